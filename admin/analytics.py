@@ -0,0 +1,245 @@
+# admin/analytics.py
+"""
+Analytics engine for the admin reports page.
+
+Everything analytics_view shows is worked out from a fixed handful of
+grouped queries, however long the selected range:
+
+- the daily order rollup (clients.models.DailyOrderStats) grouped by
+  (date, wash type, status) over the range, the equally long period
+  before it (for revenue growth) and the last week
+- completed orders in the rollup grouped by washer, for the top washers
+- one aggregate over clients and one grouped count of orders per client
+- the maintained per-washer aggregates (clients.washer_stats) for the
+  average rating and service time percentiles, over all time
+
+The daily revenue series, weekday distribution, status counts and
+service mix are all folded out of the first query's rows in Python, with
+days that had no orders filled in as zeros. Reading the rollup means a
+long range sums a few rows per day rather than every order.
+
+The page itself is a shell that fetches its widgets (WIDGETS) as JSON in
+parallel. Each widget runs only the queries it needs, over only the days
+it shows, so a slow chart never holds up the KPIs.
+"""
+import calendar
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+
+
+# Days of revenue trend shown on the chart (the end of the range)
+TREND_DAYS = 30
+TOP_WASHERS = 5
+
+
+def order_groups(start_date, end_date):
+    """
+    [(date, wash_type, status, orders, revenue)] for orders created from
+    start_date to end_date inclusive, one row per group, read from the
+    daily rollup
+    """
+    from clients.models import DailyOrderStats
+
+    return list(
+        DailyOrderStats.objects.filter(date__range=(start_date, end_date), orders__gt=0)
+        .values('date', 'wash_type', 'status')
+        .annotate(order_count=Sum('orders'), order_revenue=Sum('revenue'))
+        .order_by()
+        .values_list('date', 'wash_type', 'status', 'order_count', 'order_revenue')
+    )
+
+
+def top_washers(start_date, end_date, limit=TOP_WASHERS):
+    """Washers with the most completed orders created in the range, with their revenue"""
+    from clients.models import DailyOrderStats
+
+    return list(
+        DailyOrderStats.objects.filter(
+            status='completed',
+            date__range=(start_date, end_date),
+            washer__isnull=False
+        ).values(
+            'washer__first_name', 'washer__last_name'
+        ).annotate(
+            completed_orders=Sum('orders'),
+            total_revenue=Sum('revenue')
+        ).order_by('-completed_orders')[:limit]
+    )
+
+
+def customer_stats(start_date, end_date):
+    """(new customers in the range, all customers, customers with more than one order)"""
+    from clients.models import Client, WashOrder
+
+    counts = Client.objects.aggregate(
+        total=Count('client_id'),
+        new=Count('client_id', filter=Q(date_created__date__range=(start_date, end_date)))
+    )
+    repeat = WashOrder.objects.values('client').annotate(orders=Count('order_id')).filter(orders__gt=1).count()
+    return counts['new'], counts['total'], repeat
+
+
+def previous_period(start_date, end_date):
+    """The stretch before the range that revenue growth compares against"""
+    period_length = (end_date - start_date).days
+    return start_date - timedelta(days=period_length), start_date - timedelta(days=1)
+
+
+def summarize(groups, start_date, end_date, today, customers=(0, 0, 0), washers=(), rating=None,
+              service_time=None):
+    """
+    Everything analytics_view shows, from order_groups() rows covering the
+    range, the previous period and the last week. rating and service_time
+    are washer_stats.overall_rating() and overall_service_time(). Pure
+    Python, so a failed query can fall back to summarize([], ...).
+    """
+    service_time = service_time or {}
+    week_ago = today - timedelta(days=7)
+    prev_start, prev_end = previous_period(start_date, end_date)
+
+    daily_revenue = defaultdict(Decimal)
+    statuses = Counter()
+    services = Counter()
+    weekdays = Counter()
+    revenue_today = revenue_week = prev_period_revenue = Decimal('0.00')
+
+    for day, wash_type, status, orders, revenue in groups:
+        completed_revenue = (revenue or Decimal('0.00')) if status == 'completed' else Decimal('0.00')
+        if day == today:
+            revenue_today += completed_revenue
+        if day >= week_ago:
+            revenue_week += completed_revenue
+        if prev_start <= day <= prev_end:
+            prev_period_revenue += completed_revenue
+        if start_date <= day <= end_date:
+            daily_revenue[day] += completed_revenue
+            statuses[status] += orders
+            services[wash_type] += orders
+            weekdays[day.weekday()] += orders
+
+    revenue_period = sum(daily_revenue.values(), Decimal('0.00'))
+    total_orders = sum(statuses.values())
+    completed_orders = statuses['completed']
+    cancelled_orders = statuses['cancelled']
+
+    new_customers, total_customers, repeat_customers = customers
+    repeat_customers_percentage = repeat_customers / total_customers * 100 if total_customers > 0 else 0
+    avg_order_value = revenue_period / completed_orders if completed_orders else Decimal('0.00')
+    completion_rate = completed_orders / total_orders * 100 if total_orders > 0 else 100.0
+    cancellation_rate = cancelled_orders / total_orders * 100 if total_orders > 0 else 0.0
+
+    if prev_period_revenue > 0:
+        revenue_growth = float((revenue_period - prev_period_revenue) / prev_period_revenue * 100)
+    else:
+        revenue_growth = 100.0 if revenue_period > 0 else 0.0
+
+    # Monday first, as calendar.day_name is
+    orders_by_weekday = {calendar.day_name[i]: weekdays[i] for i in range(7)}
+    if any(orders_by_weekday.values()):
+        peak_day = max(orders_by_weekday, key=orders_by_weekday.get)
+        peak_day_orders = orders_by_weekday[peak_day]
+    else:
+        peak_day = "No data"
+        peak_day_orders = 0
+
+    # The last TREND_DAYS days of the range, with empty days as zero
+    trend_start = max(start_date, end_date - timedelta(days=TREND_DAYS - 1))
+    trend_days = [trend_start + timedelta(days=i) for i in range((end_date - trend_start).days + 1)]
+
+    service_mix = services.most_common()
+    service_labels = [wash_type.replace('_', ' ').title() for wash_type, _ in service_mix] or ['No Data Available']
+    service_counts = [count for _, count in service_mix] or [1]
+
+    return {
+        'analytics': {
+            'total_revenue': float(revenue_period),
+            'total_orders': total_orders,
+            'new_customers': new_customers,
+            'avg_order_value': float(avg_order_value),
+            'completion_rate': round(completion_rate, 1),
+            'avg_rating': rating,
+            'peak_day_orders': peak_day_orders,
+            'peak_day': peak_day,
+            'repeat_customers': round(repeat_customers_percentage, 1),
+            'avg_service_time': service_time.get('avg'),
+            'service_time_p50': service_time.get('p50'),
+            'service_time_p90': service_time.get('p90'),
+            'cancellation_rate': round(cancellation_rate, 1),
+            'revenue_growth': round(revenue_growth, 1),
+        },
+        'revenue_today': float(revenue_today),
+        'revenue_week': float(revenue_week),
+        'revenue_period': float(revenue_period),
+        'status_counts': dict(statuses),
+        'top_washers': list(washers),
+        'revenue_trend_data': [float(daily_revenue[day]) for day in trend_days],
+        'revenue_trend_labels': [day.strftime('%m/%d') for day in trend_days],
+        'service_labels': service_labels,
+        'service_counts': service_counts,
+        'daily_orders_data': list(orders_by_weekday.values()),
+        'daily_orders_labels': list(orders_by_weekday),
+    }
+
+
+def kpi_widget(start_date, end_date, today):
+    """The metric cards and insights, with today's, this week's and the period's revenue"""
+    from clients import washer_stats
+
+    prev_start, _ = previous_period(start_date, end_date)
+    groups = order_groups(
+        min(start_date, prev_start, today - timedelta(days=7)),
+        max(end_date, today)
+    )
+    results = summarize(
+        groups, start_date, end_date, today,
+        customers=customer_stats(start_date, end_date),
+        rating=washer_stats.overall_rating(),
+        service_time=washer_stats.overall_service_time()
+    )
+    return {key: results[key] for key in ('analytics', 'revenue_today', 'revenue_week', 'revenue_period')}
+
+
+def revenue_trend_widget(start_date, end_date, today):
+    """Daily completed revenue over the last TREND_DAYS days of the range"""
+    trend_start = max(start_date, end_date - timedelta(days=TREND_DAYS - 1))
+    results = summarize(order_groups(trend_start, end_date), trend_start, end_date, today)
+    return {'labels': results['revenue_trend_labels'], 'data': results['revenue_trend_data']}
+
+
+def service_mix_widget(start_date, end_date, today):
+    """Orders per wash type, most popular first"""
+    results = summarize(order_groups(start_date, end_date), start_date, end_date, today)
+    return {'labels': results['service_labels'], 'data': results['service_counts']}
+
+
+def weekday_orders_widget(start_date, end_date, today):
+    """Orders per day of the week, Monday first"""
+    results = summarize(order_groups(start_date, end_date), start_date, end_date, today)
+    return {'labels': results['daily_orders_labels'], 'data': results['daily_orders_data']}
+
+
+def top_washers_widget(start_date, end_date, today):
+    return {
+        'washers': [
+            {
+                'name': f"{washer['washer__first_name']} {washer['washer__last_name']}",
+                'completed_orders': washer['completed_orders'],
+                'total_revenue': float(washer['total_revenue'] or 0),
+            }
+            for washer in top_washers(start_date, end_date)
+        ]
+    }
+
+
+# The analytics page's widgets: name -> function(start_date, end_date, today)
+# returning a JSON-ready dict. Cache policies are in analytics_cache.
+WIDGETS = {
+    'kpis': kpi_widget,
+    'revenue_trend': revenue_trend_widget,
+    'service_mix': service_mix_widget,
+    'weekday_orders': weekday_orders_widget,
+    'top_washers': top_washers_widget,
+}
@@ -0,0 +1,177 @@
+# admin/analytics_cache.py
+"""
+Result cache for the analytics page widgets.
+
+Each widget (admin.analytics.WIDGETS) is cached per (start_date,
+end_date) under its own policy, (fresh seconds, stale seconds), with
+stale-while-revalidate:
+
+- younger than fresh: served as is
+- younger than fresh + stale: served as is, and one background thread
+  recomputes it
+- older, or computed on a previous day (today's revenue and the trend end
+  would be wrong): recomputed before answering
+
+Recomputation is single-flight per widget and range: whoever wins
+cache.add() on the lock key does it, so a room full of admins refreshing
+the same report costs the database one set of queries. On a miss the
+others wait briefly for the winner's result instead of piling on.
+
+Entries and locks live in the ANALYTICS_CACHE alias of CACHES (a file-based
+cache by default), not the per-process default cache, so every worker and
+the warm_analytics_cache command share them.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'analytics.2'
+
+# (fresh, stale) seconds per widget; ANALYTICS_WIDGET_CACHE_SECONDS overrides.
+# The KPIs move with every order, the charts are read for their shape.
+DEFAULT_POLICIES = {
+    'kpis': (60, 600),
+    'revenue_trend': (300, 3600),
+    'service_mix': (300, 3600),
+    'weekday_orders': (900, 3600),
+    'top_washers': (300, 3600),
+}
+
+# How often a waiter looks for the winner's result on a miss
+WAIT_POLL_SECONDS = 0.05
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _cache():
+    return caches[_setting('ANALYTICS_CACHE', 'analytics')]
+
+
+def policy(name):
+    """(fresh seconds, stale seconds) for a widget"""
+    policies = {**DEFAULT_POLICIES, **_setting('ANALYTICS_WIDGET_CACHE_SECONDS', {})}
+    return policies.get(name, (60, 600))
+
+
+def _key(name, start_date, end_date):
+    return f'{CACHE_PREFIX}:{name}:{start_date.isoformat()}:{end_date.isoformat()}'
+
+
+def _lock_key(name, start_date, end_date):
+    return f'{_key(name, start_date, end_date)}:lock'
+
+
+def _lock_seconds():
+    # Long enough for one slow recomputation; a crashed refresher's lock expires
+    return _setting('ANALYTICS_CACHE_LOCK_SECONDS', 30)
+
+
+def _compute(name, start_date, end_date, today):
+    """Recompute the widget and store it with the time it was computed"""
+    from .analytics import WIDGETS
+
+    started = time.perf_counter()
+    results = WIDGETS[name](start_date, end_date, today)
+    entry = {
+        'results': results,
+        'today': today,
+        'computed_at': time.time(),
+        'compute_ms': (time.perf_counter() - started) * 1000,
+    }
+    _cache().set(_key(name, start_date, end_date), entry, sum(policy(name)))
+    return entry
+
+
+def _refresh(name, start_date, end_date, today):
+    """Recompute the widget if no one else is; returns the new entry or None"""
+    lock_key = _lock_key(name, start_date, end_date)
+    if not _cache().add(lock_key, True, _lock_seconds()):
+        return None
+    try:
+        return _compute(name, start_date, end_date, today)
+    finally:
+        _cache().delete(lock_key)
+
+
+def _refresh_logged(name, start_date, end_date, today):
+    try:
+        _refresh(name, start_date, end_date, today)
+    except Exception:
+        logger.exception('Refreshing analytics %s for %s to %s failed', name, start_date, end_date)
+
+
+def _refresh_in_thread(name, start_date, end_date, today):
+    try:
+        _refresh_logged(name, start_date, end_date, today)
+    finally:
+        connection.close()
+
+
+def _refresh_in_background(name, start_date, end_date, today):
+    if not _setting('ANALYTICS_CACHE_BACKGROUND_REFRESH', True):
+        # Inline (tests, or single-threaded servers); the stale entry is still what's served
+        _refresh_logged(name, start_date, end_date, today)
+        return
+    thread = threading.Thread(
+        target=_refresh_in_thread, args=(name, start_date, end_date, today),
+        name=f'analytics-{name}-refresh', daemon=True
+    )
+    thread.start()
+
+
+def _wait_for(name, start_date, end_date, today):
+    """On a miss another request is computing; wait for its entry, or None"""
+    deadline = time.monotonic() + _setting('ANALYTICS_CACHE_WAIT_SECONDS', 5)
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_POLL_SECONDS)
+        entry = _cache().get(_key(name, start_date, end_date))
+        if entry is not None and entry['today'] == today:
+            return entry
+        if _cache().get(_lock_key(name, start_date, end_date)) is None:
+            break
+    return None
+
+
+def get_widget(name, start_date, end_date, today=None):
+    """
+    (results, age in seconds, state, compute ms) for the widget, where state
+    is 'fresh', 'stale' (served while a refresh runs) or 'miss' (computed
+    now); compute ms is how long its last computation took
+    """
+    today = today or timezone.localdate()
+    entry = _cache().get(_key(name, start_date, end_date))
+
+    if entry is not None and entry['today'] == today:
+        age = time.time() - entry['computed_at']
+        if age <= policy(name)[0]:
+            return entry['results'], age, 'fresh', entry['compute_ms']
+        _refresh_in_background(name, start_date, end_date, today)
+        return entry['results'], age, 'stale', entry['compute_ms']
+
+    entry = _refresh(name, start_date, end_date, today) or _wait_for(name, start_date, end_date, today)
+    if entry is None:
+        # The other request failed or is too slow; compute without the lock
+        entry = _compute(name, start_date, end_date, today)
+    return entry['results'], time.time() - entry['computed_at'], 'miss', entry['compute_ms']
+
+
+def warm(name, start_date, end_date, today=None, force=False):
+    """Make sure the widget is cached and fresh; returns the state before warming"""
+    today = today or timezone.localdate()
+    entry = _cache().get(_key(name, start_date, end_date))
+    if entry is not None and entry['today'] == today and not force:
+        if time.time() - entry['computed_at'] <= policy(name)[0]:
+            return 'fresh'
+    state = 'stale' if entry is not None else 'miss'
+    _compute(name, start_date, end_date, today)
+    return state
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from clients.models import Client, Vehicle, WashOrder
+from clients.models import Client, DailyOrderStats, Vehicle
 from washers.models import Washer
 from django.utils import timezone
 from datetime import timedelta
@@ -59,14 +59,18 @@ class Command(BaseCommand):
         self.stdout.write(f'  Available: {available_washers}')
         self.stdout.write(f'  Busy: {busy_washers}')
 
-        # Order statistics
-        total_orders = WashOrder.objects.count()
-        
-        # Orders by status
-        pending_orders = WashOrder.objects.filter(status='pending').count()
-        in_progress_orders = WashOrder.objects.filter(status='in_progress').count()
-        completed_orders = WashOrder.objects.filter(status='completed').count()
-        cancelled_orders = WashOrder.objects.filter(status='cancelled').count()
+        # Order statistics, per status from the daily rollup
+        from django.db.models import Sum
+        by_status = dict(
+            DailyOrderStats.objects.values('status').annotate(
+                order_count=Sum('orders')
+            ).order_by().values_list('status', 'order_count')
+        )
+        total_orders = sum(by_status.values())
+        pending_orders = by_status.get('pending', 0)
+        in_progress_orders = by_status.get('in_progress', 0)
+        completed_orders = by_status.get('completed', 0)
+        cancelled_orders = by_status.get('cancelled', 0)
 
         self.stdout.write('\n📦 Order Statistics:')
         self.stdout.write(f'  Total Orders: {total_orders}')
@@ -77,7 +81,9 @@ class Command(BaseCommand):
 
         # Recent activity (last 7 days)
         week_ago = timezone.now() - timedelta(days=7)
-        recent_orders = WashOrder.objects.filter(created_at__gte=week_ago).count()
+        recent_orders = DailyOrderStats.objects.filter(
+            date__gt=timezone.localdate() - timedelta(days=7)
+        ).aggregate(total=Sum('orders'))['total'] or 0
         recent_clients = Client.objects.filter(date_created__gte=week_ago).count()
 
         self.stdout.write('\n📈 Recent Activity (Last 7 Days):')
@@ -86,14 +92,11 @@ class Command(BaseCommand):
 
         # Revenue statistics
         if total_orders > 0:
-            from django.db.models import Sum, Avg
-            total_revenue = WashOrder.objects.filter(
+            total_revenue = DailyOrderStats.objects.filter(
                 status='completed'
-            ).aggregate(total=Sum('price'))['total'] or 0
+            ).aggregate(total=Sum('revenue'))['total'] or 0
             
-            avg_order_value = WashOrder.objects.filter(
-                status='completed'
-            ).aggregate(avg=Avg('price'))['avg'] or 0
+            avg_order_value = total_revenue / completed_orders if completed_orders else 0
 
             self.stdout.write('\n💰 Revenue Statistics:')
             self.stdout.write(f'  Total Revenue: ${total_revenue:.2f}')
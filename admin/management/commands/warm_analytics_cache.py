@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from admin import analytics_cache
+from admin.analytics import WIDGETS
+
+
+class Command(BaseCommand):
+    help = 'Pre-compute the analytics page widgets for the common date ranges (run it from cron or after a deploy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ranges',
+            default='today,7d,30d',
+            help="Comma-separated ranges ending today: 'today' or '<days>d' (default: today,7d,30d)"
+        )
+        parser.add_argument('--force', action='store_true', help='Recompute ranges that are still fresh')
+
+    def parse_range(self, value, today):
+        # Same ranges the page asks for: 'today', the week button (7d) and the default month (30d)
+        if value == 'today':
+            return today, today
+        if value.endswith('d') and value[:-1].isdigit():
+            return today - timedelta(days=int(value[:-1])), today
+        raise CommandError(f"Unknown range {value!r}; use 'today' or '<days>d'.")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        ranges = [value.strip() for value in options['ranges'].split(',') if value.strip()]
+        if not ranges:
+            raise CommandError('No ranges given.')
+
+        for value in ranges:
+            start_date, end_date = self.parse_range(value, today)
+            states = [
+                analytics_cache.warm(name, start_date, end_date, today, force=options['force'])
+                for name in WIDGETS
+            ]
+            computed = len(states) - states.count('fresh')
+            action = f'{computed} widget(s) computed' if computed else 'already fresh'
+            self.stdout.write(f'  {value}: {start_date} to {end_date} {action}')
+
+        self.stdout.write(self.style.SUCCESS(f'Analytics cache warm for {len(ranges)} range(s).'))
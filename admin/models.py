@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from clients.models import Client
 from washers.models import Washer
 from django.utils import timezone
@@ -32,16 +33,10 @@ class SystemStats:
         try:
             stats['total_washers'] = Washer.objects.count()
             
-            # Get truly available washers (those without active orders)
-            from clients.models import WashOrder
-            washers_with_active_orders = WashOrder.objects.filter(
-                status__in=['assigned', 'in_progress']
-            ).values_list('washer_id', flat=True)
-            
+            # Get truly available washers (those with room for another order)
             stats['available_washers'] = Washer.objects.filter(
-                is_available=True
-            ).exclude(
-                washer_id__in=washers_with_active_orders
+                is_available=True,
+                active_order_count__lt=F('max_concurrent_orders')
             ).count()
             
         except Exception as e:
@@ -54,12 +49,19 @@ class SystemStats:
             print(f"Error getting vehicles count: {e}")
             
         try:
-            from clients.models import WashOrder, Appointment
+            from django.db.models import Sum
+            from clients.models import WashOrder, Appointment, DailyOrderStats
             
-            # Count all orders
-            stats['total_orders'] = WashOrder.objects.count()
-            stats['pending_orders'] = WashOrder.objects.filter(status='pending').count()
-            stats['in_progress_orders'] = WashOrder.objects.filter(status='in_progress').count()
+            # Order counts and revenue per status from the daily rollup
+            by_status = {
+                status: (orders or 0, revenue or 0)
+                for status, orders, revenue in DailyOrderStats.objects.values('status').annotate(
+                    order_count=Sum('orders'), order_revenue=Sum('revenue')
+                ).order_by().values_list('status', 'order_count', 'order_revenue')
+            }
+            stats['total_orders'] = sum(orders for orders, _ in by_status.values())
+            stats['pending_orders'] = by_status.get('pending', (0, 0))[0]
+            stats['in_progress_orders'] = by_status.get('in_progress', (0, 0))[0]
             stats['completed_today'] = WashOrder.objects.filter(
                 status='completed',
                 completed_at__date=timezone.now().date()
@@ -74,9 +76,7 @@ class SystemStats:
             # Add scheduled appointments to pending orders count
             stats['scheduled_appointments'] = scheduled_appointments
             
-            # Calculate total revenue from completed orders
-            completed_orders = WashOrder.objects.filter(status='completed')
-            stats['total_revenue'] = sum(order.price for order in completed_orders if order.price)
+            stats['total_revenue'] = by_status.get('completed', (0, 0))[1]
             
             print(f"DEBUG: Orders stats - Total: {stats['total_orders']}, Pending: {stats['pending_orders']}, Scheduled: {scheduled_appointments}")
             
@@ -1,3 +1,311 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from clients import rollups, washer_stats
+from clients.models import Review, WashOrder
+from clients.tests import FixtureMixin
+from . import analytics_cache
+from .analytics import (
+    WIDGETS, kpi_widget, order_groups, revenue_trend_widget, service_mix_widget, summarize,
+    top_washers_widget, weekday_orders_widget
+)
+
+
+# The analytics widgets' file-based cache, in a directory of its own for the tests
+ANALYTICS_CACHE_DIR = tempfile.mkdtemp(prefix='analytics-cache-')
+temp_analytics_cache = override_settings(CACHES={
+    **settings.CACHES,
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': ANALYTICS_CACHE_DIR,
+    },
+})
+
+
+def tearDownModule():
+    shutil.rmtree(ANALYTICS_CACHE_DIR, ignore_errors=True)
+
+
+@temp_analytics_cache
+class AnalyticsEngineTests(FixtureMixin, TestCase):
+    """The analytics page is a fixed handful of grouped queries over the daily rollup"""
+
+    def setUp(self):
+        cache.clear()
+        analytics_cache._cache().clear()
+        self.today = timezone.localdate()
+        self.client_obj, self.vehicle = self.make_client('stats')
+        self.washer = self.make_washer('top')
+
+    def order(self, days_ago, wash_type='basic', status='completed', price='15.00', washer=None):
+        order = WashOrder.objects.create(
+            client=self.client_obj, vehicle=self.vehicle, wash_type=wash_type,
+            status=status, price=Decimal(price), washer=washer
+        )
+        created = timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), time(12, 0)))
+        WashOrder.objects.filter(order_id=order.order_id).update(created_at=created)
+        return order
+
+    def roll_up(self):
+        # The orders were back-dated behind the rollup's back
+        rollups.rebuild(self.today - timedelta(days=800), self.today)
+
+    def test_summary_matches_the_orders(self):
+        self.order(0, 'premium', price='25.00', washer=self.washer)
+        self.order(0, 'basic', status='cancelled')
+        self.order(2, 'deluxe', price='35.00', washer=self.washer)
+        self.order(2, 'basic', status='pending')
+        # Previous period only
+        self.order(12, 'basic', price='30.00')
+        self.roll_up()
+
+        start = self.today - timedelta(days=6)
+        kpis = kpi_widget(start, self.today, self.today)
+        analytics = kpis['analytics']
+
+        self.assertEqual(analytics['total_orders'], 4)
+        self.assertEqual(analytics['total_revenue'], 60.0)
+        self.assertEqual(analytics['avg_order_value'], 30.0)
+        self.assertEqual(analytics['completion_rate'], 50.0)
+        self.assertEqual(analytics['cancellation_rate'], 25.0)
+        self.assertEqual(analytics['revenue_growth'], 100.0)
+        self.assertEqual(kpis['revenue_today'], 25.0)
+        self.assertEqual(kpis['revenue_week'], 60.0)
+        results = summarize(order_groups(start, self.today), start, self.today, self.today)
+        self.assertEqual(results['status_counts'], {'completed': 2, 'cancelled': 1, 'pending': 1})
+
+        # One point per day, empty days included
+        trend = revenue_trend_widget(start, self.today, self.today)['data']
+        self.assertEqual(len(trend), 7)
+        self.assertEqual(trend[-1], 25.0)
+        self.assertEqual(trend[-3], 35.0)
+        self.assertEqual(sum(trend), 60.0)
+
+        mix = service_mix_widget(start, self.today, self.today)
+        self.assertEqual(mix['labels'][0], 'Basic')
+        self.assertEqual(dict(zip(mix['labels'], mix['data'])), {'Basic': 2, 'Premium': 1, 'Deluxe': 1})
+        by_weekday = weekday_orders_widget(start, self.today, self.today)
+        weekdays = dict(zip(by_weekday['labels'], by_weekday['data']))
+        self.assertEqual(weekdays[self.today.strftime('%A')], 2)
+        self.assertEqual(sum(weekdays.values()), 4)
+        self.assertEqual(top_washers_widget(start, self.today, self.today)['washers'], [
+            {'name': 'Top Washer', 'completed_orders': 2, 'total_revenue': 60.0}
+        ])
+
+    def test_empty_summary_has_safe_defaults(self):
+        results = summarize([], self.today - timedelta(days=6), self.today, self.today)
+        self.assertEqual(results['analytics']['peak_day'], 'No data')
+        self.assertEqual(results['analytics']['completion_rate'], 100.0)
+        self.assertEqual(results['revenue_trend_data'], [0.0] * 7)
+        self.assertEqual(results['service_labels'], ['No Data Available'])
+
+    def test_rating_and_service_time_come_from_the_washers(self):
+        empty = kpi_widget(self.today, self.today, self.today)['analytics']
+        self.assertIsNone(empty['avg_rating'])
+        self.assertIsNone(empty['avg_service_time'])
+
+        for rating, minutes in ((5, 20), (4, 30), (3, 70)):
+            order = self.order(0, washer=self.washer)
+            Review.objects.create(
+                client=self.client_obj, wash_order=order, washer=self.washer, rating=rating, job_id=order.order_id
+            )
+            washer_stats.adjust_service_time(self.washer.washer_id, minutes)
+        analytics = kpi_widget(self.today, self.today, self.today)['analytics']
+        self.assertEqual(analytics['avg_rating'], 4.0)
+        self.assertEqual(
+            (analytics['avg_service_time'], analytics['service_time_p50'], analytics['service_time_p90']),
+            (40, 30, 70)
+        )
+
+    def test_washer_list_cost_does_not_grow_with_the_washers(self):
+        admin = User.objects.create_user('washerlist', 'washerlist@example.com', 'pw', is_staff=True)
+        self.client.force_login(admin)
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('carwash_admin:manage_washers'))
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries)
+
+        order = self.order(0, washer=self.washer)
+        Review.objects.create(client=self.client_obj, wash_order=order, washer=self.washer, rating=4, job_id=1)
+        self.roll_up()
+        one = list_queries()
+        for i in range(5):
+            self.make_washer(f'more{i}')
+        self.assertEqual(list_queries(), one)
+        self.washer.refresh_from_db()
+        self.assertEqual(self.washer.average_rating, 4.0)
+
+    def test_page_cost_does_not_grow_with_the_range(self):
+        for days_ago in range(0, 400, 9):
+            self.order(days_ago, ['basic', 'premium', 'deluxe'][days_ago % 3], washer=self.washer)
+        self.roll_up()
+        admin = User.objects.create_user('analyst', 'analyst@example.com', 'pw', is_staff=True)
+        self.client.force_login(admin)
+
+        def widget_queries(days):
+            params = {'start_date': (self.today - timedelta(days=days)).isoformat(), 'end_date': self.today.isoformat()}
+            queries = {}
+            for name in WIDGETS:
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.get(reverse('carwash_admin:analytics_widget', args=[name]), params)
+                self.assertEqual(response.status_code, 200)
+                queries[name] = len(ctx.captured_queries)
+            return queries
+
+        week, year = widget_queries(7), widget_queries(365)
+        self.assertEqual(week, year)
+        self.assertLessEqual(sum(year.values()), 20)
+
+    def test_widgets_match_the_summary(self):
+        self.order(0, 'premium', price='25.00', washer=self.washer)
+        self.order(3, 'basic', status='cancelled')
+        self.roll_up()
+        start = self.today - timedelta(days=6)
+        results = summarize(order_groups(start, self.today), start, self.today, self.today)
+
+        trend = revenue_trend_widget(start, self.today, self.today)
+        self.assertEqual(trend, {'labels': results['revenue_trend_labels'], 'data': results['revenue_trend_data']})
+        self.assertEqual(service_mix_widget(start, self.today, self.today)['data'], results['service_counts'])
+        self.assertEqual(weekday_orders_widget(start, self.today, self.today)['data'], results['daily_orders_data'])
+        self.assertEqual(kpi_widget(start, self.today, self.today)['revenue_period'], results['revenue_period'])
+
+
+@override_settings(ANALYTICS_CACHE_BACKGROUND_REFRESH=False, ANALYTICS_CACHE_WAIT_SECONDS=0.1)
+@temp_analytics_cache
+class AnalyticsCacheTests(FixtureMixin, TestCase):
+    """Analytics widgets are served from the cache and refreshed once per range"""
+
+    def setUp(self):
+        analytics_cache._cache().clear()
+        self.today = timezone.localdate()
+        self.start = self.today - timedelta(days=7)
+        _, self.vehicle = self.make_client('cache')
+
+    def add_order(self):
+        WashOrder.objects.create(
+            client=self.vehicle.client, vehicle=self.vehicle, status='completed', price=Decimal('20.00')
+        )
+        rollups.rebuild(self.today, self.today)
+
+    def age_entry(self, seconds, name='kpis'):
+        key = analytics_cache._key(name, self.start, self.today)
+        entry = analytics_cache._cache().get(key)
+        entry['computed_at'] -= seconds
+        analytics_cache._cache().set(key, entry)
+
+    def get(self):
+        with CaptureQueriesContext(connection) as ctx:
+            results, age, state, _ = analytics_cache.get_widget('kpis', self.start, self.today, self.today)
+        return results['analytics']['total_orders'], state, len(ctx.captured_queries)
+
+    def test_fresh_entry_costs_no_queries(self):
+        self.add_order()
+        orders, state, _ = self.get()
+        self.assertEqual((orders, state), (1, 'miss'))
+        self.add_order()
+        self.assertEqual(self.get(), (1, 'fresh', 0))
+
+    def test_stale_entry_is_served_while_it_refreshes(self):
+        self.get()
+        self.add_order()
+        self.age_entry(120)
+        orders, state, queries = self.get()
+        self.assertEqual((orders, state), (0, 'stale'))
+        self.assertGreater(queries, 0)
+        self.assertEqual(self.get(), (1, 'fresh', 0))
+
+    def test_one_refresh_per_range(self):
+        self.get()
+        self.age_entry(120)
+        # Another request is already refreshing this range
+        analytics_cache._cache().add(analytics_cache._lock_key('kpis', self.start, self.today), True, 30)
+        self.assertEqual(self.get(), (0, 'stale', 0))
+
+    def test_entry_from_yesterday_is_recomputed(self):
+        self.get()
+        self.add_order()
+        # revenue_today and the trend would be a day out
+        key = analytics_cache._key('kpis', self.start, self.today)
+        entry = analytics_cache._cache().get(key)
+        entry['today'] = self.today - timedelta(days=1)
+        analytics_cache._cache().set(key, entry)
+        orders, state, _ = self.get()
+        self.assertEqual((orders, state), (1, 'miss'))
+
+    @override_settings(ANALYTICS_WIDGET_CACHE_SECONDS={'service_mix': (10, 60)})
+    def test_each_widget_has_its_own_policy(self):
+        self.assertEqual(analytics_cache.policy('service_mix'), (10, 60))
+        self.assertEqual(analytics_cache.policy('kpis'), analytics_cache.DEFAULT_POLICIES['kpis'])
+        for name in ('kpis', 'service_mix'):
+            analytics_cache.get_widget(name, self.start, self.today, self.today)
+            self.age_entry(30, name)
+        self.assertEqual(analytics_cache.get_widget('kpis', self.start, self.today, self.today)[2], 'fresh')
+        self.assertEqual(analytics_cache.get_widget('service_mix', self.start, self.today, self.today)[2], 'stale')
+
+    def test_shell_runs_no_analytics_queries(self):
+        admin = User.objects.create_user('shellanalyst', 'shell@example.com', 'pw', is_staff=True)
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('carwash_admin:analytics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'daily_order_stats' in q['sql']])
+        for name in WIDGETS:
+            self.assertContains(response, reverse('carwash_admin:analytics_widget', args=[name]))
+
+    def test_widget_reports_cache_age_and_timing(self):
+        admin = User.objects.create_user('cachedanalyst', 'cached@example.com', 'pw', is_staff=True)
+        self.client.force_login(admin)
+        url = reverse('carwash_admin:analytics_widget', args=['kpis'])
+        params = {'start_date': self.start.isoformat(), 'end_date': self.today.isoformat()}
+
+        response = self.client.get(url, params)
+        self.assertEqual(response['X-Analytics-Cache'], 'miss')
+        self.assertIn('compute;dur=', response['Server-Timing'])
+        self.assertEqual(response.json()['analytics']['total_orders'], 0)
+        self.age_entry(30)
+        response = self.client.get(url, params)
+        self.assertEqual(response['X-Analytics-Cache'], 'fresh')
+        self.assertEqual(response['X-Analytics-Cache-Age'], '30')
+        self.assertIn('max-age=30', response['Cache-Control'])
+
+        self.assertEqual(self.client.get(reverse('carwash_admin:analytics_widget', args=['nope'])).status_code, 404)
+
+    def test_warm_command_fills_the_common_ranges(self):
+        out = io.StringIO()
+        call_command('warm_analytics_cache', stdout=out)
+        self.assertIn('3 range(s)', out.getvalue())
+        self.assertEqual(self.get(), (0, 'fresh', 0))
+        for start in (self.today, self.today - timedelta(days=30)):
+            for name in WIDGETS:
+                self.assertIsNotNone(analytics_cache._cache().get(analytics_cache._key(name, start, self.today)))
+
+        out = io.StringIO()
+        call_command('warm_analytics_cache', '--ranges', '7d', stdout=out)
+        self.assertIn('already fresh', out.getvalue())
+
+    def test_warmed_entries_are_shared_between_processes(self):
+        call_command('warm_analytics_cache', '--ranges', 'today', stdout=io.StringIO())
+        key = analytics_cache._key('kpis', self.today, self.today)
+        # A fresh connection to the alias, as another worker process would open
+        other_worker = caches.create_connection(settings.ANALYTICS_CACHE)
+        self.assertEqual(other_worker.get(key)['today'], self.today)
+        self.assertIsNone(cache.get(key))
+        # and the single-flight lock one worker takes is held for all of them
+        lock_key = analytics_cache._lock_key('kpis', self.start, self.today)
+        self.assertTrue(other_worker.add(lock_key, True, 30))
+        self.assertFalse(analytics_cache._cache().add(lock_key, True, 30))
@@ -31,6 +31,7 @@ urlpatterns = [
     
     # Analytics
     path('analytics/', views.analytics_view, name='analytics'),
+    path('analytics/widgets/<slug:name>/', views.analytics_widget_view, name='analytics_widget'),
     
     # Dashboard (default)
     path('', views.admin_dashboard_view, name='dashboard'),
@@ -1,3 +1,5 @@
+import logging
+
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -8,6 +10,9 @@ from django.utils.decorators import method_decorator
 from .forms import AdminLoginForm
 
 
+logger = logging.getLogger(__name__)
+
+
 def is_admin(user):
     """Check if user is an admin (staff member)"""
     return user.is_authenticated and user.is_staff
@@ -51,6 +56,7 @@ def admin_dashboard_view(request):
     from .models import SystemStats
     from clients.models import WashOrder
     from washers.models import Washer
+    from django.db.models import F
     
     # Get dashboard statistics
     stats = SystemStats.get_dashboard_stats()
@@ -61,18 +67,10 @@ def admin_dashboard_view(request):
         status='pending'
     ).select_related('client', 'vehicle').order_by('-created_at')[:6]
     
-    # Get available washers for assignment (those without active orders)
-    from django.db.models import Q
-    
-    # Get washers who don't have any active orders
-    washers_with_active_orders = WashOrder.objects.filter(
-        status__in=['assigned', 'in_progress']
-    ).values_list('washer_id', flat=True)
-    
+    # Get available washers for assignment (those with room for another order)
     available_washers = Washer.objects.filter(
-        is_available=True
-    ).exclude(
-        washer_id__in=washers_with_active_orders
+        is_available=True,
+        active_order_count__lt=F('max_concurrent_orders')
     ).order_by('first_name')
     
     context = {
@@ -141,44 +139,38 @@ def delete_client_view(request, client_id):
 def manage_washers_view(request):
     """View to manage washers - list, view, delete"""
     from washers.models import Washer
-    from clients.models import WashOrder
-    from django.db.models import Count, Q
+    from clients import washer_stats
+    from clients.models import DailyOrderStats
+    from django.db.models import F, Q, Sum
     
     washers = Washer.objects.all().order_by('-date_hired')
     
-    # Calculate statistics for each washer
+    # Per-washer statistics from the maintained aggregates, two queries for
+    # the whole list: completed orders from the daily rollup and service
+    # times from the histogram; ratings are counters on the washer itself
+    completed = dict(
+        DailyOrderStats.objects.filter(status='completed', washer__isnull=False)
+        .values('washer_id').annotate(total=Sum('orders')).values_list('washer_id', 'total')
+    )
+    service_times = washer_stats.service_times()
+    
     for washer in washers:
-        # Get completed orders count
-        washer.completed_orders = WashOrder.objects.filter(
-            washer=washer, 
-            status='completed'
-        ).count()
-        
-        # Get active orders count
-        washer.active_orders = WashOrder.objects.filter(
-            washer=washer,
-            status__in=['assigned', 'in_progress']
-        ).count()
-        
-        # Set a default rating (you can implement a real rating system later)
-        washer.rating = 4.8  # Default rating
+        washer.completed_orders = completed.get(washer.washer_id, 0)
+        washer.active_orders = washer.active_order_count
+        washer.rating = washer.average_rating
+        washer.service_time = service_times.get(washer.washer_id) or washer_stats.summarize_service_times([])
     
     # Calculate overall statistics
     total_washers = washers.count()
     
     # Get washers with active orders (busy)
-    washers_with_active_orders = WashOrder.objects.filter(
-        status__in=['assigned', 'in_progress']
-    ).values_list('washer_id', flat=True)
+    busy_washers = washers.filter(active_order_count__gt=0).count()
     
-    busy_washers = len(set(washers_with_active_orders))  # Count unique busy washers
-    
-    # Available washers are those who are active, available, and don't have active orders
+    # Available washers are those who are active, available, and have room for another order
     available_washers = washers.filter(
         is_available=True, 
-        status='active'
-    ).exclude(
-        washer_id__in=washers_with_active_orders
+        status='active',
+        active_order_count__lt=F('max_concurrent_orders')
     ).count()
     
     # Offline washers are those who are inactive or on break
@@ -233,19 +225,22 @@ def delete_washer_view(request, washer_id):
 def toggle_washer_status_view(request, washer_id):
     """Toggle washer availability status and auto-assign pending orders"""
     from washers.models import Washer
-    from clients.utils import auto_assign_pending_orders
+    from clients.events import flush_after_commit
     
     try:
         washer = Washer.objects.get(washer_id=washer_id)
         washer.is_available = not washer.is_available
-        washer.save()
+        washer.save(update_fields=['is_available'])
         
         status = "available" if washer.is_available else "unavailable"
         messages.success(request, f'Washer {washer.first_name} {washer.last_name} is now {status}.')
         
-        # If washer is now available, try to auto-assign pending orders
+        # If washer is now available, run the queued dispatch tick right away
+        # (once the change has committed, which is when the tick is queued)
         if washer.is_available:
-            assigned_count = auto_assign_pending_orders()
+            reports = flush_after_commit()
+            report = reports[0] if reports else None
+            assigned_count = len(report['assigned']) if report else 0
             if assigned_count > 0:
                 messages.success(request, f'Automatically assigned {assigned_count} pending order(s) to available washers.')
     except Washer.DoesNotExist:
@@ -393,8 +388,8 @@ def manage_orders_view(request):
 def assign_washer_view(request, order_id):
     """Assign a washer to an order"""
     from clients.models import WashOrder
+    from clients.utils import claim_order
     from washers.models import Washer
-    from django.utils import timezone
     
     try:
         order = WashOrder.objects.get(order_id=order_id)
@@ -405,28 +400,19 @@ def assign_washer_view(request, order_id):
                 try:
                     washer = Washer.objects.get(washer_id=washer_id)
                     
-                    # Check if washer already has an active order
-                    active_orders = WashOrder.objects.filter(
-                        washer=washer,
-                        status__in=['assigned', 'in_progress']
-                    ).count()
-                    
-                    if active_orders > 0:
+                    # Assign only if the order is still pending and the washer has capacity
+                    if claim_order(order.order_id, washer.washer_id):
+                        # Don't mark washer as unavailable - they can get new orders after completing current one
+                        messages.success(request, f'Order #{order.order_id} assigned to {washer.full_name}.')
+                    elif order.status != 'pending':
+                        messages.error(request, f'Order #{order.order_id} is no longer pending.')
+                    else:
                         messages.error(request, 
                             f'Cannot assign order to {washer.full_name}. '
-                            f'This washer already has {active_orders} active order(s). '
+                            f'This washer is already working {washer.max_concurrent_orders} order(s), '
+                            f'the most they can handle at once. '
                             f'Please wait for current orders to be completed.'
                         )
-                    else:
-                        # Assign washer to order
-                        order.washer = washer
-                        order.status = 'assigned'
-                        order.assigned_at = timezone.now()
-                        order.save()
-                        
-                        # Don't mark washer as unavailable - they can get new orders after completing current one
-                        
-                        messages.success(request, f'Order #{order.order_id} assigned to {washer.full_name}.')
                         
                 except Washer.DoesNotExist:
                     messages.error(request, 'Washer not found.')
@@ -444,44 +430,42 @@ def assign_washer_view(request, order_id):
 def cancel_order_view(request, order_id):
     """Cancel an order and auto-assign pending orders"""
     from clients.models import WashOrder
-    from clients.utils import auto_assign_pending_orders
+    from clients.events import flush_after_commit
+    from clients.transitions import cancel_order
+    from washers.models import Washer
     
     try:
-        order = WashOrder.objects.get(order_id=order_id)
+        transition = cancel_order(order_id)
         
-        # Check if order can be cancelled
-        if order.status == 'cancelled':
-            messages.warning(request, f'Order #{order.order_id} is already cancelled.')
-        elif order.status == 'completed':
-            messages.error(request, f'Cannot cancel completed order #{order.order_id}.')
-        else:
-            # Track if washer was freed up
-            washer_freed = False
-            
-            # If order was assigned, make washer available again
-            if order.washer and order.status in ['assigned', 'in_progress']:
-                order.washer.is_available = True
-                order.washer.save()
-                washer_freed = True
+        if transition:
+            # If the order was being worked, make washer available again
+            if transition.frees_capacity:
+                Washer.objects.filter(washer_id=transition.washer_id, is_available=False).update(is_available=True)
             
             # Get cancellation reason if provided
             cancellation_reason = request.POST.get('cancellation_reason', '')
-            
-            order.status = 'cancelled'
             # You could add a cancellation_reason field to the model if needed
-            # order.cancellation_reason = cancellation_reason
-            order.save()
             
             if cancellation_reason:
-                messages.success(request, f'Order #{order.order_id} has been cancelled. Reason: {cancellation_reason}')
+                messages.success(request, f'Order #{order_id} has been cancelled. Reason: {cancellation_reason}')
             else:
-                messages.success(request, f'Order #{order.order_id} has been cancelled.')
+                messages.success(request, f'Order #{order_id} has been cancelled.')
             
-            # If a washer was freed up, try to auto-assign pending orders
-            if washer_freed:
-                assigned_count = auto_assign_pending_orders()
+            # If a washer was freed up, run the queued dispatch tick right away
+            # (once the cancellation has committed, which is when it is queued)
+            if transition.frees_capacity:
+                reports = flush_after_commit()
+                report = reports[0] if reports else None
+                assigned_count = len(report['assigned']) if report else 0
                 if assigned_count > 0:
                     messages.success(request, f'Automatically assigned {assigned_count} pending order(s) to available washers.')
+        else:
+            # Only read the order to explain why it couldn't be cancelled
+            order = WashOrder.objects.get(order_id=order_id)
+            if order.status == 'cancelled':
+                messages.warning(request, f'Order #{order.order_id} is already cancelled.')
+            else:
+                messages.error(request, f'Cannot cancel {order.status} order #{order.order_id}.')
         
     except WashOrder.DoesNotExist:
         messages.error(request, 'Order not found.')
@@ -496,30 +480,20 @@ def cancel_order_view(request, order_id):
         return redirect('carwash_admin:manage_orders')
 
 
-@login_required(login_url='/carwash-admin/login/')
-@user_passes_test(is_admin, login_url='/carwash-admin/login/')
-def analytics_view(request):
-    """Analytics and reporting view with robust error handling"""
-    from clients.models import WashOrder, Client, Vehicle
-    from washers.models import Washer
+def _analytics_range(request):
+    """(start_date, end_date, today) from the start_date/end_date parameters, the last 30 days by default"""
+    from datetime import datetime
     from django.utils import timezone
-    from django.db.models import Count, Sum, Avg, Q
-    from decimal import Decimal
-    import calendar
-    
-    # Get date range from request parameters or use defaults
-    start_date_str = request.GET.get('start_date')
-    end_date_str = request.GET.get('end_date')
     
     # Default date ranges
-    today = timezone.now().date()
-    week_ago = today - timezone.timedelta(days=7)
+    today = timezone.localdate()
     month_ago = today - timezone.timedelta(days=30)
     
     # Parse custom date range if provided
+    start_date_str = request.GET.get('start_date')
+    end_date_str = request.GET.get('end_date')
     try:
         if start_date_str and end_date_str:
-            from datetime import datetime
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
         else:
@@ -534,267 +508,68 @@ def analytics_view(request):
     if start_date > end_date:
         start_date, end_date = end_date, start_date
     
-    # Revenue analytics with safe defaults
-    try:
-        revenue_today = WashOrder.objects.filter(
-            created_at__date=today, status='completed'
-        ).aggregate(total=Sum('price'))['total'] or Decimal('0.00')
-        
-        revenue_week = WashOrder.objects.filter(
-            created_at__date__gte=week_ago, status='completed'
-        ).aggregate(total=Sum('price'))['total'] or Decimal('0.00')
-        
-        revenue_period = WashOrder.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
-            status='completed'
-        ).aggregate(total=Sum('price'))['total'] or Decimal('0.00')
-    except Exception as e:
-        print(f"Revenue calculation error: {e}")
-        revenue_today = revenue_week = revenue_period = Decimal('0.00')
-    
-    # Order analytics with safe defaults
-    try:
-        total_orders = WashOrder.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
-        ).count()
-        
-        completed_orders = WashOrder.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
-            status='completed'
-        ).count()
-        
-        cancelled_orders = WashOrder.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
-            status='cancelled'
-        ).count()
-    except Exception as e:
-        print(f"Order count error: {e}")
-        total_orders = completed_orders = cancelled_orders = 0
-    
-    # Customer analytics with safe defaults
-    try:
-        new_customers = Client.objects.filter(
-            date_created__date__gte=start_date,
-            date_created__date__lte=end_date
-        ).count()
-        
-        total_customers = Client.objects.count()
-        
-        # Repeat customers analysis
-        repeat_customers_count = Client.objects.annotate(
-            order_count=Count('washorder')
-        ).filter(order_count__gt=1).count()
-        
-        repeat_customers_percentage = (
-            (repeat_customers_count / total_customers * 100) 
-            if total_customers > 0 else 0
-        )
-    except Exception as e:
-        print(f"Customer analytics error: {e}")
-        new_customers = total_customers = repeat_customers_count = 0
-        repeat_customers_percentage = 0
-    
-    # Calculate rates with safe division
-    try:
-        avg_order_value = WashOrder.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
-            status='completed'
-        ).aggregate(avg=Avg('price'))['avg'] or Decimal('0.00')
-        
-        completion_rate = (
-            (completed_orders / total_orders * 100) 
-            if total_orders > 0 else 100.0
-        )
-        
-        cancellation_rate = (
-            (cancelled_orders / total_orders * 100) 
-            if total_orders > 0 else 0.0
-        )
-    except Exception as e:
-        print(f"Rate calculation error: {e}")
-        avg_order_value = Decimal('0.00')
-        completion_rate = cancellation_rate = 0.0
-    
-    # Peak day analysis with fallbacks
-    try:
-        orders_by_weekday = {}
-        for i in range(7):  # 0=Monday, 6=Sunday
-            # Django week_day: 1=Sunday, 2=Monday, ..., 7=Saturday
-            django_day_num = (i + 2) % 7
-            if django_day_num == 0:
-                django_day_num = 7
-                
-            day_orders = WashOrder.objects.filter(
-                created_at__date__gte=start_date,
-                created_at__date__lte=end_date,
-                created_at__week_day=django_day_num
-            ).count()
-            orders_by_weekday[calendar.day_name[i]] = day_orders
-        
-        if any(orders_by_weekday.values()):
-            peak_day = max(orders_by_weekday, key=orders_by_weekday.get)
-            peak_day_orders = orders_by_weekday[peak_day]
-        else:
-            peak_day = "No data"
-            peak_day_orders = 0
-    except Exception as e:
-        print(f"Peak day analysis error: {e}")
-        peak_day = "Saturday"
-        peak_day_orders = 0
-        orders_by_weekday = {day: 0 for day in calendar.day_name}
-    
-    # Revenue growth calculation with safe division
-    try:
-        # Calculate previous period for comparison
-        period_length = (end_date - start_date).days
-        prev_start = start_date - timezone.timedelta(days=period_length)
-        prev_end = start_date - timezone.timedelta(days=1)
-        
-        prev_period_revenue = WashOrder.objects.filter(
-            created_at__date__gte=prev_start,
-            created_at__date__lte=prev_end,
-            status='completed'
-        ).aggregate(total=Sum('price'))['total'] or Decimal('0.00')
-        
-        if prev_period_revenue > 0:
-            revenue_growth = float((revenue_period - prev_period_revenue) / prev_period_revenue * 100)
-        else:
-            revenue_growth = 100.0 if revenue_period > 0 else 0.0
-    except Exception as e:
-        print(f"Revenue growth calculation error: {e}")
-        revenue_growth = 0.0
-    
-    # Chart data preparation with fallbacks
-    try:
-        # Revenue trend data
-        revenue_trend_data = []
-        revenue_trend_labels = []
-        
-        current_date = start_date
-        while current_date <= end_date:
-            daily_revenue = WashOrder.objects.filter(
-                created_at__date=current_date,
-                status='completed'
-            ).aggregate(total=Sum('price'))['total'] or Decimal('0.00')
-            
-            revenue_trend_data.append(float(daily_revenue))
-            revenue_trend_labels.append(current_date.strftime('%m/%d'))
-            current_date += timezone.timedelta(days=1)
-        
-        # Limit to last 30 days for readability
-        if len(revenue_trend_data) > 30:
-            revenue_trend_data = revenue_trend_data[-30:]
-            revenue_trend_labels = revenue_trend_labels[-30:]
-    except Exception as e:
-        print(f"Revenue trend data error: {e}")
-        revenue_trend_data = [0] * 30
-        revenue_trend_labels = [(today - timezone.timedelta(days=i)).strftime('%m/%d') for i in range(29, -1, -1)]
-    
-    # Service distribution with fallbacks
-    try:
-        service_distribution = WashOrder.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
-        ).values('wash_type').annotate(
-            count=Count('wash_type')
-        ).order_by('-count')
-        
-        service_labels = []
-        service_counts = []
-        
-        for service in service_distribution:
-            service_labels.append(service['wash_type'].replace('_', ' ').title())
-            service_counts.append(service['count'])
-        
-        # Fallback data if no services
-        if not service_labels:
-            service_labels = ['No Data Available']
-            service_counts = [1]
-    except Exception as e:
-        print(f"Service distribution error: {e}")
-        service_labels = ['Basic Wash']
-        service_counts = [1]
-    
-    # Daily orders data with safe handling
-    try:
-        daily_orders_data = []
-        daily_orders_labels = []
-        
-        for day_num in range(7):  # 0=Monday, 6=Sunday
-            day_name = calendar.day_name[day_num]
-            day_orders = orders_by_weekday.get(day_name, 0)
-            
-            daily_orders_data.append(day_orders)
-            daily_orders_labels.append(day_name)
-    except Exception as e:
-        print(f"Daily orders data error: {e}")
-        daily_orders_data = [0] * 7
-        daily_orders_labels = list(calendar.day_name)
-    
-    # Top washers with safe handling
-    try:
-        top_washers = WashOrder.objects.filter(
-            status='completed',
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
-            washer__isnull=False
-        ).values(
-            'washer__first_name', 'washer__last_name'
-        ).annotate(
-            completed_orders=Count('order_id'),
-            total_revenue=Sum('price')
-        ).order_by('-completed_orders')[:5]
-    except Exception as e:
-        print(f"Top washers error: {e}")
-        top_washers = []
-    
-    # Create analytics object with safe values
-    analytics = {
-        'total_revenue': float(revenue_period),
-        'total_orders': total_orders,
-        'new_customers': new_customers,
-        'avg_order_value': float(avg_order_value),
-        'completion_rate': round(completion_rate, 1),
-        'avg_rating': 4.8,  # Placeholder until rating system is implemented
-        'peak_day_orders': peak_day_orders,
-        'peak_day': peak_day,
-        'repeat_customers': round(repeat_customers_percentage, 1),
-        'avg_service_time': 45,  # Placeholder
-        'cancellation_rate': round(cancellation_rate, 1),
-        'revenue_growth': round(revenue_growth, 1),
-    }
+    return start_date, end_date, today
+
+
+@login_required(login_url='/carwash-admin/login/')
+@user_passes_test(is_admin, login_url='/carwash-admin/login/')
+def analytics_view(request):
+    """
+    Analytics and reporting page. Only the shell is rendered here; the
+    template fetches each widget from analytics_widget_view in parallel.
+    """
+    from .analytics import WIDGETS
     
-    # Color schemes
-    service_colors = [
-        '#023859', '#a7ebf2', '#28a745', '#ffc107', '#dc3545', 
-        '#17a2b8', '#6f42c1', '#fd7e14'
-    ]
+    start_date, end_date, _ = _analytics_range(request)
     
     context = {
         'title': 'Analytics & Reports',
-        'analytics': analytics,
-        'revenue_today': float(revenue_today),
-        'revenue_week': float(revenue_week),
-        'revenue_period': float(revenue_period),
         'start_date': start_date.strftime('%Y-%m-%d'),
         'end_date': end_date.strftime('%Y-%m-%d'),
-        'top_washers': top_washers,
-        'revenue_trend_data': revenue_trend_data,
-        'revenue_trend_labels': revenue_trend_labels,
-        'service_labels': service_labels,
-        'service_counts': service_counts,
-        'service_colors': service_colors[:len(service_labels)],
-        'daily_orders_data': daily_orders_data,
-        'daily_orders_labels': daily_orders_labels,
+        'widget_urls': {
+            name: reverse('carwash_admin:analytics_widget', args=[name]) for name in WIDGETS
+        },
     }
     return render(request, 'admin/analytics.html', context)
 
 
+@login_required(login_url='/carwash-admin/login/')
+@user_passes_test(is_admin, login_url='/carwash-admin/login/')
+def analytics_widget_view(request, name):
+    """
+    One analytics widget as JSON, served from its cache (see analytics_cache).
+    X-Analytics-Cache and X-Analytics-Cache-Age say how it was served and
+    Server-Timing how long it took.
+    """
+    import time
+    from django.http import JsonResponse
+    from django.utils.cache import patch_cache_control
+    from .analytics import WIDGETS
+    from .analytics_cache import get_widget, policy
+    
+    if name not in WIDGETS:
+        return JsonResponse({'error': f'Unknown widget {name!r}.'}, status=404)
+    
+    start_date, end_date, today = _analytics_range(request)
+    started = time.perf_counter()
+    try:
+        results, cache_age, cache_state, compute_ms = get_widget(name, start_date, end_date, today)
+    except Exception:
+        logger.exception('Analytics %s calculation failed', name)
+        return JsonResponse({'error': 'This widget is unavailable right now.'}, status=503)
+    
+    response = JsonResponse(results)
+    response['X-Analytics-Cache'] = cache_state
+    response['X-Analytics-Cache-Age'] = str(int(cache_age))
+    response['Server-Timing'] = (
+        f'widget;dur={(time.perf_counter() - started) * 1000:.1f};desc="{cache_state}", '
+        f'compute;dur={compute_ms:.1f}'
+    )
+    # The browser may reuse it for whatever is left of its fresh window
+    patch_cache_control(response, private=True, max_age=max(0, policy(name)[0] - int(cache_age)))
+    return response
+
+
 @login_required(login_url='/carwash-admin/login/')
 @user_passes_test(is_admin, login_url='/carwash-admin/login/')
 def manage_appointments_view(request):
@@ -850,15 +625,19 @@ def cancel_appointment_admin_view(request, appointment_id):
 @user_passes_test(is_admin, login_url='/carwash-admin/login/')
 def auto_assign_orders_view(request):
     """Manually trigger auto-assignment of pending orders"""
-    from clients.utils import auto_assign_pending_orders
+    from clients.utils import dispatch_pending_orders
     
     try:
-        assigned_count = auto_assign_pending_orders()
+        report = dispatch_pending_orders()
+        assigned_count = len(report['assigned'])
+        waiting_count = len(report['skipped'])
         
         if assigned_count > 0:
             messages.success(request, f'Successfully assigned {assigned_count} pending order(s) to available washers.')
-        else:
-            messages.info(request, 'No pending orders to assign or no available washers.')
+        if waiting_count > 0:
+            messages.info(request, f'{waiting_count} order(s) still pending - no free washers right now.')
+        elif assigned_count == 0:
+            messages.info(request, 'No pending orders to assign.')
     except Exception as e:
         messages.error(request, f'Error auto-assigning orders: {str(e)}')
     
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django import forms
-from .models import Client, PasswordResetToken, Vehicle, WashOrder, TimeSlot, Appointment
+from .models import Client, PasswordResetToken, Vehicle, WashOrder, TimeSlot, Appointment, ScheduleTemplate, ScheduleClosure, WaitlistEntry
 
 class TimeSlotForm(forms.ModelForm):
     date = forms.DateField(
@@ -42,10 +42,39 @@ class WashOrderAdmin(admin.ModelAdmin):
 @admin.register(TimeSlot)
 class TimeSlotAdmin(admin.ModelAdmin):
     form = TimeSlotForm
-    list_display = ('date', 'start_time', 'end_time', 'max_capacity', 'booking_count', 'is_active')
+    list_display = ('date', 'start_time', 'end_time', 'max_capacity', 'booking_count', 'minutes_free', 'is_active')
     search_fields = ('date',)
     list_filter = ('date', 'is_active')
     date_hierarchy = 'date'
+    # Maintained by bookings and save(), never edited by hand
+    readonly_fields = ('booked_count', 'booked_minutes', 'length_minutes')
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_availability()
+    
+    @admin.display(description='Bookings', ordering='booked')
+    def booking_count(self, obj):
+        return obj.booked
+    
+    @admin.display(description='Bay-minutes free', ordering='remaining')
+    def minutes_free(self, obj):
+        return f'{obj.remaining} / {obj.capacity_minutes}'
+
+@admin.register(ScheduleTemplate)
+class ScheduleTemplateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'weekdays', 'opens_at', 'closes_at', 'slot_minutes', 'max_capacity', 'is_active')
+    list_filter = ('is_active',)
+    fieldsets = (
+        (None, {'fields': ('name', 'is_active', 'weekdays'),
+                'description': 'Weekdays are comma-separated numbers, Monday=0 ... Sunday=6.'}),
+        ('Hours', {'fields': ('opens_at', 'closes_at', 'slot_minutes', 'break_start', 'break_end', 'max_capacity')}),
+        ('Validity', {'fields': ('valid_from', 'valid_until')}),
+    )
+
+@admin.register(ScheduleClosure)
+class ScheduleClosureAdmin(admin.ModelAdmin):
+    list_display = ('date', 'reason')
+    date_hierarchy = 'date'
 
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
@@ -54,6 +83,13 @@ class AppointmentAdmin(admin.ModelAdmin):
     list_filter = ('is_confirmed', 'is_cancelled', 'wash_type', 'created_at')
     readonly_fields = ('created_at', 'updated_at', 'cancelled_at')
 
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('client', 'time_slot', 'wash_type', 'status', 'created_at', 'promoted_at')
+    search_fields = ('client__email', 'vehicle__license_plate')
+    list_filter = ('status', 'wash_type')
+    readonly_fields = ('created_at', 'promoted_at', 'appointment')
+
 @admin.register(PasswordResetToken)
 class PasswordResetTokenAdmin(admin.ModelAdmin):
     list_display = ('client', 'token', 'created_at', 'is_used')
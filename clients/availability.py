@@ -0,0 +1,233 @@
+# clients/availability.py
+"""
+Per-date slot availability cache.
+
+Each date is a DayAvailability: parallel arrays of slot ids, start/end
+times, bays, slot lengths and free bay-minutes, in start order. It backs
+the booking calendar, the schedule page and AppointmentForm, so a popular
+date is built with one slot query and then served from Django's cache
+framework until something on that date changes.
+
+Entries are versioned rather than edited: every date has a version in
+the cache, replaced with a new one when an appointment on that date is
+made, cancelled or moved or when one of its slots changes. Readers always
+look up the current version's key, so a bump invalidates the date for
+every worker sharing the cache at once, and concurrent writers can't
+overwrite each other's updates. Changes to schedule templates or closures
+bump a global generation instead, which invalidates every date.
+
+The versions only reach every worker process through a cache they share;
+the production settings point the default cache at a file-based one.
+"""
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+
+# Change when DayAvailability's layout changes, so a shared cache never
+# hands new code entries pickled by old code
+CACHE_PREFIX = 'slot_availability.3'
+GENERATION_KEY = f'{CACHE_PREFIX}:generation'
+
+_stats_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _cache_seconds():
+    return getattr(settings, 'AVAILABILITY_CACHE_SECONDS', 300)
+
+
+def _version_key(day):
+    return f'{CACHE_PREFIX}:version:{day.isoformat()}'
+
+
+def _current(key):
+    """
+    Read a version, seeding it with the current time if it is missing. A
+    version evicted from the cache therefore comes back with a value no
+    earlier entry was stored under, so stale entries can't resurface.
+    """
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def _bump(key):
+    # A new timestamp rather than incr(), which shared backends such as the
+    # file-based cache implement as a read and a write: two workers bumping
+    # at once would both write the same next value
+    cache.set(key, time.time_ns(), None)
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        stats[name] += n
+
+
+def hit_ratio():
+    """Share of date reads served from the cache, or None before any read"""
+    total = stats['hits'] + stats['misses']
+    return stats['hits'] / total if total else None
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in stats:
+            stats[name] = 0
+
+
+class DayAvailability:
+    """Availability for each active slot of one day, in start order"""
+    __slots__ = ('date', 'slot_ids', 'starts', 'ends', 'capacity', 'lengths', 'remaining')
+
+    def __init__(self, date):
+        self.date = date
+        self.slot_ids = array('l')  # 0 for a virtual slot with no row yet
+        self.starts = []
+        self.ends = []
+        self.capacity = array('I')  # bays
+        self.lengths = array('I')  # minutes
+        self.remaining = array('I')  # free bay-minutes
+
+    def __getstate__(self):
+        return self.date, self.slot_ids, self.starts, self.ends, self.capacity, self.lengths, self.remaining
+
+    def __setstate__(self, state):
+        (self.date, self.slot_ids, self.starts, self.ends,
+         self.capacity, self.lengths, self.remaining) = state
+
+    def add(self, slot_id, start_time, end_time, capacity, length, remaining):
+        self.slot_ids.append(slot_id)
+        self.starts.append(start_time)
+        self.ends.append(end_time)
+        self.capacity.append(capacity)
+        self.lengths.append(length)
+        self.remaining.append(max(0, remaining))
+
+    def slots(self):
+        """The day's slots as TimeSlot objects (unsaved for virtual slots)"""
+        from .models import TimeSlot
+
+        return [
+            TimeSlot(
+                id=slot_id or None, date=self.date, start_time=start, end_time=end,
+                max_capacity=capacity, length_minutes=length,
+                booked_minutes=capacity * length - remaining, is_active=True
+            )
+            for slot_id, start, end, capacity, length, remaining in zip(
+                self.slot_ids, self.starts, self.ends, self.capacity, self.lengths, self.remaining
+            )
+        ]
+
+    def as_dict(self, now=None):
+        """
+        JSON-ready form: free bay-minutes per slot and, as 'available', how
+        many more of the shortest wash the day can take. Slots that have
+        already started show nothing free.
+        """
+        from .models import shortest_wash_minutes
+
+        remaining = list(self.remaining)
+        now = timezone.localtime(now or timezone.now())
+        if self.date == now.date():
+            current = now.time()
+            remaining = [0 if start <= current else free for start, free in zip(self.starts, remaining)]
+        elif self.date < now.date():
+            remaining = [0] * len(remaining)
+
+        shortest = shortest_wash_minutes()
+        return {
+            'date': self.date.isoformat(),
+            'available': sum(free // shortest for free in remaining),
+            'slots': list(self.slot_ids),
+            'times': [start.strftime('%H:%M') for start in self.starts],
+            'remaining': remaining,
+        }
+
+
+def load_days(days):
+    """
+    Build DayAvailability for the given dates from one slot query. In
+    virtual slot mode, template slots without a row yet are included with
+    slot id 0 and all their bay-minutes free.
+    """
+    from .models import TimeSlot, minutes_between
+    from .scheduling import desired_slots, virtual_slots_enabled
+
+    built = {day: DayAvailability(day) for day in days}
+    rows = list(TimeSlot.objects.filter(date__in=built).values_list(
+        'date', 'start_time', 'id', 'end_time', 'max_capacity', 'length_minutes', 'booked_minutes', 'is_active'
+    ))
+    slots = [
+        (day, start_time, slot_id, end_time, max_capacity, length, max_capacity * length - booked)
+        for day, start_time, slot_id, end_time, max_capacity, length, booked, is_active in rows
+        if is_active
+    ]
+
+    if virtual_slots_enabled() and days:
+        taken = {(row[0], row[1]) for row in rows}
+        for (day, start_time), (end_time, max_capacity) in desired_slots(min(days), max(days)).items():
+            if day in built and (day, start_time) not in taken:
+                length = minutes_between(start_time, end_time)
+                slots.append((day, start_time, 0, end_time, max_capacity, length, max_capacity * length))
+
+    for day, start_time, slot_id, end_time, max_capacity, length, remaining in sorted(slots):
+        built[day].add(slot_id, start_time, end_time, max_capacity, length, remaining)
+    return built
+
+
+def get_range(start, end):
+    """DayAvailability for every date from start to end inclusive"""
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+    generation = _current(GENERATION_KEY)
+    versions = cache.get_many([_version_key(day) for day in days])
+    keys = {}
+    for day in days:
+        version = versions.get(_version_key(day))
+        if version is None:
+            version = _current(_version_key(day))
+        keys[day] = f'{CACHE_PREFIX}:{generation}:{day.isoformat()}:{version}'
+
+    cached = cache.get_many(list(keys.values()))
+    missing = [day for day in days if keys[day] not in cached]
+    _count('hits', len(days) - len(missing))
+    _count('misses', len(missing))
+
+    result = {day: cached[keys[day]] for day in days if keys[day] in cached}
+    if missing:
+        loaded = load_days(missing)
+        cache.set_many({keys[day]: entry for day, entry in loaded.items()}, _cache_seconds())
+        result.update(loaded)
+
+    return [result[day] for day in days]
+
+
+def invalidate_day(day):
+    """Bump a date's version so its next read is rebuilt"""
+    if isinstance(day, datetime):
+        day = day.date()
+    _bump(_version_key(day))
+    _count('invalidations')
+
+
+def invalidate_all():
+    """Bump the generation, e.g. after schedule templates change"""
+    _bump(GENERATION_KEY)
+    _count('invalidations')
+
+
+def slot_changed(slot_id):
+    """A booking on this slot changed; invalidate the slot's date"""
+    from .models import TimeSlot
+
+    day = TimeSlot.objects.filter(id=slot_id).values_list('date', flat=True).first()
+    if day is not None:
+        invalidate_day(day)
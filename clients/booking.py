@@ -0,0 +1,61 @@
+# clients/booking.py
+"""
+Booking an appointment end to end.
+
+book_appointment() is the one way in for the booking page, APIs and bulk
+imports: it validates the request, reserves the slot's bay-minutes with
+the guarded UPDATE (TimeSlot.reserve_spot), and inserts the wash order
+and the appointment, already pointing at each other, in one transaction.
+That is one write per row - no second save of the appointment to attach
+its order - and a failure anywhere leaves nothing behind: no orphan
+appointment, no order without one, no minutes reserved for neither.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Appointment, TimeSlot, WashOrder, wash_minutes
+
+
+def validate_booking(client, vehicle, time_slot, wash_type):
+    """Raise ValidationError if this booking can't be made, whatever the slot's load"""
+    if wash_type not in dict(WashOrder.WASH_TYPE_CHOICES):
+        raise ValidationError(f'Unknown wash type: {wash_type}')
+    if vehicle.client_id != client.pk:
+        raise ValidationError('That vehicle does not belong to this client.')
+    if not time_slot.is_active:
+        raise ValidationError('This time slot is not available.')
+    if time_slot.is_past:
+        raise ValidationError('Cannot book appointments for past time slots.')
+
+
+def book_appointment(client, vehicle, time_slot, wash_type='basic', special_instructions=''):
+    """
+    Book a wash in the slot (saved or virtual) and return the saved
+    Appointment with its wash_order. Raises ValidationError if the request
+    is invalid or the slot has no room for the wash; nothing is written
+    then.
+    """
+    validate_booking(client, vehicle, time_slot, wash_type)
+    minutes = wash_minutes(wash_type)
+
+    with transaction.atomic():
+        time_slot = TimeSlot.materialize(time_slot)
+        if not TimeSlot.reserve_spot(time_slot.id, minutes, time_slot):
+            raise ValidationError('This time slot is fully booked.')
+
+        appointment = Appointment(
+            client=client,
+            vehicle=vehicle,
+            time_slot=time_slot,
+            wash_type=wash_type,
+            special_instructions=special_instructions,
+            booked_minutes=minutes
+        )
+        order = appointment.build_wash_order()
+        order.save()
+        appointment.wash_order = order
+        # The minutes are reserved above, so save() only inserts the row
+        appointment._loaded_spot = (time_slot.id, minutes, wash_type)
+        appointment.save()
+
+    return appointment
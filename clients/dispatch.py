@@ -0,0 +1,209 @@
+# clients/dispatch.py
+"""
+Priority-queue dispatcher for pairing pending orders with washers.
+
+Orders sit in a heap ordered by an order policy's score and washers in a
+heap ordered by a washer policy's score; both are built once per dispatch
+pass and updated incrementally as assignments are made, so nothing is
+re-sorted or re-queried per order. Policies are plain classes with a
+score() method and are picked via the DISPATCH_ORDER_POLICY and
+DISPATCH_WASHER_POLICY settings.
+"""
+import heapq
+import itertools
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Avg, Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+DEFAULT_ORDER_POLICY = 'clients.dispatch.PriorityOrderPolicy'
+DEFAULT_WASHER_POLICY = 'clients.dispatch.BalancedWasherPolicy'
+
+
+class OrderCandidate:
+    """The parts of a pending order the dispatcher needs"""
+    __slots__ = ('order_id', 'created_at', 'wash_type', 'appointment_at')
+
+    def __init__(self, order_id, created_at, wash_type='basic', appointment_at=None):
+        self.order_id = order_id
+        self.created_at = created_at
+        self.wash_type = wash_type
+        self.appointment_at = appointment_at
+
+
+class WasherCandidate:
+    """The parts of a washer the dispatcher needs"""
+    __slots__ = ('washer_id', 'date_hired', 'load', 'capacity', 'rating', 'completed_today', 'hourly_rate')
+
+    def __init__(self, washer_id, date_hired, load=0, capacity=1, rating=None, completed_today=0,
+                 hourly_rate=None):
+        self.washer_id = washer_id
+        self.date_hired = date_hired
+        self.load = load
+        self.capacity = capacity
+        self.rating = rating
+        self.completed_today = completed_today
+        self.hourly_rate = hourly_rate
+
+    @property
+    def has_capacity(self):
+        return self.load < self.capacity
+
+
+# Order policies - higher score is dispatched first
+
+class FifoOrderPolicy:
+    """Oldest order first (the original behaviour)"""
+
+    def score(self, order, now):
+        return (now - order.created_at).total_seconds()
+
+
+class PriorityOrderPolicy:
+    """
+    Score orders in minutes of waiting: time already waited, plus a bonus
+    for bigger washes, plus urgency for appointments that are about to start.
+    """
+    WASH_TYPE_BONUS = {'basic': 0, 'premium': 10, 'deluxe': 20}
+    APPOINTMENT_BONUS = 60
+
+    def score(self, order, now):
+        score = (now - order.created_at).total_seconds() / 60
+        score += self.WASH_TYPE_BONUS.get(order.wash_type, 0)
+
+        if order.appointment_at is not None:
+            minutes_to_start = (order.appointment_at - now).total_seconds() / 60
+            score += self.APPOINTMENT_BONUS + max(0, 60 - minutes_to_start)
+
+        return score
+
+
+# Washer policies - higher score gets the next order
+
+class SeniorityWasherPolicy:
+    """Longest-serving washer first (the original behaviour)"""
+
+    def score(self, washer):
+        return -washer.date_hired.timestamp()
+
+
+class BalancedWasherPolicy:
+    """
+    Prefer well-reviewed washers with spare capacity who have done less
+    work today, so good washers get jobs without being overloaded.
+    """
+    DEFAULT_RATING = 3.0
+
+    def score(self, washer):
+        rating = washer.rating if washer.rating is not None else self.DEFAULT_RATING
+        return float(rating) * 10 - washer.load * 50 - washer.completed_today * 5
+
+
+def get_order_policy():
+    return import_string(getattr(settings, 'DISPATCH_ORDER_POLICY', DEFAULT_ORDER_POLICY))()
+
+
+def get_washer_policy():
+    return import_string(getattr(settings, 'DISPATCH_WASHER_POLICY', DEFAULT_WASHER_POLICY))()
+
+
+class Dispatcher:
+    """
+    Two heaps: pending orders by order policy score and washers with spare
+    capacity by washer policy score. match() pops the best order and the
+    best washer together; a washer that still has capacity afterwards is
+    pushed back with its new score.
+    """
+
+    def __init__(self, order_policy=None, washer_policy=None, now=None):
+        self.order_policy = order_policy or get_order_policy()
+        self.washer_policy = washer_policy or get_washer_policy()
+        self.now = now or timezone.now()
+        self._orders = []
+        self._washers = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def push_order(self, order):
+        score = self.order_policy.score(order, self.now)
+        heapq.heappush(self._orders, (-score, order.created_at, next(self._seq), order))
+
+    def push_washer(self, washer):
+        if washer.has_capacity:
+            score = self.washer_policy.score(washer)
+            heapq.heappush(self._washers, (-score, washer.washer_id, next(self._seq), washer))
+
+    def pop_order(self):
+        return heapq.heappop(self._orders)[-1]
+
+    def pop_orders(self, limit):
+        """Pop up to limit best orders"""
+        return [self.pop_order() for _ in range(min(limit, len(self._orders)))]
+
+    def pending_orders(self):
+        """Orders left unmatched, best first"""
+        return [entry[-1] for entry in sorted(self._orders)]
+
+    def free_washers(self):
+        """Washers with spare capacity, best first"""
+        return [entry[-1] for entry in sorted(self._washers)]
+
+    def match(self):
+        """Yield (order, washer) pairs until orders or capacity run out"""
+        while self._orders and self._washers:
+            order = self.pop_order()
+            washer = heapq.heappop(self._washers)[-1]
+            washer.load += 1
+            self.push_washer(washer)
+            yield order, washer
+
+
+def order_candidates(queryset):
+    """Build OrderCandidates from a WashOrder queryset in one query"""
+    rows = queryset.values_list(
+        'order_id', 'created_at', 'wash_type',
+        'appointment__time_slot__date', 'appointment__time_slot__start_time'
+    )
+
+    candidates = []
+    for order_id, created_at, wash_type, slot_date, slot_time in rows:
+        appointment_at = None
+        if slot_date is not None:
+            appointment_at = datetime.combine(slot_date, slot_time)
+            if timezone.is_naive(appointment_at):
+                appointment_at = timezone.make_aware(appointment_at)
+        candidates.append(OrderCandidate(order_id, created_at, wash_type, appointment_at))
+    return candidates
+
+
+def washer_candidates(queryset, now=None):
+    """
+    Build WasherCandidates (with rating and completed-today, the local day
+    of now) in one query
+    """
+    from .models import Review, WashOrder
+
+    avg_rating = Review.objects.filter(
+        washer_id=OuterRef('washer_id')
+    ).order_by().values('washer_id').annotate(avg=Avg('rating')).values('avg')
+    completed_today = WashOrder.objects.filter(
+        washer_id=OuterRef('washer_id'),
+        status='completed',
+        completed_at__date=timezone.localdate(now)
+    ).order_by().values('washer_id').annotate(n=Count('order_id')).values('n')
+
+    rows = queryset.annotate(
+        avg_rating=Subquery(avg_rating),
+        done_today=Coalesce(Subquery(completed_today, output_field=IntegerField()), 0)
+    ).values_list(
+        'washer_id', 'date_hired', 'active_order_count', 'max_concurrent_orders',
+        'avg_rating', 'done_today', 'hourly_rate'
+    )
+
+    return [WasherCandidate(*row) for row in rows]
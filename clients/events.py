@@ -0,0 +1,143 @@
+# clients/events.py
+"""
+Event-driven auto-assignment.
+
+Any transition that frees washer capacity (an order completed or cancelled,
+a washer made available or activated, a new washer) sends the
+capacity_freed signal. Each signal enqueues a dispatch tick once its
+transaction commits; ticks arriving within DISPATCH_COALESCE_SECONDS of
+each other are coalesced into a single dispatch pass, so a burst of
+completions triggers one pass rather than one per completion.
+
+The delayed pass runs on a timer thread. Where worker processes don't
+run threads (uWSGI without --enable-threads, PythonAnywhere) set
+DISPATCH_TICKER_TIMER = False: the first event after a quiet spell then
+dispatches at once, the ones following it within the window wait for
+the next pass, and the dispatch_tick command run from cron (or as an
+always-on task) makes sure that pass comes.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import Signal, receiver
+
+
+logger = logging.getLogger(__name__)
+
+# Sent with washer_id (None when unknown) and reason, e.g. 'order_completed'
+capacity_freed = Signal()
+
+
+class DispatchTicker:
+    """
+    Coalesces dispatch requests into timed passes and records how long
+    freed capacity waited for a dispatch pass.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self._first_event_at = None
+        self._last_pass_at = None
+        self._pending_events = 0
+        self.stats = {
+            'events': 0,
+            'ticks': 0,
+            'assigned': 0,
+            'last_latency_ms': None,
+            'max_latency_ms': 0.0,
+        }
+
+    def notify(self, reason=''):
+        """Note freed capacity and make sure a dispatch pass is coming"""
+        delay = getattr(settings, 'DISPATCH_COALESCE_SECONDS', 2)
+        use_timer = getattr(settings, 'DISPATCH_TICKER_TIMER', True)
+
+        with self._lock:
+            self.stats['events'] += 1
+            self._pending_events += 1
+            now = time.monotonic()
+            if self._first_event_at is None:
+                self._first_event_at = now
+            start_timer = flush_now = False
+            if delay <= 0:
+                flush_now = True
+            elif not use_timer:
+                # No thread to run a delayed pass: dispatch now unless a pass
+                # ran within the window; cron's dispatch_tick covers the rest
+                flush_now = self._last_pass_at is None or now - self._last_pass_at >= delay
+            elif self._timer is None:
+                self._timer = threading.Timer(delay, self._run_in_thread)
+                self._timer.daemon = True
+                start_timer = True
+
+        if start_timer:
+            self._timer.start()
+        elif flush_now:
+            self.flush()
+
+    def flush(self):
+        """
+        Run the pending dispatch pass now (if any) and return its report,
+        or None when nothing was waiting. Call it after the freeing
+        transaction commits; the event is only noted then.
+        """
+        from .utils import dispatch_pending_orders
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            first_event_at, self._first_event_at = self._first_event_at, None
+            events, self._pending_events = self._pending_events, 0
+
+        if first_event_at is None:
+            return None
+
+        report = dispatch_pending_orders()
+        finished_at = time.monotonic()
+        latency_ms = (finished_at - first_event_at) * 1000
+
+        with self._lock:
+            self._last_pass_at = finished_at
+            self.stats['ticks'] += 1
+            self.stats['assigned'] += len(report['assigned'])
+            self.stats['last_latency_ms'] = latency_ms
+            self.stats['max_latency_ms'] = max(self.stats['max_latency_ms'], latency_ms)
+
+        logger.info(
+            'Dispatch tick: %d event(s) coalesced, %d assigned, %.0f ms after capacity freed',
+            events, len(report['assigned']), latency_ms
+        )
+        return report
+
+    def _run_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Dispatch tick failed')
+        finally:
+            connection.close()
+
+
+ticker = DispatchTicker()
+
+
+@receiver(capacity_freed)
+def enqueue_dispatch_tick(sender, washer_id=None, reason='', **kwargs):
+    """Dispatch once the freeing transaction has committed"""
+    transaction.on_commit(lambda: ticker.notify(reason))
+
+
+def flush_after_commit():
+    """
+    Run the pending dispatch pass once the current transaction commits
+    (at once outside one). Returns a list that then holds the pass's
+    report, or None if nothing was waiting; it stays empty until commit.
+    """
+    reports = []
+    transaction.on_commit(lambda: reports.append(ticker.flush()))
+    return reports
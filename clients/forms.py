@@ -1,8 +1,8 @@
 # clients/forms.py
 from django import forms
-from .models import Client, Vehicle, WashOrder, Appointment, TimeSlot
+from .models import Client, Vehicle, WashOrder, Appointment, TimeSlot, wash_minutes
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 
 class SignupForm(forms.ModelForm):
     password = forms.CharField(
@@ -157,8 +157,48 @@ class WashOrderForm(forms.ModelForm):
             self.fields['vehicle'].queryset = Vehicle.objects.filter(client=client)
 
 
+class SlotChoiceField(forms.ChoiceField):
+    """
+    Time slot picker keyed by date and start time (TimeSlot.slot_key), so it
+    can offer slots that don't have a database row yet. Cleans to the
+    TimeSlot object, which may be unsaved.
+    """
+    
+    def __init__(self, *args, empty_label="Select a time slot", **kwargs):
+        self.empty_label = empty_label
+        super().__init__(*args, **kwargs)
+        self.slots = []
+    
+    @property
+    def slots(self):
+        return list(self._slots.values())
+    
+    @slots.setter
+    def slots(self, slots):
+        self._slots = {slot.slot_key: slot for slot in slots}
+        self.choices = [('', self.empty_label)] + [
+            (key, str(slot) if slot.available_spots else f'{slot} (full - waitlist only)')
+            for key, slot in self._slots.items()
+        ]
+    
+    def prepare_value(self, value):
+        if isinstance(value, TimeSlot):
+            return value.slot_key
+        return value
+    
+    def clean(self, value):
+        value = super().clean(value)
+        return self._slots.get(value)
+
+
 class AppointmentForm(forms.ModelForm):
     """Form for booking appointments with time slots"""
+    time_slot = SlotChoiceField(widget=forms.Select(attrs={'class': 'form-control'}))
+    join_waitlist = forms.BooleanField(
+        required=False,
+        label='If this slot is full, put me on its waitlist',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
     
     class Meta:
         model = Appointment
@@ -167,9 +207,6 @@ class AppointmentForm(forms.ModelForm):
             'vehicle': forms.Select(attrs={
                 'class': 'form-control'
             }),
-            'time_slot': forms.Select(attrs={
-                'class': 'form-control'
-            }),
             'wash_type': forms.Select(attrs={
                 'class': 'form-control'
             }),
@@ -181,6 +218,8 @@ class AppointmentForm(forms.ModelForm):
         }
 
     def __init__(self, client=None, selected_date=None, *args, **kwargs):
+        from .scheduling import slots_between
+        
         super().__init__(*args, **kwargs)
         
         if client:
@@ -188,55 +227,76 @@ class AppointmentForm(forms.ModelForm):
         
         # Filter time slots to show only available ones for the selected date
         if selected_date:
-            from django.utils import timezone
             from datetime import datetime
             
             # Convert string date to date object if needed
             if isinstance(selected_date, str):
                 selected_date = datetime.strptime(selected_date, '%Y-%m-%d').date()
             
-            # Get all time slots for the date and filter manually
-            all_slots = TimeSlot.objects.filter(
-                date=selected_date,
-                is_active=True
-            )
-            
-            # Filter out fully booked slots
-            available_slot_ids = []
-            for slot in all_slots:
-                booked_count = slot.appointments.filter(is_cancelled=False).count()
-                if booked_count < slot.max_capacity:
-                    available_slot_ids.append(slot.id)
-            
-            available_slots = TimeSlot.objects.filter(id__in=available_slot_ids)
-            
-            self.fields['time_slot'].queryset = available_slots
-            self.fields['time_slot'].empty_label = "Select a time slot"
+            # The day's slots (including ones not yet created, in virtual
+            # slot mode); full ones can still be waitlisted
+            self.fields['time_slot'].slots = slots_between(selected_date, selected_date)
         else:
             # Show next 7 days of available slots
-            from django.utils import timezone
             from datetime import timedelta
             
             start_date = timezone.now().date()
             end_date = start_date + timedelta(days=7)
             
-            self.fields['time_slot'].queryset = TimeSlot.objects.filter(
-                date__range=[start_date, end_date],
-                is_active=True
-            )
+            self.fields['time_slot'].slots = slots_between(start_date, end_date)
+        
+        if self.instance.pk and self.instance.time_slot_id:
+            self.initial['time_slot'] = self.instance.time_slot
+
+    @property
+    def available_slots(self):
+        """The slots offered by the time slot field"""
+        return self.fields['time_slot'].slots
+
+    @property
+    def waitlisted(self):
+        """True if the cleaned booking is for the chosen slot's waitlist"""
+        return getattr(self, '_waitlisted', False)
 
     def clean_time_slot(self):
         time_slot = self.cleaned_data.get('time_slot')
         
-        if time_slot:
-            if time_slot.is_past:
-                raise forms.ValidationError("Cannot book appointments for past time slots.")
-            
-            if not time_slot.is_available:
-                raise forms.ValidationError("This time slot is fully booked.")
+        if time_slot and time_slot.is_past:
+            raise forms.ValidationError("Cannot book appointments for past time slots.")
         
         return time_slot
 
+    def clean(self):
+        cleaned_data = super().clean()
+        time_slot = cleaned_data.get('time_slot')
+        
+        if time_slot:
+            wash_type = cleaned_data.get('wash_type') or 'basic'
+            if not time_slot.has_room_for(wash_minutes(wash_type)):
+                if not cleaned_data.get('join_waitlist'):
+                    self.add_error('time_slot', "This time slot is fully booked for a "
+                                                f"{dict(WashOrder.WASH_TYPE_CHOICES)[wash_type]}.")
+                    return cleaned_data
+                self._waitlisted = True
+        
+        return cleaned_data
+    
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # A virtual slot has no row (so no id) until it is booked; validating
+        # must not create one, book_appointment() or save() does
+        time_slot = self.cleaned_data.get('time_slot')
+        if time_slot is not None and time_slot.pk is None:
+            exclude.add('time_slot')
+        return exclude
+    
+    def save(self, commit=True):
+        """Save the appointment, creating its slot's row first if it is virtual"""
+        with transaction.atomic():
+            if self.instance.time_slot_id is None and self.cleaned_data.get('time_slot') is not None:
+                self.instance.time_slot = TimeSlot.materialize(self.cleaned_data['time_slot'])
+            return super().save(commit)
+
 
 class TimeSlotSelectionForm(forms.Form):
     """Form for selecting date to view available time slots"""
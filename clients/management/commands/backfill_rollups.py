@@ -0,0 +1,91 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from clients import rollups
+from clients.models import WashOrder
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild (or verify) the daily order rollup from the wash orders, one chunk of days at a time, '
+        'or with --stale only the days whose rollup update failed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day, YYYY-MM-DD (default: the first order)')
+        parser.add_argument('--end', help='Last day, YYYY-MM-DD (default: today)')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days rebuilt per transaction (default: 31)')
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report days whose rollup has drifted, do not rebuild them'
+        )
+        parser.add_argument(
+            '--stale',
+            action='store_true',
+            help='Only rebuild the days marked stale by a failed rollup update (run it from cron)'
+        )
+
+    def parse_day(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Dates must be in YYYY-MM-DD format, not {value!r}.')
+
+    def rebuild_stale(self):
+        started = timezone.now()
+        stale = rollups.stale_days()
+        if not stale:
+            self.stdout.write(self.style.SUCCESS('No stale rollup days.'))
+            return
+        for day, marked_at in stale:
+            rows = rollups.rebuild(day, day)
+            # A day marked again while it was rebuilt stays marked for the next run
+            rollups.clear_stale(day, day, marked_before=started)
+            self.stdout.write(f'  {day}: {rows} row(s)')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(stale)} stale rollup day(s).'))
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days must be at least 1.')
+        if options['stale']:
+            if options['verify'] or options['start'] or options['end']:
+                raise CommandError('--stale does not take --verify, --start or --end.')
+            self.rebuild_stale()
+            return
+
+        end = self.parse_day(options['end']) if options['end'] else timezone.localdate()
+        if options['start']:
+            start = self.parse_day(options['start'])
+        else:
+            first = WashOrder.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if first is None:
+                self.stdout.write(self.style.SUCCESS('No orders to roll up.'))
+                return
+            start = timezone.localtime(first).date()
+        if start > end:
+            raise CommandError('--start must not be after --end.')
+
+        if options['verify']:
+            drifted = []
+            for chunk_start, chunk_end in rollups.in_chunks(start, end, options['chunk_days']):
+                drifted += rollups.drifted_days(chunk_start, chunk_end)
+            if not drifted:
+                self.stdout.write(self.style.SUCCESS(f'Daily rollup matches the orders from {start} to {end}.'))
+                return
+            for day in drifted:
+                self.stdout.write(f'  {day}')
+            self.stdout.write(
+                self.style.WARNING(f'{len(drifted)} day(s) have drifted. Run without --verify to rebuild.')
+            )
+            return
+
+        total = 0
+        for chunk_start, chunk_end in rollups.in_chunks(start, end, options['chunk_days']):
+            started = timezone.now()
+            rows = rollups.rebuild(chunk_start, chunk_end)
+            rollups.clear_stale(chunk_start, chunk_end, marked_before=started)
+            total += rows
+            self.stdout.write(f'  {chunk_start} to {chunk_end}: {rows} row(s)')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the daily rollup from {start} to {end}: {total} row(s).'))
@@ -0,0 +1,129 @@
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import time as dt_time, timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Benchmark appointment booking (bookings/sec) against a scratch SQLite database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=2000, help='Booking attempts per path (default: 2000)')
+        parser.add_argument('--days', type=int, default=14, help='Days of slots to book into (default: 14)')
+        parser.add_argument('--bays', type=int, default=4, help='Bays per slot (default: 4)')
+        parser.add_argument('--clients', type=int, default=200, help='Clients making bookings (default: 200)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument(
+            '--path',
+            choices=['service', 'legacy', 'both'],
+            default='both',
+            help='book_appointment(), the old save-then-create_wash_order path, or both (default: both)'
+        )
+        parser.add_argument('--db', help='Scratch database file (default: a temporary file)')
+        parser.add_argument('--keep-db', action='store_true', help='Keep the scratch database afterwards')
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_bookings only runs against SQLite.')
+
+        scratch = options['db'] or os.path.join(tempfile.mkdtemp(), 'bookings.sqlite3')
+        connection.settings_dict['TEST'] = {**connection.settings_dict.get('TEST', {}), 'NAME': scratch}
+
+        self.stdout.write(f'Building scratch database at {scratch}...')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            paths = ['service', 'legacy'] if options['path'] == 'both' else [options['path']]
+            people = self.make_clients(options['clients'])
+            first_day = timezone.localdate() + timedelta(days=1)
+            results = []
+            for number, path in enumerate(paths):
+                # Each path books into its own, identical block of days
+                start = first_day + timedelta(days=number * options['days'])
+                slots = self.make_slots(start, options['days'], options['bays'])
+                results.append((path, self.run(path, people, slots, options, connection)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keep_db'])
+
+        for path, (booked, rejected, elapsed, statements) in results:
+            attempts = booked + rejected
+            writes = statements['INSERT'] + statements['UPDATE']
+            self.stdout.write(f'\n{path}: {booked} booked, {rejected} rejected in {elapsed * 1000:.0f} ms')
+            self.stdout.write(f'  Queries per attempt: {sum(statements.values()) / attempts:.2f} '
+                              f'({writes / attempts:.2f} writes: {statements["INSERT"]} INSERT, '
+                              f'{statements["UPDATE"]} UPDATE)')
+            self.stdout.write(self.style.SUCCESS(f'  {attempts / elapsed:,.0f} bookings/sec'))
+
+    def make_clients(self, count):
+        from clients.models import Client, Vehicle
+
+        clients = Client.objects.bulk_create([
+            Client(email=f'bench{i}@example.com', password_hash='x', first_name='Bench', last_name=str(i))
+            for i in range(count)
+        ])
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(client=client, make='Bench', model='Car', license_plate=f'BENCH-{i}')
+            for i, client in enumerate(clients)
+        ])
+        return list(zip(clients, vehicles))
+
+    def make_slots(self, start, days, bays):
+        from clients.models import TimeSlot
+
+        return TimeSlot.objects.bulk_create([
+            TimeSlot(
+                date=start + timedelta(days=offset), start_time=dt_time(hour, 0), end_time=dt_time(hour + 1, 0),
+                max_capacity=bays
+            )
+            for offset in range(days)
+            for hour in range(8, 18)
+        ])
+
+    def run(self, path, people, slots, options, connection):
+        """(booked, rejected, seconds, statement counts by kind) for one path"""
+        from clients.booking import book_appointment
+        from clients.models import Appointment, WashOrder
+        from clients.utils import rebuild_slot_booked_counts
+
+        rng = random.Random(options['seed'])
+        wash_types = [choice for choice, _ in WashOrder.WASH_TYPE_CHOICES]
+        attempts = [
+            (*rng.choice(people), rng.choice(slots), rng.choice(wash_types))
+            for _ in range(options['bookings'])
+        ]
+        statements = Counter()
+
+        def count(execute, sql, params, many, context):
+            statements[sql.split(None, 1)[0].upper()] += 1
+            return execute(sql, params, many, context)
+
+        booked = rejected = 0
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            for client, vehicle, slot, wash_type in attempts:
+                try:
+                    if path == 'service':
+                        book_appointment(client, vehicle, slot, wash_type)
+                    else:
+                        appointment = Appointment.objects.create(
+                            client=client, vehicle=vehicle, time_slot=slot, wash_type=wash_type
+                        )
+                        appointment.create_wash_order()
+                except ValidationError:
+                    rejected += 1
+                else:
+                    booked += 1
+            elapsed = time.perf_counter() - started
+
+        # Both paths must leave every slot's counters matching its bookings
+        drifted = rebuild_slot_booked_counts(fix=False)
+        if drifted:
+            raise CommandError(f'{path}: {len(drifted)} slot(s) drifted')
+        return booked, rejected, elapsed, statements
@@ -0,0 +1,128 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from clients.dispatch import Dispatcher, OrderCandidate, WasherCandidate
+from clients.matching import linear_sum_assignment, optimal_pairs
+from clients.models import Client, Vehicle, WashOrder
+from clients.utils import dispatch_pending_orders
+from washers.models import Washer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the in-memory dispatcher (and with --db a real dispatch pass) on synthetic orders and washers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10000, help='Pending orders (default: 10000)')
+        parser.add_argument('--washers', type=int, default=500, help='Free washers (default: 500)')
+        parser.add_argument('--capacity', type=int, default=1, help='Orders each washer can take (default: 1)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument(
+            '--matching',
+            choices=['greedy', 'optimal'],
+            default='greedy',
+            help='Pair one at a time or solve the batch as an assignment problem (default: greedy)'
+        )
+        parser.add_argument(
+            '--db',
+            action='store_true',
+            help='Also time dispatch_pending_orders() with the same orders and washers written to the '
+                 'database, alongside any already pending or free there (rolled back afterwards)'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        wash_types = [choice for choice, _ in WashOrder.WASH_TYPE_CHOICES]
+
+        orders = [
+            OrderCandidate(
+                order_id,
+                now - timedelta(minutes=rng.randint(0, 240)),
+                rng.choice(wash_types),
+                now + timedelta(minutes=rng.randint(0, 180)) if rng.random() < 0.3 else None
+            )
+            for order_id in range(options['orders'])
+        ]
+        washers = [
+            WasherCandidate(
+                washer_id,
+                now - timedelta(days=rng.randint(1, 1000)),
+                capacity=options['capacity'],
+                rating=rng.uniform(1, 5),
+                completed_today=rng.randint(0, 8),
+                hourly_rate=rng.randint(10, 30)
+            )
+            for washer_id in range(options['washers'])
+        ]
+
+        started = time.perf_counter()
+        dispatcher = Dispatcher(now=now)
+        for order in orders:
+            dispatcher.push_order(order)
+        if options['matching'] == 'optimal':
+            free_slots = options['capacity'] * len(washers)
+            candidates = dispatcher.pop_orders(free_slots * 3)
+            built = time.perf_counter()
+            assigned = len(optimal_pairs(candidates, washers, now))
+        else:
+            for washer in washers:
+                dispatcher.push_washer(washer)
+            built = time.perf_counter()
+            assigned = sum(1 for _ in dispatcher.match())
+        finished = time.perf_counter()
+
+        match_time = finished - built
+        self.stdout.write(f'Orders: {len(orders)}, washers: {len(washers)} x {options["capacity"]}')
+        if options['matching'] == 'optimal':
+            solver = 'scipy' if linear_sum_assignment is not None else 'pure Python'
+            self.stdout.write(f'Optimal matching over {len(candidates)} candidate orders ({solver} solver)')
+        self.stdout.write(f'Build queues: {(built - started) * 1000:.1f} ms')
+        self.stdout.write(f'Match: {assigned} assignments in {match_time * 1000:.1f} ms')
+        self.stdout.write(self.style.SUCCESS(
+            f'{(assigned / match_time if match_time else 0):,.0f} assignments/sec '
+            f'({assigned / (finished - started):,.0f}/sec including queue build)'
+        ))
+
+        if options['db']:
+            self.benchmark_database(orders, washers, options)
+
+    def benchmark_database(self, orders, washers, options):
+        """Time one real dispatch pass over the synthetic orders and washers, then roll them back"""
+        with transaction.atomic():
+            client = Client.objects.create(
+                email='benchmark@example.invalid', password_hash='!', first_name='Benchmark', last_name='Client'
+            )
+            vehicle = Vehicle.objects.create(client=client, make='Benchmark', model='Car', license_plate='BENCH')
+            Washer.objects.bulk_create([
+                Washer(
+                    email=f'benchmark{washer.washer_id}@example.invalid', password_hash='!',
+                    first_name='Benchmark', last_name=f'Washer {washer.washer_id}', phone='0',
+                    hourly_rate=washer.hourly_rate, max_concurrent_orders=options['capacity']
+                )
+                for washer in washers
+            ], batch_size=500)
+            # created_at is stamped now on insert; the pass ranks them as written
+            WashOrder.objects.bulk_create([
+                WashOrder(client=client, vehicle=vehicle, wash_type=order.wash_type, price=15)
+                for order in orders
+            ], batch_size=500)
+
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                report = dispatch_pending_orders(matching=options['matching'])
+                finished = time.perf_counter()
+            transaction.set_rollback(True)
+
+        elapsed = finished - started
+        self.stdout.write(
+            f'Database pass ({connection.vendor}): {len(report["assigned"])} assignments, '
+            f'{len(report["skipped"])} left pending in {elapsed * 1000:.1f} ms, {len(queries)} queries'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{(len(report["assigned"]) / elapsed if elapsed else 0):,.0f} assignments/sec against the database'
+        ))
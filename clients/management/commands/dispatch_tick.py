@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from clients.utils import dispatch_pending_orders
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a dispatch pass for the pending queue: the fallback for the coalesced dispatch ticker '
+        'where worker processes run no timer threads (run it from cron, or with --every as an always-on task)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=float,
+            default=0,
+            help='Keep running a pass every this many seconds (default: one pass and exit)'
+        )
+        parser.add_argument(
+            '--passes',
+            type=int,
+            default=0,
+            help='With --every, stop after this many passes (default: run until stopped)'
+        )
+
+    def handle(self, *args, **options):
+        every, passes = options['every'], options['passes']
+        if every < 0 or passes < 0:
+            raise CommandError('--every and --passes must not be negative.')
+
+        done = 0
+        while True:
+            report = dispatch_pending_orders()
+            done += 1
+            if report['assigned'] or report['released'] or not every:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Dispatch pass: released {report['released']}, assigned {len(report['assigned'])}, "
+                    f"{len(report['skipped'])} still pending."
+                ))
+            if not every or (passes and done >= passes):
+                return
+            time.sleep(every)
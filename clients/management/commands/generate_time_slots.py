@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from clients.models import ScheduleTemplate
+from clients.scheduling import DEFAULT_CHUNK_SIZE, generate_time_slots
+
+
+class Command(BaseCommand):
+    help = 'Create missing time slots from the active schedule templates'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Number of days to create time slots for (default: 30)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Rows per INSERT (default: {DEFAULT_CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+
+        if not ScheduleTemplate.objects.filter(is_active=True).exists():
+            self.stdout.write(self.style.WARNING(
+                'No active schedule templates. Add one in the Django admin (Schedule templates).'
+            ))
+            return
+
+        started = time.perf_counter()
+        created, skipped = generate_time_slots(days=days, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully created {created} time slots. '
+                f'Skipped {skipped} existing slots. ({days} days in {elapsed:.2f}s)'
+            )
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from clients.utils import rebuild_slot_booked_counts
+
+
+class Command(BaseCommand):
+    help = 'Verify (and repair) the booking and bay-minute counters on time slots'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drifted slots, do not fix them'
+        )
+
+    def handle(self, *args, **options):
+        verify_only = options['verify']
+
+        drifted = rebuild_slot_booked_counts(fix=not verify_only)
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All time slot booking counts are correct.'))
+            return
+
+        for slot_id, stored, actual in drifted:
+            self.stdout.write(f'  Slot #{slot_id}: stored {stored[0]} booking(s) / {stored[1]} min, '
+                              f'actual {actual[0]} / {actual[1]} min')
+
+        if verify_only:
+            self.stdout.write(
+                self.style.WARNING(f'{len(drifted)} slot(s) have drifted. Run without --verify to repair.')
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted)} slot(s).'))
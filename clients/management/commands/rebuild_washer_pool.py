@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from clients import washer_stats
+from clients.utils import rebuild_active_order_counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify (and repair) the active order counters behind the free-washer pool '
+        'and the washer rating and service time aggregates'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drifted washers, do not fix them'
+        )
+
+    def handle(self, *args, **options):
+        verify_only = options['verify']
+
+        drifted = rebuild_active_order_counts(fix=not verify_only)
+        drifted_stats = washer_stats.rebuild(fix=not verify_only)
+
+        if not drifted and not drifted_stats:
+            self.stdout.write(self.style.SUCCESS(
+                'All washer active order counts, ratings and service times are correct.'
+            ))
+            return
+
+        for washer_id, stored, actual in drifted:
+            self.stdout.write(f'  Washer #{washer_id}: stored {stored}, actual {actual}')
+        for washer_id, what in drifted_stats:
+            self.stdout.write(f'  Washer #{washer_id}: {what.replace("_", " ")} drifted')
+
+        washers = len({row[0] for row in drifted} | {washer_id for washer_id, _ in drifted_stats})
+        if verify_only:
+            self.stdout.write(
+                self.style.WARNING(f'{washers} washer(s) have drifted. Run without --verify to repair.')
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {washers} washer(s).'))
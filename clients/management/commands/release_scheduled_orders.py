@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from clients.utils import dispatch_pending_orders, next_release_at
+
+
+class Command(BaseCommand):
+    help = 'Release held appointment orders that are due and dispatch the pending queue'
+
+    def handle(self, *args, **options):
+        report = dispatch_pending_orders()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Released {report['released']} scheduled order(s). "
+                f"Assigned {len(report['assigned'])}, {len(report['skipped'])} still pending."
+            )
+        )
+
+        upcoming = next_release_at()
+        if upcoming:
+            self.stdout.write(f'Next scheduled release: {upcoming:%Y-%m-%d %H:%M}')
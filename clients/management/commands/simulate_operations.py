@@ -0,0 +1,77 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Simulate a day of orders, appointments and dispatch against a scratch SQLite database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=12, help='Simulated hours (default: 12)')
+        parser.add_argument('--washers', type=int, default=10, help='Number of washers (default: 10)')
+        parser.add_argument('--rate', type=float, default=20, help='Order arrivals per hour (default: 20)')
+        parser.add_argument('--multiplier', type=float, default=1, help='Scale the arrival rate, e.g. 10 for a 10x day')
+        parser.add_argument('--appointments', type=float, default=0.3, help='Share of arrivals booking a slot (default: 0.3)')
+        parser.add_argument('--cancel-rate', type=float, default=0.05, help='Share of orders cancelled (default: 0.05)')
+        parser.add_argument('--shift-hours', type=int, default=8, help='Washer shift length (default: 8)')
+        parser.add_argument('--capacity', type=int, default=1, help='Concurrent orders per washer (default: 1)')
+        parser.add_argument('--tick', type=float, default=1, help='Minutes between coalesced dispatch passes (default: 1)')
+        parser.add_argument('--matching', choices=['greedy', 'optimal'], help='Override DISPATCH_MATCHING')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--db', help='Scratch SQLite database file, replaced if it exists (default: in memory)')
+        parser.add_argument('--keep-db', action='store_true', help='Keep the --db file afterwards')
+
+    def handle(self, *args, **options):
+        from clients.simulation import OperationsSimulator, scratch_database
+
+        # Runs on its own SQLite database whatever the configured one is,
+        # so it is safe to point at production settings
+        scratch = options['db'] or ':memory:'
+        if options['db'] and os.path.exists(scratch):
+            os.remove(scratch)
+
+        self.stdout.write(f'Building scratch database {"in memory" if scratch == ":memory:" else f"at {scratch}"}...')
+        try:
+            with scratch_database(scratch):
+                simulator = OperationsSimulator(
+                    hours=options['hours'],
+                    washers=options['washers'],
+                    arrivals_per_hour=options['rate'] * options['multiplier'],
+                    appointment_share=options['appointments'],
+                    cancel_rate=options['cancel_rate'],
+                    shift_hours=options['shift_hours'],
+                    washer_capacity=options['capacity'],
+                    tick_minutes=options['tick'],
+                    matching=options['matching'],
+                    seed=options['seed'],
+                )
+                started = time.perf_counter()
+                summary = simulator.run()
+                elapsed = time.perf_counter() - started
+        finally:
+            if options['db'] and not options['keep_db'] and os.path.exists(scratch):
+                os.remove(scratch)
+
+        self.report(summary, elapsed)
+
+    def report(self, s, elapsed):
+        def minutes(value):
+            return 'n/a' if value is None else f'{value:.1f} min'
+
+        self.stdout.write(self.style.SUCCESS(f"\n=== Simulated {s['hours']} hours in {elapsed:.1f}s ==="))
+        self.stdout.write(f"  Arrivals: {s['arrivals']} ({s['walk_ins']} walk-in, {s['appointments']} appointments, "
+                          f"{s['booking_rejected']} bookings rejected)")
+        self.stdout.write(f"  Cancelled: {s['cancelled']}")
+        self.stdout.write(f"  Dispatched: {s['dispatched']}, completed: {s['completed']}")
+        self.stdout.write(f"  Throughput: {s['throughput_per_hour']:.1f} washes/hour")
+        self.stdout.write(f"  Queue length: avg {s['avg_queue']:.1f}, max {s['max_queue']}")
+        self.stdout.write(f"  Washer utilization: {s['utilization'] * 100:.1f}%")
+        self.stdout.write(f"  Wait: p50 {minutes(s['wait_p50'])}, p95 {minutes(s['wait_p95'])}")
+        qpp, qpo = s['queries_per_dispatch_pass'], s['queries_per_dispatched_order']
+        self.stdout.write(f"  Dispatch passes: {s['dispatch_passes']} ({s['empty_dispatch_passes']} assigned nothing), "
+                          f"queries per pass: {'n/a' if qpp is None else f'{qpp:.2f}'}, "
+                          f"per dispatched order: {'n/a' if qpo is None else f'{qpo:.2f}'}")
+        ratio = s['availability_hit_ratio']
+        self.stdout.write(f"  Availability cache: {s['availability_hits']} hits, {s['availability_misses']} misses "
+                          f"({'n/a' if ratio is None else f'{ratio * 100:.1f}%'} hit ratio)")
@@ -0,0 +1,155 @@
+# clients/matching.py
+"""
+Optimal batch matching of pending orders to free washers.
+
+Greedy one-at-a-time assignment can hand a deluxe wash to a low-rated
+washer while a top-rated washer gets a basic one. When several washers are
+free at once, build a cost matrix over (order, washer) pairs and solve it
+as an assignment problem instead.
+
+The problem is solved with scipy's linear_sum_assignment (numpy and scipy
+are in requirements.txt), which takes a few milliseconds for hundreds of
+orders by hundreds of washer slots. Where they are missing, a pure-Python
+Hungarian algorithm (shortest augmenting paths, O(n^2 m)) solves batches
+up to PURE_PYTHON_MAX_CELLS (see can_solve()) and dispatch matches bigger
+ones greedily.
+"""
+try:
+    import numpy as np
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # an install that predates the requirement
+    np = None
+    linear_sum_assignment = None
+
+# How much one minute of waiting is worth compared with a better pairing
+WAIT_WEIGHT = 0.05
+# Value of the job; bigger washes benefit more from a better washer
+WASH_TYPE_WEIGHT = {'basic': 1, 'premium': 2, 'deluxe': 3}
+# Cost per currency unit of the washer's hourly rate
+RATE_WEIGHT = 0.02
+DEFAULT_RATING = 3.0
+# Largest orders x washer slots problem the pure-Python solver takes on
+# (about 0.1s); 200 x 600 takes seconds, so bigger ones are matched greedily
+PURE_PYTHON_MAX_CELLS = 10_000
+
+
+def _order_terms(order, now):
+    value = WASH_TYPE_WEIGHT.get(order.wash_type, 1)
+    wait_minutes = (now - order.created_at).total_seconds() / 60
+    return value, wait_minutes * WAIT_WEIGHT
+
+
+def _washer_terms(washer):
+    rating = washer.rating if washer.rating is not None else DEFAULT_RATING
+    return float(rating) / 5, float(washer.hourly_rate or 0) * RATE_WEIGHT
+
+
+def build_cost_matrix(orders, washers, now):
+    """
+    Rows are orders, columns are washer capacity slots; lower is better.
+
+    cost = -(job value * washer quality * 10 + wait bonus) + rate cost
+
+    The value x quality term sends the best washers to the biggest jobs;
+    the wait term decides which orders get served first when there are
+    more orders than washers. Built as an outer product with numpy when
+    it is available.
+    """
+    order_terms = [_order_terms(order, now) for order in orders]
+    washer_terms = [_washer_terms(washer) for washer in washers]
+
+    if np is not None:
+        values, waits = np.array(order_terms, dtype=float).reshape(-1, 2).T
+        qualities, rates = np.array(washer_terms, dtype=float).reshape(-1, 2).T
+        return rates[np.newaxis, :] - np.outer(values, qualities) * 10 - waits[:, np.newaxis]
+
+    return [
+        [rate - (value * quality * 10 + wait) for quality, rate in washer_terms]
+        for value, wait in order_terms
+    ]
+
+
+def can_solve(orders, slots):
+    """Whether an orders x washer slots assignment problem is cheap enough to solve here"""
+    return linear_sum_assignment is not None or orders * slots <= PURE_PYTHON_MAX_CELLS
+
+
+def solve_assignment(cost):
+    """
+    Minimum-cost assignment for a rectangular cost matrix.
+    Returns a list of (row, col) pairs, one per row or column, whichever
+    is fewer.
+    """
+    if len(cost) == 0 or len(cost[0]) == 0:
+        return []
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(cost)
+        return list(zip(rows.tolist(), cols.tolist()))
+
+    if len(cost) > len(cost[0]):
+        transposed = [list(column) for column in zip(*cost)]
+        return [(row, col) for col, row in _hungarian(transposed)]
+    return _hungarian(cost)
+
+
+def _hungarian(cost):
+    """Hungarian algorithm with potentials; requires rows <= columns"""
+    n, m = len(cost), len(cost[0])
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    match = [0] * (m + 1)  # match[col] = row assigned to col (1-based, 0 = free)
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = cost[i0 - 1]
+            ui0 = u[i0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    reduced = row[j - 1] - ui0 - v[j]
+                    if reduced < minv[j]:
+                        minv[j] = reduced
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    return sorted((match[j] - 1, j - 1) for j in range(1, m + 1) if match[j])
+
+
+def free_slots(washers):
+    """Each washer once per order it has room for"""
+    return [washer for washer in washers for _ in range(max(0, washer.capacity - washer.load))]
+
+
+def optimal_pairs(orders, washers, now):
+    """
+    Pair orders with washers to minimise total cost. A washer with room for
+    several orders appears once per free slot. Returns (order, washer) pairs.
+    """
+    slots = free_slots(washers)
+    cost = build_cost_matrix(orders, slots, now)
+    return [(orders[row], slots[col]) for row, col in solve_assignment(cost)]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.13 on 2026-10-17 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0004_merge_20251125_2043'),
+        ('washers', '0003_washer_active_order_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='washorder',
+            name='release_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='washorder',
+            index=models.Index(fields=['status', 'release_at'], name='wash_orders_release_idx'),
+        ),
+    ]
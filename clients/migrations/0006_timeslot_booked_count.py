@@ -0,0 +1,32 @@
+# Generated by Django 5.1.13 on 2026-10-17 21:05
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_booked_counts(apps, schema_editor):
+    """Seed the counter from each slot's non-cancelled appointments"""
+    TimeSlot = apps.get_model('clients', 'TimeSlot')
+
+    counts = TimeSlot.objects.annotate(
+        actual=Count('appointments', filter=Q(appointments__is_cancelled=False))
+    ).filter(actual__gt=0).values_list('id', 'actual')
+
+    for slot_id, actual in counts:
+        TimeSlot.objects.filter(id=slot_id).update(booked_count=actual)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0005_washorder_release_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='booked_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_booked_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.13 on 2026-10-17 17:37
+
+import datetime
+
+from django.db import migrations, models
+
+
+def create_standard_hours(apps, schema_editor):
+    """The hours the create_time_slots command used to hard-code"""
+    ScheduleTemplate = apps.get_model('clients', 'ScheduleTemplate')
+    ScheduleTemplate.objects.create(
+        name='Standard hours',
+        weekdays='0,1,2,3,4,5',
+        opens_at=datetime.time(8, 0),
+        closes_at=datetime.time(17, 0),
+        slot_minutes=60,
+        break_start=datetime.time(12, 0),
+        break_end=datetime.time(13, 0),
+        max_capacity=3,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0006_timeslot_booked_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+            ],
+            options={
+                'db_table': 'schedule_closures',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ScheduleTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('weekdays', models.CharField(default='0,1,2,3,4,5', max_length=20)),
+                ('opens_at', models.TimeField()),
+                ('closes_at', models.TimeField()),
+                ('slot_minutes', models.PositiveIntegerField(default=60)),
+                ('break_start', models.TimeField(blank=True, null=True)),
+                ('break_end', models.TimeField(blank=True, null=True)),
+                ('max_capacity', models.PositiveIntegerField(default=3)),
+                ('valid_from', models.DateField(blank=True, null=True)),
+                ('valid_until', models.DateField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'schedule_templates',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(create_standard_hours, migrations.RunPython.noop),
+    ]
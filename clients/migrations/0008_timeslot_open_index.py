@@ -0,0 +1,17 @@
+# Generated by Django 5.1.13 on 2026-10-17 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0007_schedule_templates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(condition=models.Q(('booked_count__lt', models.F('max_capacity')), ('is_active', True)), fields=['date', 'start_time'], name='time_slots_open_idx'),
+        ),
+    ]
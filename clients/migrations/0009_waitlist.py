@@ -0,0 +1,35 @@
+# Generated by Django 5.1.13 on 2026-10-17 17:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0008_timeslot_open_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wash_type', models.CharField(choices=[('basic', 'Basic Wash'), ('premium', 'Premium Wash'), ('deluxe', 'Deluxe Wash')], default='basic', max_length=20)),
+                ('special_instructions', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('promoted', 'Promoted'), ('withdrawn', 'Withdrawn')], default='waiting', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('promoted_at', models.DateTimeField(blank=True, null=True)),
+                ('appointment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entry', to='clients.appointment')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='clients.client')),
+                ('time_slot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='clients.timeslot')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clients.vehicle')),
+            ],
+            options={
+                'verbose_name_plural': 'waitlist entries',
+                'db_table': 'waitlist_entries',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['time_slot', 'status', 'created_at'], name='waitlist_promotion_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.13 on 2026-10-17 17:52
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+# The wash durations when bay-minute capacity was introduced
+DURATION_MINUTES = {'basic': 20, 'premium': 45, 'deluxe': 90}
+
+
+def populate_bay_minutes(apps, schema_editor):
+    """
+    Slot lengths, each live appointment's minutes, and the minutes booked
+    in each slot, with washes longer than their slot running on into the
+    next one
+    """
+    TimeSlot = apps.get_model('clients', 'TimeSlot')
+    Appointment = apps.get_model('clients', 'Appointment')
+
+    slots = {}
+    for slot in TimeSlot.objects.all():
+        slot.length_minutes = max(0, (slot.end_time.hour * 60 + slot.end_time.minute)
+                                  - (slot.start_time.hour * 60 + slot.start_time.minute))
+        slot.booked_minutes = 0
+        slots[slot.id] = slot
+    by_position = {(slot.date, slot.start_time): slot for slot in slots.values()}
+
+    appointments = list(Appointment.objects.filter(is_cancelled=False))
+    for appointment in appointments:
+        appointment.booked_minutes = DURATION_MINUTES.get(appointment.wash_type, 20)
+        slot = slots[appointment.time_slot_id]
+        here = min(appointment.booked_minutes, slot.length_minutes)
+        slot.booked_minutes += here
+        next_slot = by_position.get((slot.date, slot.end_time))
+        if next_slot is not None and appointment.booked_minutes > here:
+            next_slot.booked_minutes += min(appointment.booked_minutes - here, next_slot.length_minutes)
+
+    TimeSlot.objects.bulk_update(slots.values(), ['length_minutes', 'booked_minutes'], batch_size=500)
+    Appointment.objects.bulk_update(appointments, ['booked_minutes'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0009_waitlist'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timeslot',
+            name='time_slots_open_idx',
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='booked_minutes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='timeslot',
+            name='booked_minutes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='timeslot',
+            name='length_minutes',
+            field=models.PositiveIntegerField(default=60),
+        ),
+        migrations.RunPython(populate_bay_minutes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(condition=models.Q(('booked_minutes__lt', django.db.models.expressions.CombinedExpression(models.F('max_capacity'), '*', models.F('length_minutes'))), ('is_active', True)), fields=['date', 'start_time'], name='time_slots_open_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.13 on 2026-10-17 18:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_order_stats(apps, schema_editor):
+    """Seed the rollup from the existing orders (as rollups.rebuild() does), so it starts out complete"""
+    WashOrder = apps.get_model('clients', 'WashOrder')
+    DailyOrderStats = apps.get_model('clients', 'DailyOrderStats')
+
+    service = ExpressionWrapper(F('completed_at') - F('started_at'), output_field=DurationField())
+    timed = Q(status='completed', started_at__isnull=False, completed_at__isnull=False)
+    groups = WashOrder.objects.annotate(
+        day=TruncDate('created_at')
+    ).values(
+        'day', 'wash_type', 'status', 'washer_id'
+    ).annotate(
+        order_count=Count('order_id'),
+        order_revenue=Sum('price'),
+        service=Sum(service, filter=timed),
+        timed=Count('order_id', filter=timed)
+    ).order_by()
+
+    DailyOrderStats.objects.bulk_create([
+        DailyOrderStats(
+            date=group['day'], wash_type=group['wash_type'], status=group['status'],
+            washer_id=group['washer_id'], orders=group['order_count'],
+            revenue=group['order_revenue'] or 0,
+            service_seconds=int(group['service'].total_seconds()) if group['service'] else 0,
+            timed_orders=group['timed']
+        )
+        for group in groups
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0010_bay_minutes'),
+        ('washers', '0004_washer_max_concurrent_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('wash_type', models.CharField(choices=[('basic', 'Basic Wash'), ('premium', 'Premium Wash'), ('deluxe', 'Deluxe Wash')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('scheduled', 'Scheduled'), ('assigned', 'Assigned'), ('in_progress', 'In Progress'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('service_seconds', models.BigIntegerField(default=0)),
+                ('timed_orders', models.IntegerField(default=0)),
+                ('washer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='washers.washer')),
+            ],
+            options={
+                'db_table': 'daily_order_stats',
+                'indexes': [models.Index(fields=['date', 'status'], name='daily_order_stats_date_idx')],
+            },
+        ),
+        migrations.RunPython(populate_daily_order_stats, migrations.RunPython.noop),
+    ]
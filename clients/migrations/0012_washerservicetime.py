@@ -0,0 +1,49 @@
+# Generated by Django 5.1.13 on 2026-10-17 18:14
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_service_times(apps, schema_editor):
+    """Seed the histogram from the completed orders that have both timestamps"""
+    WashOrder = apps.get_model('clients', 'WashOrder')
+    WasherServiceTime = apps.get_model('clients', 'WasherServiceTime')
+
+    buckets = Counter()
+    timed = WashOrder.objects.filter(
+        status='completed', washer__isnull=False, started_at__isnull=False, completed_at__isnull=False
+    ).values_list('washer_id', 'started_at', 'completed_at')
+    for washer_id, started_at, completed_at in timed.iterator():
+        buckets[washer_id, max(0, round((completed_at - started_at).total_seconds() / 60))] += 1
+
+    WasherServiceTime.objects.bulk_create([
+        WasherServiceTime(washer_id=washer_id, minutes=minutes, orders=orders)
+        for (washer_id, minutes), orders in buckets.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0011_daily_order_stats'),
+        ('washers', '0005_washer_rating_count_washer_rating_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WasherServiceTime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minutes', models.PositiveIntegerField()),
+                ('orders', models.IntegerField(default=0)),
+                ('washer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_times', to='washers.washer')),
+            ],
+            options={
+                'db_table': 'washer_service_times',
+                'unique_together': {('washer', 'minutes')},
+            },
+        ),
+        migrations.RunPython(populate_service_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.13 on 2026-10-17 18:25
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    """Fill in washer_key and fold rows sharing a key into one before the constraint goes on"""
+    DailyOrderStats = apps.get_model('clients', 'DailyOrderStats')
+
+    DailyOrderStats.objects.filter(washer__isnull=False).update(washer_key=models.F('washer_id'))
+
+    rows = defaultdict(list)
+    for row in DailyOrderStats.objects.order_by('id').iterator():
+        rows[row.date, row.wash_type, row.status, row.washer_key].append(row)
+    for kept, *duplicates in rows.values():
+        if not duplicates:
+            continue
+        for row in duplicates:
+            kept.orders += row.orders
+            kept.revenue += row.revenue
+            kept.service_seconds += row.service_seconds
+            kept.timed_orders += row.timed_orders
+        kept.save(update_fields=['orders', 'revenue', 'service_seconds', 'timed_orders'])
+        DailyOrderStats.objects.filter(id__in=[row.id for row in duplicates]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0012_washerservicetime'),
+        ('washers', '0005_washer_rating_count_washer_rating_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleRollupDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('marked_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'stale_rollup_days',
+            },
+        ),
+        migrations.AddField(
+            model_name='dailyorderstats',
+            name='washer_key',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyorderstats',
+            constraint=models.UniqueConstraint(fields=('date', 'wash_type', 'status', 'washer_key'), name='daily_order_stats_key'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.hashers import make_password, check_password
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils import timezone
@@ -85,6 +85,16 @@ class WashOrder(models.Model):
         ('premium', 'Premium Wash'),
         ('deluxe', 'Deluxe Wash'),
     ]
+    
+    # Bay-minutes per wash type; override with settings.WASH_DURATION_MINUTES
+    DURATION_MINUTES = {
+        'basic': 20,
+        'premium': 45,
+        'deluxe': 90,
+    }
+    
+    # Statuses that keep a washer busy
+    ACTIVE_STATUSES = ['assigned', 'in_progress']
 
     order_id = models.AutoField(primary_key=True)
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
@@ -99,56 +109,424 @@ class WashOrder(models.Model):
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     client_notified = models.BooleanField(default=False)
+    # When a 'scheduled' appointment order joins the dispatch queue
+    release_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'wash_orders'
+        indexes = [
+            # Next-release lookups for held appointment orders
+            models.Index(fields=['status', 'release_at'], name='wash_orders_release_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.order_id} - {self.vehicle} ({self.status})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the assignment as loaded so clean() can skip re-checking it
+        instance._loaded_assignment = (instance.__dict__.get('washer_id'), instance.__dict__.get('status'))
+        # and the daily rollup share, so an edit moves it with a delta
+        instance._loaded_rollup = rollup_snapshot(instance)
+        return instance
+    
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # Partly refreshed, the rest may hold unsaved edits; the rollup rebuilds the day
+        self._loaded_rollup = rollup_snapshot(self) if fields is None else None
+    
     def clean(self):
-        """Validate that washer doesn't have multiple active orders"""
+        """Validate that the washer has capacity for another active order"""
         from django.core.exceptions import ValidationError
+        from washers.models import Washer
+        
+        # The washer already held this order when it was loaded (e.g. starting
+        # or re-saving an assigned order), so it takes no extra capacity
+        loaded_washer_id, loaded_status = getattr(self, '_loaded_assignment', (None, None))
+        if (self.washer_id is not None and self.washer_id == loaded_washer_id
+                and loaded_status in self.ACTIVE_STATUSES):
+            return
         
-        if self.washer and self.status in ['assigned', 'in_progress']:
-            # Check if washer already has active orders (excluding current order)
-            existing_orders = WashOrder.objects.filter(
-                washer=self.washer,
-                status__in=['assigned', 'in_progress']
-            ).exclude(order_id=self.order_id)
+        if self.washer_id and self.status in self.ACTIVE_STATUSES:
+            # Read the maintained counter instead of counting orders
+            capacity = Washer.objects.filter(
+                washer_id=self.washer_id,
+                active_order_count__gte=models.F('max_concurrent_orders')
+            ).values_list('max_concurrent_orders', flat=True).first()
             
-            if existing_orders.exists():
+            if capacity is not None:
                 raise ValidationError(
-                    f'Washer {self.washer.full_name} already has {existing_orders.count()} active order(s). '
-                    f'A washer can only handle one order at a time.'
+                    f'Washer {self.washer.full_name} already has {capacity} active order(s). '
+                    f'This washer can only handle {capacity} order(s) at a time.'
                 )
     
     def save(self, *args, **kwargs):
-        """Override save to run validation"""
+        """Override save to run validation and keep the washer's load counter in sync"""
+        from django.core.exceptions import ValidationError
+        from washers.models import Washer
+        from .events import capacity_freed
+        
         self.clean()
-        super().save(*args, **kwargs)
+        
+        loaded_washer_id, loaded_status = getattr(self, '_loaded_assignment', (None, None))
+        held_by = loaded_washer_id if loaded_status in self.ACTIVE_STATUSES else None
+        now_held_by = self.washer_id if self.status in self.ACTIVE_STATUSES else None
+        
+        with transaction.atomic():
+            if held_by != now_held_by:
+                # The guarded reservation is what actually enforces capacity
+                # when two saves race past clean()
+                if now_held_by is not None and not Washer.reserve_order_slot(now_held_by):
+                    raise ValidationError(f'Washer #{now_held_by} has no capacity for another order.')
+                if held_by is not None:
+                    Washer.adjust_active_order_count(held_by, -1)
+            super().save(*args, **kwargs)
+        
+        if held_by is not None and held_by != now_held_by:
+            capacity_freed.send(sender=WashOrder, washer_id=held_by, reason=f'order_{self.status}')
+        
+        self._loaded_assignment = (self.washer_id, self.status)
+        self._loaded_rollup = rollup_snapshot(self)
+
+
+# The WashOrder fields its daily rollup (DailyOrderStats) share depends on
+ROLLUP_FIELDS = ('order_id', 'created_at', 'wash_type', 'status', 'price', 'washer_id', 'started_at', 'completed_at')
+
+
+def rollup_snapshot(order):
+    """The order's ROLLUP_FIELDS values, or None if any of them weren't loaded"""
+    loaded = order.__dict__
+    if any(field not in loaded for field in ROLLUP_FIELDS):
+        return None
+    return tuple(loaded[field] for field in ROLLUP_FIELDS)
+
+
+def wash_minutes(wash_type):
+    """Bay-minutes a wash of this type takes (settings.WASH_DURATION_MINUTES)"""
+    from django.conf import settings
+    
+    durations = getattr(settings, 'WASH_DURATION_MINUTES', WashOrder.DURATION_MINUTES)
+    return durations.get(wash_type, durations['basic'])
+
+
+def shortest_wash_minutes():
+    from django.conf import settings
+    return min(getattr(settings, 'WASH_DURATION_MINUTES', WashOrder.DURATION_MINUTES).values())
+
+
+def minutes_between(start_time, end_time):
+    """Length in minutes of a same-day time range"""
+    return max(0, (end_time.hour * 60 + end_time.minute) - (start_time.hour * 60 + start_time.minute))
+
+
+class TimeSlotQuerySet(models.QuerySet):
+    """Slot lookups with availability worked out in the same query"""
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for slot in objs:
+            slot.length_minutes = minutes_between(slot.start_time, slot.end_time)
+        return super().bulk_create(objs, *args, **kwargs)
+    
+    def with_availability(self):
+        """
+        Annotate booked (appointments starting in the slot), bay_minutes
+        (bays x slot length) and remaining (free bay-minutes), read from the
+        maintained booked_count and booked_minutes columns
+        """
+        from django.db.models import F, IntegerField, Value
+        from django.db.models.functions import Greatest
+        
+        return self.annotate(
+            booked=F('booked_count'),
+            bay_minutes=F('max_capacity') * F('length_minutes'),
+            remaining=Greatest(
+                F('max_capacity') * F('length_minutes') - F('booked_minutes'), Value(0),
+                output_field=IntegerField()
+            )
+        )
+    
+    def bookable(self):
+        """
+        Active slots with room for at least the shortest wash, annotated as
+        with_availability()
+        """
+        from django.db.models import F
+        
+        # The first condition is the open-slot index's, so the index is used
+        return self.filter(
+            is_active=True, booked_minutes__lt=F('max_capacity') * F('length_minutes')
+        ).with_availability().filter(remaining__gte=shortest_wash_minutes())
 
 
 class TimeSlot(models.Model):
-    """Available time slots for appointments"""
+    """
+    Available time slots for appointments. Capacity is counted in
+    bay-minutes: max_capacity bays for the length of the slot. A wash
+    takes its duration (see wash_minutes) out of the slot it is booked in;
+    if it is longer than the slot, the rest comes out of the slot that
+    starts when this one ends.
+    """
     date = models.DateField()
     start_time = models.TimeField()
     end_time = models.TimeField()
-    max_capacity = models.PositiveIntegerField(default=3)  # How many appointments can be booked
+    max_capacity = models.PositiveIntegerField(default=3)  # Wash bays working this slot
     is_active = models.BooleanField(default=True)
+    # Appointments starting in this slot, and the bay-minutes taken by them
+    # and by washes spilling over from the previous slot; maintained by
+    # reserve_spot()/release_spot()
+    booked_count = models.PositiveIntegerField(default=0)
+    booked_minutes = models.PositiveIntegerField(default=0)
+    # end_time - start_time, kept by save() and bulk_create() for queries
+    length_minutes = models.PositiveIntegerField(default=60)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = TimeSlotQuerySet.as_manager()
+    
     class Meta:
         db_table = 'time_slots'
         ordering = ['date', 'start_time']
         unique_together = ['date', 'start_time']
+        indexes = [
+            # Forward scans for the next open slots (next_available_slots)
+            models.Index(
+                fields=['date', 'start_time'],
+                condition=models.Q(
+                    is_active=True,
+                    booked_minutes__lt=models.F('max_capacity') * models.F('length_minutes')
+                ),
+                name='time_slots_open_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.date} {self.start_time} - {self.end_time}"
     
+    def save(self, *args, **kwargs):
+        """Never write back stale booking counters from a full save"""
+        self.length_minutes = minutes_between(self.start_time, self.end_time)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ('booked_count', 'booked_minutes')
+            ]
+        super().save(*args, **kwargs)
+        
+        from .availability import invalidate_day
+        day = self.date
+        transaction.on_commit(lambda: invalidate_day(day))
+    
+    @property
+    def slot_key(self):
+        """Identifies the slot by date and start time, saved or not"""
+        return f"{self.date.isoformat()}T{self.start_time.strftime('%H:%M')}"
+    
+    @classmethod
+    def materialize(cls, slot):
+        """
+        The saved row for a slot, inserting it if it only exists virtually.
+        Concurrent first bookings are resolved by the unique (date, start_time).
+        """
+        if slot.pk:
+            return slot
+        row, _ = cls.objects.get_or_create(
+            date=slot.date,
+            start_time=slot.start_time,
+            defaults={'end_time': slot.end_time, 'max_capacity': slot.max_capacity}
+        )
+        return row
+    
+    @classmethod
+    def following(cls, slot_id):
+        """
+        (slot, next slot) for the given slot id in one query, next being
+        the slot that starts when this one ends, or None
+        """
+        this = cls.objects.filter(id=slot_id)
+        rows = list(cls.objects.filter(
+            models.Q(id=slot_id) | models.Q(
+                date=models.Subquery(this.values('date')),
+                start_time=models.Subquery(this.values('end_time'))
+            )
+        ))
+        slot = next((row for row in rows if row.id == slot_id), None)
+        next_slot = next((row for row in rows if row.id != slot_id), None)
+        return slot, next_slot
+    
+    @classmethod
+    def virtual_at(cls, day, start_time):
+        """The unsaved template slot at this date and time, if any (virtual mode)"""
+        from .scheduling import desired_slots, virtual_slots_enabled
+        
+        if not virtual_slots_enabled():
+            return None
+        found = desired_slots(day, day).get((day, start_time))
+        if found is None:
+            return None
+        end_time, max_capacity = found
+        return cls(
+            date=day, start_time=start_time, end_time=end_time, max_capacity=max_capacity,
+            length_minutes=minutes_between(start_time, end_time)
+        )
+    
+    def split(self, minutes, next_slot=None):
+        """
+        [(slot, bay-minutes)] a wash of `minutes` takes, starting in this
+        slot, or None if it runs on past the end of the next slot (or there
+        is no next slot to run into)
+        """
+        here = min(minutes, self.length_minutes)
+        spill = minutes - here
+        if not spill:
+            return [(self, here)]
+        if next_slot is None or spill > next_slot.length_minutes:
+            return None
+        return [(self, here), (next_slot, spill)]
+    
+    def fits(self, minutes, next_slot=None):
+        """True if a wash of `minutes` can start in this slot"""
+        parts = self.split(minutes, next_slot)
+        return parts is not None and all(
+            slot.is_active and slot.available_minutes >= taken for slot, taken in parts
+        )
+    
+    def has_room_for(self, minutes):
+        """
+        True if a wash of `minutes` can be booked to start in this slot,
+        going by the free minutes loaded with it (reserve_spot() has the
+        final say)
+        """
+        if self.is_past or not self.is_active:
+            return False
+        next_slot = None
+        if minutes > self.length_minutes:
+            next_slot = (
+                TimeSlot.objects.filter(date=self.date, start_time=self.end_time).first()
+                or TimeSlot.virtual_at(self.date, self.end_time)
+            )
+        return self.fits(minutes, next_slot)
+    
+    @staticmethod
+    def booking_changes(parts):
+        """{slot id: (bay-minutes, bookings)} for one booking's split()"""
+        return {slot.id: (taken, 1 if i == 0 else 0) for i, (slot, taken) in enumerate(parts)}
+    
+    @staticmethod
+    def change_bookings(changes, sign=1):
+        """
+        Add (sign=1) or take back (sign=-1) bookings given as {slot id:
+        (bay-minutes, bookings)} with a single UPDATE. Adding is guarded by
+        each slot's capacity and is all or nothing; returns True if it
+        happened.
+        """
+        from django.db.models import Case, IntegerField, Value, When
+        from django.db.models.functions import Greatest
+        
+        def per_slot(index):
+            return Case(
+                *[When(id=slot_id, then=Value(change[index])) for slot_id, change in changes.items()],
+                default=Value(0), output_field=IntegerField()
+            )
+        minutes, bookings = per_slot(0), per_slot(1)
+        rows = TimeSlot.objects.filter(id__in=list(changes))
+        
+        if sign < 0:
+            rows.update(
+                booked_minutes=Greatest(models.F('booked_minutes') - minutes, Value(0)),
+                booked_count=Greatest(models.F('booked_count') - bookings, Value(0))
+            )
+            return True
+        
+        with transaction.atomic():
+            updated = rows.filter(
+                booked_minutes__lte=models.F('max_capacity') * models.F('length_minutes') - minutes
+            ).update(
+                booked_minutes=models.F('booked_minutes') + minutes,
+                booked_count=models.F('booked_count') + bookings
+            )
+            if updated != len(changes):
+                transaction.set_rollback(True)
+                return False
+        return True
+    
+    @staticmethod
+    def reserve_spot(slot_id, minutes, slot=None):
+        """
+        Book a wash of `minutes` starting in the slot (and spilling into the
+        next one if it has to) if there is room. Either way the booking is a
+        single guarded UPDATE, so concurrent bookings can't overbook; the
+        slot and the one after it are only read for a wash that may spill.
+        Pass the slot as the caller loaded it, if at hand, to skip the
+        single-slot attempt for a wash longer than the slot. Returns True
+        if booked.
+        """
+        # Most washes fit in their slot: try that with the UPDATE alone
+        if (slot is None or minutes <= slot.length_minutes) and TimeSlot.objects.filter(
+            id=slot_id, is_active=True, length_minutes__gte=minutes,
+            booked_minutes__lte=models.F('max_capacity') * models.F('length_minutes') - minutes
+        ).update(
+            booked_minutes=models.F('booked_minutes') + minutes,
+            booked_count=models.F('booked_count') + 1
+        ):
+            TimeSlot._refresh_calendar(slot_id, slot.date if slot else None)
+            return True
+        
+        slot, next_slot = TimeSlot.following(slot_id)
+        if slot is not None and slot.length_minutes >= minutes:
+            return False
+        if slot is not None and next_slot is None and minutes > slot.length_minutes:
+            # Spilling into a slot that only exists in a template so far
+            next_slot = TimeSlot.virtual_at(slot.date, slot.end_time)
+            if next_slot is not None:
+                next_slot = TimeSlot.materialize(next_slot)
+        parts = slot.split(minutes, next_slot) if slot and slot.is_active else None
+        if parts is None or any(not part.is_active for part, _ in parts):
+            return False
+        
+        reserved = TimeSlot.change_bookings(TimeSlot.booking_changes(parts))
+        if reserved:
+            TimeSlot._refresh_calendar(slot_id, slot.date)
+        return reserved
+    
+    @staticmethod
+    def release_spot(slot_id, minutes):
+        """Give back a booking of `minutes` made with reserve_spot()"""
+        from django.db.models import Value
+        from django.db.models.functions import Greatest
+        from .waitlist import spot_released
+        
+        if TimeSlot.objects.filter(id=slot_id, length_minutes__gte=minutes).update(
+            booked_minutes=Greatest(models.F('booked_minutes') - minutes, Value(0)),
+            booked_count=Greatest(models.F('booked_count') - 1, Value(0))
+        ):
+            TimeSlot._refresh_calendar(slot_id)
+            spot_released(slot_id)
+            return True
+        
+        slot, next_slot = TimeSlot.following(slot_id)
+        if slot is None:
+            return False
+        parts = slot.split(minutes, next_slot) or [(slot, min(minutes, slot.length_minutes))]
+        
+        TimeSlot.change_bookings(TimeSlot.booking_changes(parts), -1)
+        TimeSlot._refresh_calendar(slot_id)
+        for part, _ in parts:
+            spot_released(part.id)
+        return True
+    
+    @staticmethod
+    def _refresh_calendar(slot_id, day=None):
+        """Invalidate the slot's cached date (looked up if not given) once the change commits"""
+        from .availability import invalidate_day, slot_changed
+        if day is not None:
+            transaction.on_commit(lambda: invalidate_day(day))
+        else:
+            transaction.on_commit(lambda: slot_changed(slot_id))
+    
     @property
     def is_past(self):
         """Check if this time slot is in the past"""
@@ -166,23 +544,107 @@ class TimeSlot(models.Model):
     
     @property
     def is_available(self):
-        """Check if this time slot has available capacity"""
+        """Check if this time slot has room for at least the shortest wash"""
         if self.is_past or not self.is_active:
             return False
         
-        booked_count = self.appointments.filter(is_cancelled=False).count()
-        return booked_count < self.max_capacity
+        return self.available_spots > 0
+    
+    @property
+    def capacity_minutes(self):
+        return self.max_capacity * self.length_minutes
+    
+    @property
+    def available_minutes(self):
+        """Free bay-minutes"""
+        return max(0, self.capacity_minutes - self.booked_minutes)
     
     @property
     def available_spots(self):
-        """Get number of available spots"""
-        booked_count = self.appointments.filter(is_cancelled=False).count()
-        return max(0, self.max_capacity - booked_count)
+        """How many more of the shortest wash would fit"""
+        return self.available_minutes // shortest_wash_minutes()
     
     @property
     def booking_count(self):
         """Get current booking count"""
-        return self.appointments.filter(is_cancelled=False).count()
+        return self.booked_count
+
+
+class ScheduleTemplate(models.Model):
+    """Recurring opening hours that time slots are generated from"""
+    WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    
+    name = models.CharField(max_length=100)
+    # Comma-separated weekday numbers, Monday=0 ... Sunday=6
+    weekdays = models.CharField(max_length=20, default='0,1,2,3,4,5')
+    opens_at = models.TimeField()
+    closes_at = models.TimeField()
+    slot_minutes = models.PositiveIntegerField(default=60)
+    # Optional break (e.g. lunch); no slot overlaps it
+    break_start = models.TimeField(null=True, blank=True)
+    break_end = models.TimeField(null=True, blank=True)
+    max_capacity = models.PositiveIntegerField(default=3)
+    valid_from = models.DateField(null=True, blank=True)
+    valid_until = models.DateField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'schedule_templates'
+        ordering = ['id']
+    
+    def __str__(self):
+        days = ', '.join(self.WEEKDAY_NAMES[day] for day in sorted(self.weekday_set))
+        return f"{self.name} ({days} {self.opens_at:%H:%M}-{self.closes_at:%H:%M})"
+    
+    @property
+    def weekday_set(self):
+        return {int(day) for day in self.weekdays.split(',') if day.strip()}
+    
+    def applies_to(self, day):
+        """Whether this template opens on the given date"""
+        if day.weekday() not in self.weekday_set:
+            return False
+        if self.valid_from and day < self.valid_from:
+            return False
+        if self.valid_until and day > self.valid_until:
+            return False
+        return True
+    
+    def slot_times(self):
+        """(start_time, end_time) for each slot of a day, skipping the break"""
+        from datetime import date, datetime, timedelta
+        
+        step = timedelta(minutes=self.slot_minutes)
+        current = datetime.combine(date.min, self.opens_at)
+        closes = datetime.combine(date.min, self.closes_at)
+        has_break = self.break_start is not None and self.break_end is not None
+        
+        times = []
+        while self.slot_minutes and current + step <= closes:
+            end = current + step
+            if has_break and current.time() < self.break_end and end.time() > self.break_start:
+                # Resume at the end of the break
+                current = datetime.combine(date.min, self.break_end)
+                continue
+            times.append((current.time(), end.time()))
+            current = end
+        return times
+
+
+class ScheduleClosure(models.Model):
+    """A date the business is closed (holiday); no slots are generated"""
+    date = models.DateField(unique=True)
+    reason = models.CharField(max_length=200, blank=True)
+    
+    class Meta:
+        db_table = 'schedule_closures'
+        ordering = ['date']
+    
+    def __str__(self):
+        return f"{self.date} closed" + (f" ({self.reason})" if self.reason else "")
 
 
 class Appointment(models.Model):
@@ -195,6 +657,8 @@ class Appointment(models.Model):
     # Appointment details
     wash_type = models.CharField(max_length=20, choices=WashOrder.WASH_TYPE_CHOICES, default='basic')
     special_instructions = models.TextField(blank=True)
+    # Bay-minutes reserved for the wash when it was booked
+    booked_minutes = models.PositiveIntegerField(default=0)
     
     # Status tracking
     is_confirmed = models.BooleanField(default=True)
@@ -219,53 +683,166 @@ class Appointment(models.Model):
         from django.utils import timezone
         return timezone.datetime.combine(self.time_slot.date, self.time_slot.start_time)
     
+    @property
+    def release_at(self):
+        """When this appointment's wash order should enter the dispatch queue"""
+        from django.conf import settings
+        
+        window = getattr(settings, 'APPOINTMENT_RELEASE_WINDOW_MINUTES', 60)
+        start = self.appointment_datetime
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        return start - timezone.timedelta(minutes=window)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The slot, bay-minutes and wash type this appointment holds as loaded, if any
+        loaded = instance.__dict__
+        instance._loaded_spot = None if loaded.get('is_cancelled') else (
+            loaded.get('time_slot_id'), loaded.get('booked_minutes'), loaded.get('wash_type')
+        )
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """Book, move or give back the time slot spot along with the row"""
+        from django.core.exceptions import ValidationError
+        
+        held_spot = getattr(self, '_loaded_spot', None)
+        if self.is_cancelled:
+            now_spot = None
+        elif held_spot is not None and held_spot[0] == self.time_slot_id and held_spot[2] == self.wash_type:
+            # Same slot and wash: keep the minutes it was booked with, even if
+            # the wash durations have been reconfigured since
+            now_spot = held_spot
+        else:
+            now_spot = (self.time_slot_id, wash_minutes(self.wash_type), self.wash_type)
+        
+        if held_spot == now_spot:
+            super().save(*args, **kwargs)
+            return
+        
+        with transaction.atomic():
+            # Give the old booking back first so moving within a slot (or
+            # changing the wash type) can reuse its minutes; the guarded
+            # reservation is what actually prevents overbooking when two
+            # bookings race past form validation
+            if held_spot is not None:
+                TimeSlot.release_spot(*held_spot[:2])
+            if now_spot is not None:
+                if not TimeSlot.reserve_spot(*now_spot[:2]):
+                    raise ValidationError('This time slot is fully booked.')
+                self.booked_minutes = now_spot[1]
+            super().save(*args, **kwargs)
+            
+            # A moved appointment's order is held or queued for the new slot
+            if held_spot is not None and now_spot is not None and held_spot[0] != now_spot[0] \
+                    and self.wash_order_id:
+                from .transitions import reschedule_order
+                reschedule_order(self.wash_order_id, self.release_at)
+        
+        self._loaded_spot = now_spot
+    
     def cancel_appointment(self, reason=""):
         """Cancel this appointment and free up the slot"""
+        from .transitions import cancel_order
+        
+        now = timezone.now()
+        with transaction.atomic():
+            # Only the call that actually cancels gives the spot back
+            cancelled = Appointment.objects.filter(id=self.id, is_cancelled=False).update(
+                is_cancelled=True,
+                cancellation_reason=reason,
+                cancelled_at=now,
+                updated_at=now
+            )
+            if not cancelled:
+                return False
+            TimeSlot.release_spot(self.time_slot_id, self.booked_minutes)
+        
         self.is_cancelled = True
         self.cancellation_reason = reason
-        self.cancelled_at = timezone.now()
-        self.save()
+        self.cancelled_at = now
+        self._loaded_spot = None
         
         # Cancel associated wash order if exists
-        if self.wash_order:
-            self.wash_order.status = 'cancelled'
-            self.wash_order.save()
+        if self.wash_order_id:
+            cancel_order(self.wash_order_id)
+        return True
+    
+    def build_wash_order(self):
+        """The unsaved wash order for this appointment"""
+        # Set price based on wash type
+        prices = {
+            'basic': 15.00,
+            'premium': 25.00,
+            'deluxe': 35.00
+        }
+        
+        # Hold the order until shortly before the slot so it doesn't
+        # tie up a washer today for a wash weeks away
+        release_at = self.release_at
+        
+        return WashOrder(
+            client=self.client,
+            vehicle=self.vehicle,
+            wash_type=self.wash_type,
+            price=prices.get(self.wash_type, 15.00),
+            notes=self.special_instructions,
+            status='scheduled' if release_at > timezone.now() else 'pending',
+            release_at=release_at
+        )
     
     def create_wash_order(self):
-        """Create a wash order from this appointment"""
+        """
+        Create the wash order for an appointment saved without one (new
+        bookings get theirs from clients.booking.book_appointment)
+        """
         if not self.wash_order:
-            try:
-                # Set price based on wash type
-                prices = {
-                    'basic': 15.00,
-                    'premium': 25.00,
-                    'deluxe': 35.00
-                }
-                
-                print(f"DEBUG: Creating wash order for appointment {self.id}")
-                print(f"DEBUG: Client: {self.client}, Vehicle: {self.vehicle}")
-                print(f"DEBUG: Wash type: {self.wash_type}, Price: {prices.get(self.wash_type, 15.00)}")
-                
-                order = WashOrder.objects.create(
-                    client=self.client,
-                    vehicle=self.vehicle,
-                    wash_type=self.wash_type,
-                    price=prices.get(self.wash_type, 15.00),
-                    notes=self.special_instructions,
-                    status='pending'  # New status for scheduled orders
-                )
-                
-                print(f"DEBUG: Wash order created successfully: {order.order_id}")
-                
+            with transaction.atomic():
+                order = self.build_wash_order()
+                order.save()
                 self.wash_order = order
-                self.save()
-                return order
-            except Exception as e:
-                print(f"ERROR: Failed to create wash order for appointment {self.id}: {e}")
-                raise e
+                self.save(update_fields=['wash_order', 'updated_at'])
+            return order
         return self.wash_order
 
 
+class WaitlistEntry(models.Model):
+    """A client waiting for a spot in a fully booked time slot"""
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('promoted', 'Promoted'),
+        ('withdrawn', 'Withdrawn'),
+    ]
+    
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='waitlist_entries')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE)
+    time_slot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE, related_name='waitlist_entries')
+    wash_type = models.CharField(max_length=20, choices=WashOrder.WASH_TYPE_CHOICES, default='basic')
+    special_instructions = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='waiting')
+    # The appointment made when the entry was promoted
+    appointment = models.OneToOneField(
+        Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_entry'
+    )
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    promoted_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'waitlist_entries'
+        ordering = ['created_at', 'id']
+        indexes = [
+            # Oldest waiting entries per slot, for promotion
+            models.Index(fields=['time_slot', 'status', 'created_at'], name='waitlist_promotion_idx'),
+        ]
+        verbose_name_plural = 'waitlist entries'
+    
+    def __str__(self):
+        return f"{self.client.first_name} waiting for {self.time_slot} ({self.status})"
+
+
 class Review(models.Model):
     """Client reviews for completed wash orders"""
     RATING_CHOICES = [
@@ -292,5 +869,81 @@ class Review(models.Model):
         db_table = 'reviews'
         ordering = ['-created_at']
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The washer the rating counts for as loaded, so a move recounts both
+        instance._loaded_washer_id = instance.__dict__.get('washer_id')
+        return instance
+    
+    def __str__(self):
+        return f"Review for Order #{self.wash_order.order_id} - {self.rating} stars"
+
+class DailyOrderStats(models.Model):
+    """
+    Wash orders rolled up by the date they were created, wash type, status
+    and washer. Kept up to date by clients.rollups as orders are created
+    and move between statuses; backfill_rollups rebuilds it from the orders.
+    """
+    date = models.DateField()
+    wash_type = models.CharField(max_length=20, choices=WashOrder.WASH_TYPE_CHOICES)
+    status = models.CharField(max_length=20, choices=WashOrder.STATUS_CHOICES)
+    washer = models.ForeignKey('washers.Washer', on_delete=models.SET_NULL, null=True, blank=True)
+    # The washer's id, or 0 for orders without one. Unlike the nullable
+    # foreign key it makes the unique row key cover unassigned orders too.
+    washer_key = models.PositiveIntegerField(default=0)
+    
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # completed_at - started_at summed over the orders that have both
+    service_seconds = models.BigIntegerField(default=0)
+    timed_orders = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'daily_order_stats'
+        indexes = [
+            models.Index(fields=['date', 'status'], name='daily_order_stats_date_idx'),
+        ]
+        constraints = [
+            # One row per key, so concurrent deltas can't each insert one
+            models.UniqueConstraint(
+                fields=['date', 'wash_type', 'status', 'washer_key'], name='daily_order_stats_key'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.wash_type}/{self.status}: {self.orders} order(s)"
+
+
+class StaleRollupDay(models.Model):
+    """
+    A day whose DailyOrderStats missed an update that failed after its
+    order change committed; backfill_rollups --stale rebuilds it.
+    """
+    date = models.DateField(unique=True)
+    marked_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'stale_rollup_days'
+    
+    def __str__(self):
+        return f"Rollup for {self.date} needs rebuilding"
+
+
+class WasherServiceTime(models.Model):
+    """
+    How many of a washer's completed orders took each whole number of
+    minutes (completed_at - started_at). A histogram, so service time
+    percentiles are read from a few rows per washer rather than every
+    order; maintained by clients.washer_stats.
+    """
+    washer = models.ForeignKey('washers.Washer', on_delete=models.CASCADE, related_name='service_times')
+    minutes = models.PositiveIntegerField()
+    orders = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'washer_service_times'
+        unique_together = ['washer', 'minutes']
+    
     def __str__(self):
-        return f"Review for Order #{self.wash_order.order_id} - {self.rating} stars"
\ No newline at end of file
+        return f"Washer #{self.washer_id}: {self.orders} order(s) in {self.minutes} min"
@@ -0,0 +1,355 @@
+# clients/rollups.py
+"""
+Daily order rollup (DailyOrderStats).
+
+One row per (created date, wash type, status, washer) holds the order
+count, revenue and summed service time of those orders, so analytics and
+dashboards sum a few rows per day instead of scanning wash_orders.
+
+The rollup is kept up to date with deltas rather than recounting:
+creating or deleting an order adds or takes away its row's share, and
+every transition (order_transitioned) moves the order's share from its old
+status to its new one. Edits through WashOrder.save() move the order's
+share from the row it was loaded in to the row it is saved in (an order
+saved without all its rollup fields loaded rebuilds its day instead).
+Each change is applied once its transaction commits, so a rolled back
+change never reaches the rollup; bursts (a dispatch pass, a bulk
+release) are gathered with batched() and applied together.
+
+Rows are unique per key and applied with an upsert, so concurrent deltas
+add up. A delta that runs into a lock (SQLite's write lock, a MySQL
+deadlock) is retried for up to RETRY_SECONDS; one that still fails after
+its order change committed is logged and its day marked stale
+(StaleRollupDay) for backfill_rollups --stale.
+
+rebuild() recomputes any range of days from the orders and
+drifted_days() checks one; backfill_rollups runs them over history in
+chunks.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ROLLUP_FIELDS, DailyOrderStats, StaleRollupDay, WashOrder
+
+
+QUEUED_STATUSES = ('pending', 'scheduled')
+# How long a delta blocked by a lock is retried before its day is marked stale
+RETRY_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _day(created_at):
+    return timezone.localtime(created_at).date() if timezone.is_aware(created_at) else created_at.date()
+
+
+def order_day(order):
+    """The rollup date of an order: the local date it was created"""
+    return _day(order.created_at)
+
+
+def _share(price, started_at, completed_at, status):
+    """(orders, revenue, service seconds, timed orders) one order adds to its row"""
+    seconds, timed = 0, 0
+    if status == 'completed' and started_at and completed_at:
+        seconds, timed = int((completed_at - started_at).total_seconds()), 1
+    return 1, Decimal(str(price)) if price is not None else Decimal('0.00'), seconds, timed
+
+
+def _add(changes, key, share, sign=1):
+    total = changes[key]
+    for i, value in enumerate(share):
+        total[i] += sign * value
+
+
+def _changes():
+    return defaultdict(lambda: [0, Decimal('0.00'), 0, 0])
+
+
+def order_changes(orders, sign=1):
+    """Rollup changes for adding (sign=1) or removing (sign=-1) WashOrders"""
+    changes = _changes()
+    for order in orders:
+        key = (order_day(order), order.wash_type, order.status, order.washer_id)
+        _add(changes, key, _share(order.price, order.started_at, order.completed_at, order.status), sign)
+    return changes
+
+
+def status_changes(orders, to_status):
+    """Rollup changes moving WashOrders, as loaded, to another status"""
+    changes = order_changes(orders, -1)
+    for order in orders:
+        key = (order_day(order), order.wash_type, to_status, order.washer_id)
+        _add(changes, key, _share(order.price, order.started_at, order.completed_at, to_status))
+    return changes
+
+
+def edit_changes(loaded, order):
+    """Rollup changes moving an edited WashOrder from its loaded ROLLUP_FIELDS snapshot to how it is now"""
+    changes = _changes()
+    _, created_at, wash_type, status, price, washer_id, started_at, completed_at = loaded
+    _add(changes, (_day(created_at), wash_type, status, washer_id),
+         _share(price, started_at, completed_at, status), -1)
+    _add(changes, (order_day(order), order.wash_type, order.status, order.washer_id),
+         _share(order.price, order.started_at, order.completed_at, order.status))
+    return changes
+
+
+def transition_changes(transitions):
+    """Rollup changes moving each transitioned order to its new status, from one query"""
+    rows = {
+        row[0]: row for row in WashOrder.objects.filter(
+            order_id__in={transition.order_id for transition in transitions}
+        ).values_list(*ROLLUP_FIELDS)
+    }
+    changes = _changes()
+    for transition in transitions:
+        row = rows.get(transition.order_id)
+        if row is None:
+            continue
+        _, created_at, wash_type, _, price, washer_id, started_at, completed_at = row
+        from_status = transition.from_statuses[0]
+        # A queued order had no washer until it was assigned
+        from_washer = None if from_status in QUEUED_STATUSES and transition.to_status == 'assigned' else washer_id
+        day = _day(created_at)
+        _add(changes, (day, wash_type, from_status, from_washer),
+             _share(price, started_at, completed_at, from_status), -1)
+        _add(changes, (day, wash_type, transition.to_status, washer_id),
+             _share(price, started_at, completed_at, transition.to_status))
+    return changes
+
+
+def _add_to_row(day, wash_type, status, washer_id, orders, revenue, seconds, timed):
+    return DailyOrderStats.objects.filter(
+        date=day, wash_type=wash_type, status=status, washer_key=washer_id or 0
+    ).update(
+        orders=F('orders') + orders,
+        revenue=F('revenue') + revenue,
+        service_seconds=F('service_seconds') + seconds,
+        timed_orders=F('timed_orders') + timed
+    )
+
+
+def apply(changes):
+    """Add {(date, wash_type, status, washer_id): [orders, revenue, seconds, timed]} to the rollup"""
+    with transaction.atomic():
+        for (day, wash_type, status, washer_id), share in changes.items():
+            if not any(share):
+                continue
+            if _add_to_row(day, wash_type, status, washer_id, *share):
+                continue
+            orders, revenue, seconds, timed = share
+            try:
+                with transaction.atomic():
+                    DailyOrderStats.objects.create(
+                        date=day, wash_type=wash_type, status=status, washer_id=washer_id,
+                        washer_key=washer_id or 0,
+                        orders=orders, revenue=revenue, service_seconds=seconds, timed_orders=timed
+                    )
+            except IntegrityError:
+                # Another transaction created the row since the update missed it
+                _add_to_row(day, wash_type, status, washer_id, *share)
+
+
+def _batch():
+    return getattr(_local, 'batch', None)
+
+
+def mark_stale(days=(), order_ids=()):
+    """Mark days (and the days of the orders) for backfill_rollups --stale to rebuild"""
+    days = set(days)
+    if order_ids:
+        days |= {
+            _day(created_at) for created_at in
+            WashOrder.objects.filter(order_id__in=set(order_ids)).values_list('created_at', flat=True)
+        }
+    for day in days:
+        # Re-marking an already stale day moves its marked_at, so a --stale run
+        # that started before this failure doesn't clear it
+        StaleRollupDay.objects.update_or_create(date=day)
+
+
+def stale_days():
+    """[(date, marked_at)] of the days marked stale, oldest first"""
+    return list(StaleRollupDay.objects.order_by('date').values_list('date', 'marked_at'))
+
+
+def clear_stale(start, end, marked_before=None):
+    """Unmark the days from start to end, only those marked before marked_before if given"""
+    marks = StaleRollupDay.objects.filter(date__range=(start, end))
+    if marked_before is not None:
+        marks = marks.filter(marked_at__lt=marked_before)
+    marks.delete()
+
+
+def _retrying(func, *args):
+    """Call func, again while it fails on a lock, for up to RETRY_SECONDS"""
+    deadline = time.monotonic() + RETRY_SECONDS
+    delay = 0.001
+    while True:
+        try:
+            return func(*args)
+        except OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+
+def _after_commit(func, *args, days=(), order_ids=()):
+    """
+    Run func once the transaction commits, retrying it while it is blocked
+    by a lock (func must be atomic). The change it rolls up is already
+    committed, so a failure here is logged rather than raised and the days
+    it touched (given, or those of order_ids) are marked stale.
+    """
+    def run():
+        try:
+            _retrying(func, *args)
+        except Exception:
+            logger.exception('Updating the daily order rollup failed')
+            try:
+                _retrying(mark_stale, days, order_ids)
+            except Exception:
+                logger.exception('Marking daily order rollup days %s stale failed',
+                                 sorted(days) or sorted(order_ids))
+    transaction.on_commit(run)
+
+
+def _days(changes):
+    return {key[0] for key in changes}
+
+
+def record(changes):
+    """Apply the changes once the current transaction commits (or with the batch)"""
+    batch = _batch()
+    if batch is not None:
+        for key, share in changes.items():
+            _add(batch['changes'], key, share)
+        return
+    _after_commit(apply, changes, days=_days(changes))
+
+
+def record_transition(transition):
+    batch = _batch()
+    if batch is not None:
+        batch['transitions'].append(transition)
+        return
+    _after_commit(lambda: apply(transition_changes([transition])), order_ids=[transition.order_id])
+
+
+def record_rebuild(day):
+    batch = _batch()
+    if batch is not None:
+        batch['days'].add(day)
+        return
+    _after_commit(rebuild, day, day, days=[day])
+
+
+@contextmanager
+def batched():
+    """
+    Gather the rollup changes made inside the block and apply them together
+    when it exits (after its transaction commits, if one is open); an
+    exception discards them with the block's own work.
+    """
+    if _batch() is not None:
+        yield
+        return
+    batch = _local.batch = {'changes': _changes(), 'transitions': [], 'days': set()}
+    try:
+        yield
+    finally:
+        _local.batch = None
+
+    def flush():
+        changes = _changes()
+        for key, share in batch['changes'].items():
+            _add(changes, key, share)
+        if batch['transitions']:
+            for key, share in transition_changes(batch['transitions']).items():
+                _add(changes, key, share)
+        with transaction.atomic():
+            apply(changes)
+            for day in sorted(batch['days']):
+                rebuild(day, day)
+
+    if batch['changes'] or batch['transitions'] or batch['days']:
+        _after_commit(
+            flush, days=_days(batch['changes']) | batch['days'],
+            order_ids=[transition.order_id for transition in batch['transitions']]
+        )
+
+
+def computed_rows(start, end):
+    """The rollup rows for days start to end inclusive, worked out from the orders (unsaved)"""
+    service = ExpressionWrapper(F('completed_at') - F('started_at'), output_field=DurationField())
+    timed = Q(status='completed', started_at__isnull=False, completed_at__isnull=False)
+    groups = WashOrder.objects.filter(
+        created_at__date__range=(start, end)
+    ).annotate(
+        day=TruncDate('created_at')
+    ).values(
+        'day', 'wash_type', 'status', 'washer_id'
+    ).annotate(
+        order_count=Count('order_id'),
+        order_revenue=Sum('price'),
+        service=Sum(service, filter=timed),
+        timed=Count('order_id', filter=timed)
+    ).order_by()
+
+    return [
+        DailyOrderStats(
+            date=group['day'], wash_type=group['wash_type'], status=group['status'],
+            washer_id=group['washer_id'], washer_key=group['washer_id'] or 0,
+            orders=group['order_count'], revenue=group['order_revenue'] or 0,
+            service_seconds=int(group['service'].total_seconds()) if group['service'] else 0,
+            timed_orders=group['timed']
+        )
+        for group in groups
+    ]
+
+
+def rebuild(start, end):
+    """Recompute the rollup for days start to end inclusive from the orders"""
+    rows = computed_rows(start, end)
+    with transaction.atomic():
+        DailyOrderStats.objects.filter(date__range=(start, end)).delete()
+        DailyOrderStats.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def drifted_days(start, end):
+    """Days from start to end whose stored rollup doesn't match the orders"""
+    def totals(rows):
+        summed = _changes()
+        for row in rows:
+            _add(summed, (row.date, row.wash_type, row.status, row.washer_id),
+                 (row.orders, Decimal(row.revenue), row.service_seconds, row.timed_orders))
+        return {key: tuple(share) for key, share in summed.items() if any(share)}
+
+    stored = totals(DailyOrderStats.objects.filter(date__range=(start, end)))
+    actual = totals(computed_rows(start, end))
+    return sorted({key[0] for key in stored.keys() ^ actual.keys()} |
+                  {key[0] for key in stored.keys() & actual.keys() if stored[key] != actual[key]})
+
+
+def in_chunks(start, end, chunk_days=31):
+    """(chunk start, chunk end) covering start to end, chunk_days at a time"""
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(end, chunk_start + timedelta(days=chunk_days - 1))
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end + timedelta(days=1)
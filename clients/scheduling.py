@@ -0,0 +1,258 @@
+# clients/scheduling.py
+"""
+Time slot generation from ScheduleTemplate rules.
+
+The desired slots for a date range are worked out in memory from the
+active templates (minus ScheduleClosure dates), diffed against the slots
+that already exist with one query, and only the gap is written, with
+bulk_create in chunks. Running it again writes nothing, so it is safe to
+schedule as often as you like.
+
+With VIRTUAL_TIME_SLOTS on, nothing has to be generated ahead of time:
+slots_between() (via clients.availability) offers the templates' slots as
+unsaved TimeSlot objects alongside the real rows, and a row is only inserted (TimeSlot.materialize)
+when somebody books one.
+"""
+import heapq
+import itertools
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from .models import ScheduleClosure, ScheduleTemplate, TimeSlot, WashOrder, minutes_between, wash_minutes
+
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def template_slots(start, end, templates=None, closed=None):
+    """
+    Yield (date, start_time, end_time, max_capacity) for every slot the
+    templates call for from start to end inclusive, in date and time order.
+    Where templates overlap, the earliest one wins. Lazy, so callers that
+    only need the first few slots stop generating early.
+    """
+    if templates is None:
+        templates = list(ScheduleTemplate.objects.filter(is_active=True))
+    if closed is None:
+        closed = set(ScheduleClosure.objects.filter(date__range=(start, end)).values_list('date', flat=True))
+    slot_times = {template.pk: template.slot_times() for template in templates}
+
+    day = start
+    while day <= end:
+        if day not in closed:
+            slots = {}
+            for template in templates:
+                if template.applies_to(day):
+                    for start_time, end_time in slot_times[template.pk]:
+                        slots.setdefault(start_time, (end_time, template.max_capacity))
+            for start_time in sorted(slots):
+                yield (day, start_time) + slots[start_time]
+        day += timedelta(days=1)
+
+
+def desired_slots(start, end, templates=None):
+    """
+    {(date, start_time): (end_time, max_capacity)} for every slot the
+    templates call for from start to end inclusive
+    """
+    return {
+        (day, start_time): (end_time, max_capacity)
+        for day, start_time, end_time, max_capacity in template_slots(start, end, templates)
+    }
+
+
+def generate_time_slots(days=30, start=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Create any missing slots for the next `days` days (from `start`, default
+    today). Returns (created, existing) counts.
+    """
+    from .availability import invalidate_day
+
+    start = start or timezone.localdate()
+    end = start + timedelta(days=days - 1)
+
+    desired = desired_slots(start, end)
+    existing = set(
+        TimeSlot.objects.filter(date__range=(start, end)).values_list('date', 'start_time')
+    )
+    missing = [
+        TimeSlot(date=day, start_time=start_time, end_time=end_time, max_capacity=max_capacity)
+        for (day, start_time), (end_time, max_capacity) in sorted(desired.items())
+        if (day, start_time) not in existing
+    ]
+
+    with transaction.atomic():
+        # ignore_conflicts covers slots created concurrently since the diff
+        TimeSlot.objects.bulk_create(missing, batch_size=chunk_size, ignore_conflicts=True)
+
+    # bulk_create skips TimeSlot.save(), so drop the cached calendar days here
+    for day in {slot.date for slot in missing}:
+        invalidate_day(day)
+
+    return len(missing), len(desired) - len(missing)
+
+
+def virtual_slots_enabled():
+    return getattr(settings, 'VIRTUAL_TIME_SLOTS', False)
+
+
+def slots_between(start, end):
+    """
+    Active slots from start to end inclusive, ordered by date and time,
+    served from the per-date availability cache. In virtual mode this
+    includes an unsaved TimeSlot for every template slot that has no row
+    yet; a real row, even an inactive one, always takes precedence over
+    the template.
+    """
+    from .availability import get_range
+
+    return [slot for day in get_range(start, end) for slot in day.slots()]
+
+
+def bookable_slots(start, end=None):
+    """slots_between() narrowed to slots with room for the shortest wash"""
+    return [slot for slot in slots_between(start, end or start) if slot.available_spots > 0]
+
+
+def template_spill(templates, slot_times, closed, minutes):
+    """
+    Q matching the slots whose rest of a `minutes` wash fits the template
+    slot starting at their end time, or None if no template has one. The
+    first template that opens on the date and has a slot at that time
+    decides, as in template_slots().
+    """
+    spills = None
+    earlier = None
+    for template in templates:
+        if not slot_times[template.pk]:
+            continue
+        opens = Q(date__iso_week_day__in=[weekday + 1 for weekday in template.weekday_set])
+        if template.valid_from:
+            opens &= Q(date__gte=template.valid_from)
+        if template.valid_until:
+            opens &= Q(date__lte=template.valid_until)
+        by_length = {}
+        for start_time, end_time in slot_times[template.pk].items():
+            by_length.setdefault(minutes_between(start_time, end_time), []).append(start_time)
+        for length, starts in by_length.items():
+            spill = opens & Q(end_time__in=starts, length_minutes__gte=minutes - length)
+            if earlier is not None:
+                spill &= ~earlier
+            spills = spill if spills is None else spills | spill
+        taken = opens & Q(end_time__in=list(slot_times[template.pk]))
+        earlier = taken if earlier is None else earlier | taken
+    if spills is not None and closed:
+        spills &= ~Q(date__in=closed)
+    return spills
+
+
+def next_available_slots(n=5, wash_type='basic', after=None):
+    """
+    The first n slots a wash of this type can start in at or after `after`
+    (default now; an earlier time counts as now, as past slots can't be
+    booked), earliest first, for "book the next opening". A slot
+    qualifies if it has the wash's bay-minutes free, or, for a wash longer
+    than the slot, if the slot that starts when it ends has room for the
+    rest.
+
+    Open rows come from a forward scan over the open-slot index, with the
+    following slot's free minutes read by a correlated subquery, that
+    stops after n rows. In virtual mode a row whose wash would spill into
+    a not yet created slot is checked against the templates' slot times in
+    the same scan, and the templates' slots are merged in lazily, skipping
+    any position that already has a row (rows that are not in the scan are
+    fetched as bare keys and free minutes, up to the last slot that could
+    still make the cut). The query count is the same however far ahead the
+    first opening is.
+    """
+    if wash_type not in dict(WashOrder.WASH_TYPE_CHOICES):
+        raise ValueError(f'Unknown wash type: {wash_type}')
+    minutes = wash_minutes(wash_type)
+
+    now = timezone.now()
+    after = timezone.localtime(max(after or now, now))
+    day, at = after.date(), after.time().replace(second=0, microsecond=0)
+    upcoming = Q(date__gt=day) | Q(date=day, start_time__gte=at)
+    search_end = day + timedelta(days=getattr(settings, 'NEXT_AVAILABLE_SEARCH_DAYS', 365))
+    virtual = virtual_slots_enabled()
+
+    following = TimeSlot.objects.filter(date=OuterRef('date'), start_time=OuterRef('end_time'))
+    free = Case(
+        When(is_active=True, then=F('max_capacity') * F('length_minutes') - F('booked_minutes')),
+        default=Value(0), output_field=IntegerField()
+    )
+    spill = Value(minutes) - F('length_minutes')
+    fits = Q(length_minutes__gte=minutes) | Q(next_free__gte=spill, next_length__gte=spill)
+    if virtual:
+        templates = list(ScheduleTemplate.objects.filter(is_active=True))
+        closed = set(ScheduleClosure.objects.filter(date__range=(day, search_end)).values_list('date', flat=True))
+        slot_times = {template.pk: dict(template.slot_times()) for template in templates}
+        # With no row after it, a slot's wash spills into the template slot
+        # that starts when it ends, if there is one and it is long enough
+        spills = template_spill(templates, slot_times, closed, minutes)
+        if spills is not None:
+            fits |= Q(next_free__isnull=True) & spills
+    scan = TimeSlot.objects.bookable().filter(upcoming).annotate(
+        next_free=Subquery(following.annotate(free=free).values('free')[:1]),
+        next_length=Subquery(following.values('length_minutes')[:1]),
+    ).filter(
+        fits, remaining__gte=Least(Value(minutes), F('length_minutes'))
+    ).order_by('date', 'start_time')
+
+    rows = list(scan[:n])
+    if not virtual:
+        return rows
+
+    def template_length(slot_day, start_time):
+        """Length of the template slot at this position, or None"""
+        if slot_day in closed:
+            return None
+        for template in templates:
+            if template.applies_to(slot_day) and start_time in slot_times[template.pk]:
+                return minutes_between(start_time, slot_times[template.pk][start_time])
+        return None
+
+    # Only slots up to the nth open row can make the cut; with fewer open
+    # rows than that, search as far as NEXT_AVAILABLE_SEARCH_DAYS
+    horizon = rows[-1].date if len(rows) == n else search_end
+    # (free bay-minutes, length) of every row position up to the horizon
+    row_free = {(slot.date, slot.start_time): (slot.remaining, slot.length_minutes) for slot in rows}
+    row_free.update(
+        ((slot_day, start_time), (free_minutes if is_active else 0, length))
+        for slot_day, start_time, free_minutes, length, is_active in TimeSlot.objects.filter(
+            upcoming, date__lte=horizon
+        ).exclude(id__in=[slot.id for slot in rows]).annotate(
+            free=F('max_capacity') * F('length_minutes') - F('booked_minutes')
+        ).values_list('date', 'start_time', 'free', 'length_minutes', 'is_active')
+    )
+
+    def virtual_fits(slot):
+        """A template slot is all free; a spill needs room in the next slot"""
+        rest = minutes - slot.length_minutes
+        if rest <= 0:
+            return True
+        key = (slot.date, slot.end_time)
+        if key in row_free:
+            free_minutes, length = row_free[key]
+            return free_minutes >= rest and length >= rest
+        length = template_length(*key)
+        return length is not None and length >= rest
+
+    virtual_slots = (
+        slot for slot in (
+            TimeSlot(
+                date=slot_day, start_time=start_time, end_time=end_time, max_capacity=max_capacity,
+                length_minutes=minutes_between(start_time, end_time)
+            )
+            for slot_day, start_time, end_time, max_capacity in template_slots(day, horizon, templates, closed)
+            if (slot_day, start_time) not in row_free and (slot_day > day or start_time >= at)
+        )
+        if virtual_fits(slot)
+    )
+    merged = heapq.merge(rows, virtual_slots, key=lambda slot: (slot.date, slot.start_time))
+    return list(itertools.islice(merged, n))
@@ -0,0 +1,121 @@
+# clients/signals.py
+"""
+Signal handlers for client models
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .events import capacity_freed
+from .models import Appointment, Review, ScheduleClosure, ScheduleTemplate, TimeSlot, WashOrder
+from .transitions import order_transitioned
+
+
+@receiver(post_delete, sender=WashOrder)
+def release_washer_on_delete(sender, instance, **kwargs):
+    """Deleting an active order (e.g. with its client) frees the washer"""
+    from washers.models import Washer
+
+    if instance.washer_id and instance.status in WashOrder.ACTIVE_STATUSES:
+        Washer.adjust_active_order_count(instance.washer_id, -1)
+        capacity_freed.send(sender=WashOrder, washer_id=instance.washer_id, reason='order_deleted')
+
+
+@receiver(post_delete, sender=Appointment)
+def release_spot_on_delete(sender, instance, **kwargs):
+    """Deleting a live appointment gives its time slot spot back"""
+    if not instance.is_cancelled:
+        TimeSlot.release_spot(instance.time_slot_id, instance.booked_minutes)
+
+
+@receiver(post_delete, sender=TimeSlot)
+def drop_calendar_day_on_delete(sender, instance, **kwargs):
+    """A removed slot disappears from the availability calendar"""
+    from .availability import invalidate_day
+    invalidate_day(instance.date)
+
+
+@receiver([post_save, post_delete], sender=ScheduleTemplate)
+@receiver([post_save, post_delete], sender=ScheduleClosure)
+def invalidate_availability_on_schedule_change(sender, **kwargs):
+    """Template and closure edits can change the slots of any date"""
+    from .availability import invalidate_all
+    invalidate_all()
+
+
+@receiver(order_transitioned)
+def announce_freed_capacity(sender, transition, **kwargs):
+    """A completed or cancelled active order frees its washer"""
+    if transition.frees_capacity:
+        capacity_freed.send(sender=WashOrder, washer_id=transition.washer_id,
+                            reason=f'order_{transition.to_status}')
+
+
+@receiver(post_save, sender=WashOrder)
+def roll_up_saved_order(sender, instance, created, update_fields=None, **kwargs):
+    """
+    A new order joins the daily rollup; an edited one moves its share from
+    the row it was loaded in, or has its day rebuilt if it wasn't fully loaded
+    """
+    from . import rollups
+    if created:
+        rollups.record(rollups.order_changes([instance]))
+        return
+    if update_fields is not None and not set(update_fields) & {*rollups.ROLLUP_FIELDS, 'washer'}:
+        return
+    loaded = getattr(instance, '_loaded_rollup', None)
+    if loaded is not None:
+        rollups.record(rollups.edit_changes(loaded, instance))
+    else:
+        rollups.record_rebuild(rollups.order_day(instance))
+
+
+@receiver(post_delete, sender=WashOrder)
+def roll_up_deleted_order(sender, instance, **kwargs):
+    from . import rollups
+    rollups.record(rollups.order_changes([instance], -1))
+
+
+@receiver(order_transitioned)
+def roll_up_transition(sender, transition, **kwargs):
+    """Move the order's share of the daily rollup to its new status"""
+    from . import rollups
+    rollups.record_transition(transition)
+
+
+@receiver(post_save, sender=Review)
+def rate_washer_on_review(sender, instance, created, **kwargs):
+    """
+    A new review adds to its washer's rating; an edited one has it
+    recounted, along with the washer it was moved from
+    """
+    from . import washer_stats
+    if created:
+        if instance.washer_id:
+            washer_stats.adjust_rating(instance.washer_id, instance.rating)
+    else:
+        for washer_id in {instance.washer_id, getattr(instance, '_loaded_washer_id', None)} - {None}:
+            washer_stats.refresh_rating(washer_id)
+    instance._loaded_washer_id = instance.washer_id
+
+
+@receiver(post_delete, sender=Review)
+def unrate_washer_on_delete(sender, instance, **kwargs):
+    from . import washer_stats
+    if instance.washer_id:
+        washer_stats.adjust_rating(instance.washer_id, instance.rating, -1)
+
+
+@receiver(order_transitioned)
+def time_completed_order(sender, transition, **kwargs):
+    """A completed order joins its washer's service time histogram"""
+    from . import washer_stats
+    if transition.to_status == 'completed':
+        washer_stats.record_completion(transition.order_id)
+
+
+@receiver(post_delete, sender=WashOrder)
+def untime_deleted_order(sender, instance, **kwargs):
+    from . import washer_stats
+    if instance.status == 'completed' and instance.washer_id and instance.started_at and instance.completed_at:
+        washer_stats.adjust_service_time(
+            instance.washer_id, washer_stats.service_minutes(instance.started_at, instance.completed_at), -1
+        )
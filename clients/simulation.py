@@ -0,0 +1,369 @@
+# clients/simulation.py
+"""
+Discrete-event simulation of a day of car wash operations.
+
+Drives the real booking and dispatch code (WashOrder.save, the
+order transitions, the TimeSlot/Appointment booking path, release_due_orders and
+dispatch_pending_orders) against whatever database is active, with a
+seeded model of arrivals, wash durations, cancellations and washer shifts.
+Simulated time starts at 07:00 tomorrow so every slot is in the future.
+Used by the simulate_operations management command, which runs it inside
+scratch_database() so the configured database and caches are never
+touched, whatever backend they use.
+
+Every pass's queries are counted, including the rollup upkeep its
+transitions trigger. Most of a pass's queries are fixed (the locked reads,
+the bulk updates, one rollup upsert per touched row), so with one pass per
+tick and a handful of orders per pass the queries per dispatched order
+mostly measure how many orders each pass finds; passes that assign nothing
+are reported separately.
+"""
+import heapq
+import itertools
+import math
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, reset_queries
+from django.db.utils import load_backend
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from washers.models import Washer
+from . import availability
+from .booking import book_appointment
+from .events import capacity_freed, enqueue_dispatch_tick
+from .models import Appointment, Client, TimeSlot, Vehicle, WashOrder
+from .scheduling import slots_between
+from .transitions import cancel_order, complete_order, start_order
+from .utils import dispatch_pending_orders, release_due_orders
+
+
+# (mean, standard deviation) of wash durations in minutes
+WASH_DURATIONS = {
+    'basic': (20, 5),
+    'premium': (40, 8),
+    'deluxe': (90, 15),
+}
+WASH_TYPE_MIX = [('basic', 0.5), ('premium', 0.3), ('deluxe', 0.2)]
+PRICES = {'basic': 15.00, 'premium': 25.00, 'deluxe': 35.00}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+@contextmanager
+def scratch_database(name=':memory:'):
+    """
+    Run the block against a freshly migrated SQLite database (in memory
+    unless name is a file) and empty local-memory caches in place of the
+    default database and every configured cache, then put them back.
+    """
+    from django.core.management import call_command
+
+    settings_dict = connections.configure_settings({
+        DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name},
+    })[DEFAULT_DB_ALIAS]
+    scratch = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, DEFAULT_DB_ALIAS)
+    default = connections[DEFAULT_DB_ALIAS]
+    configured_caches = {alias: caches[alias] for alias in settings.CACHES}
+    try:
+        # Swapped in before migrating: data migrations and transactions
+        # look their connection up by alias
+        connections[DEFAULT_DB_ALIAS] = scratch
+        call_command('migrate', interactive=False, verbosity=0)
+        for alias in configured_caches:
+            caches[alias] = LocMemCache(f'simulation-{alias}', {})
+        yield scratch
+    finally:
+        connections[DEFAULT_DB_ALIAS] = default
+        for alias, cache in configured_caches.items():
+            if caches[alias] is not cache:
+                caches[alias].clear()
+            caches[alias] = cache
+        scratch.close()
+
+
+class OperationsSimulator:
+    """
+    Event loop over simulated minutes. Each event is (minute, seq, kind,
+    payload); capacity-freeing and arrival events mark the queue dirty and
+    a dispatch pass runs at the next tick, as the coalesced dispatch ticker
+    would in production.
+    """
+
+    def __init__(self, hours=12, washers=10, arrivals_per_hour=20, appointment_share=0.3,
+                 cancel_rate=0.05, shift_hours=8, washer_capacity=1, tick_minutes=1,
+                 matching=None, seed=42):
+        self.hours = hours
+        self.washer_count = washers
+        self.arrivals_per_hour = arrivals_per_hour
+        self.appointment_share = appointment_share
+        self.cancel_rate = cancel_rate
+        self.shift_hours = shift_hours
+        self.washer_capacity = washer_capacity
+        self.tick_minutes = tick_minutes
+        self.matching = matching
+        self.rng = random.Random(seed)
+
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        self.start = timezone.make_aware(datetime.combine(tomorrow, time(7, 0)))
+        self.end_minute = hours * 60
+
+        self._events = []
+        self._seq = itertools.count()
+        self._dispatch_scheduled = False
+
+        self.ready_at = {}  # order_id -> minute it could first be dispatched
+        self.shift_end = {}  # washer_id -> minute their shift ends
+        self.metrics = {
+            'arrivals': 0,
+            'walk_ins': 0,
+            'appointments': 0,
+            'booking_rejected': 0,
+            'cancelled': 0,
+            'dispatch_passes': 0,
+            'empty_dispatch_passes': 0,
+            'dispatched': 0,
+            'completed': 0,
+            'dispatch_queries': 0,
+            'queue_lengths': [],
+            'waits': [],
+            'busy_minutes': 0.0,
+            'capacity_minutes': 0.0,
+        }
+
+    def at(self, minute):
+        return self.start + timedelta(minutes=minute)
+
+    def schedule(self, minute, kind, payload=None):
+        heapq.heappush(self._events, (minute, next(self._seq), kind, payload))
+
+    # Setup
+
+    def setup(self):
+        self.clients = []
+        for i in range(50):
+            client = Client.objects.create(
+                email=f'sim{i}@example.com', password_hash='x',
+                first_name='Sim', last_name=f'Client {i}'
+            )
+            vehicle = Vehicle.objects.create(
+                client=client, make='Sim', model='Car', license_plate=f'SIM-{i:04d}'
+            )
+            self.clients.append((client, vehicle))
+
+        # Hourly slots for every simulated day, 08:00-18:00
+        days = math.ceil((7 * 60 + self.end_minute) / (24 * 60))
+        TimeSlot.objects.bulk_create(
+            TimeSlot(
+                date=self.start.date() + timedelta(days=day),
+                start_time=time(hour, 0),
+                end_time=time(hour + 1, 0),
+                max_capacity=3
+            )
+            for day in range(days)
+            for hour in range(8, 18)
+        )
+        availability.invalidate_all()
+
+        shift_minutes = self.shift_hours * 60
+        for i in range(self.washer_count):
+            washer = Washer.objects.create(
+                email=f'simwasher{i}@example.com', password_hash='x',
+                first_name='Sim', last_name=f'Washer {i}', phone='0700000000',
+                is_available=False, max_concurrent_orders=self.washer_capacity
+            )
+            shift_start = self.rng.uniform(0, 120)
+            shift_end = min(self.end_minute, shift_start + shift_minutes)
+            if shift_start < self.end_minute:
+                self.schedule(shift_start, 'shift_start', washer.washer_id)
+                self.schedule(shift_end, 'shift_end', washer.washer_id)
+                self.shift_end[washer.washer_id] = shift_end
+                self.metrics['capacity_minutes'] += (shift_end - shift_start) * self.washer_capacity
+
+        self.schedule(self.rng.expovariate(self.arrivals_per_hour / 60), 'arrival')
+        self.schedule(0, 'release')
+
+    # Event handlers
+
+    def on_arrival(self, minute, _):
+        self.metrics['arrivals'] += 1
+        self.schedule(minute + self.rng.expovariate(self.arrivals_per_hour / 60), 'arrival')
+
+        client, vehicle = self.rng.choice(self.clients)
+        wash_type = self.rng.choices(
+            [wash for wash, _ in WASH_TYPE_MIX], [weight for _, weight in WASH_TYPE_MIX]
+        )[0]
+
+        if self.rng.random() < self.appointment_share:
+            order = self.book_appointment(minute, client, vehicle, wash_type)
+        else:
+            order = WashOrder.objects.create(
+                client=client, vehicle=vehicle, wash_type=wash_type,
+                price=PRICES[wash_type], status='pending'
+            )
+            WashOrder.objects.filter(order_id=order.order_id).update(created_at=self.at(minute))
+            self.ready_at[order.order_id] = minute
+            self.metrics['walk_ins'] += 1
+            self.request_dispatch(minute)
+
+        if order and self.rng.random() < self.cancel_rate:
+            self.schedule(minute + self.rng.uniform(5, 30), 'cancel', order.order_id)
+
+    def book_appointment(self, minute, client, vehicle, wash_type):
+        """Book a slot one to four hours ahead through the normal booking path"""
+        wanted = self.at(minute + self.rng.uniform(60, 240))
+        # The first slot at or after the wanted time, read the way the
+        # booking page reads it (through the availability cache)
+        slot = next(
+            (slot for slot in slots_between(wanted.date(), wanted.date()) if slot.start_time >= wanted.time()),
+            None,
+        )
+        if slot is None or slot.available_spots <= 0:
+            self.metrics['booking_rejected'] += 1
+            return None
+
+        try:
+            order = book_appointment(client, vehicle, slot, wash_type).wash_order
+        except ValidationError:
+            self.metrics['booking_rejected'] += 1
+            return None
+        release_minute = (order.release_at - self.start).total_seconds() / 60
+        self.ready_at[order.order_id] = max(minute, release_minute)
+        self.metrics['appointments'] += 1
+        return order
+
+    def on_cancel(self, minute, order_id):
+        order = WashOrder.objects.get(order_id=order_id)
+        if order.status not in ('pending', 'scheduled'):
+            return
+
+        appointment = Appointment.objects.filter(wash_order=order).first()
+        if appointment:
+            appointment.cancel_appointment('Simulated cancellation')
+        else:
+            cancel_order(order_id)
+        self.ready_at.pop(order_id, None)
+        self.metrics['cancelled'] += 1
+
+    def on_complete(self, minute, order_id):
+        complete_order(order_id)
+        self.metrics['completed'] += 1
+        self.request_dispatch(minute)
+
+    def on_shift_start(self, minute, washer_id):
+        washer = Washer.objects.get(washer_id=washer_id)
+        washer.is_available = True
+        washer.save(update_fields=['is_available'])
+        self.request_dispatch(minute)
+
+    def on_shift_end(self, minute, washer_id):
+        washer = Washer.objects.get(washer_id=washer_id)
+        washer.is_available = False
+        washer.save(update_fields=['is_available'])
+
+    def on_release(self, minute, _):
+        """Periodic scheduler tick for held appointment orders"""
+        if release_due_orders(now=self.at(minute)):
+            self.request_dispatch(minute)
+        self.schedule(minute + 5, 'release')
+
+    def request_dispatch(self, minute):
+        if not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            self.schedule(minute + self.tick_minutes, 'dispatch')
+
+    def on_dispatch(self, minute, _):
+        self._dispatch_scheduled = False
+
+        # The query log holds a bounded number of queries; once full,
+        # CaptureQueriesContext would count none
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            report = dispatch_pending_orders(matching=self.matching, now=self.at(minute))
+
+        self.metrics['dispatch_passes'] += 1
+        self.metrics['empty_dispatch_passes'] += not report['assigned']
+        self.metrics['dispatch_queries'] += len(queries)
+        self.metrics['queue_lengths'].append(len(report['skipped']))
+
+        for order_id, washer_id in report['assigned']:
+            start_order(order_id, washer_id=washer_id)
+            wash_type = WashOrder.objects.values_list('wash_type', flat=True).get(order_id=order_id)
+
+            mean, sd = WASH_DURATIONS[wash_type]
+            duration = max(5.0, self.rng.gauss(mean, sd))
+            self.schedule(minute + duration, 'complete', order_id)
+
+            self.metrics['dispatched'] += 1
+            self.metrics['waits'].append(minute - self.ready_at.pop(order_id, minute))
+            # Only count work inside the shift, to match capacity_minutes
+            self.metrics['busy_minutes'] += max(0, min(duration, self.shift_end[washer_id] - minute))
+
+    # Main loop
+
+    def run(self):
+        """Run the simulation and return a summary dict"""
+        capacity_freed.disconnect(enqueue_dispatch_tick)
+        availability.reset_stats()
+        try:
+            self.setup()
+            handlers = {
+                'arrival': self.on_arrival,
+                'cancel': self.on_cancel,
+                'complete': self.on_complete,
+                'shift_start': self.on_shift_start,
+                'shift_end': self.on_shift_end,
+                'release': self.on_release,
+                'dispatch': self.on_dispatch,
+            }
+            while self._events and self._events[0][0] <= self.end_minute:
+                minute, _, kind, payload = heapq.heappop(self._events)
+                handlers[kind](minute, payload)
+        finally:
+            capacity_freed.connect(enqueue_dispatch_tick)
+
+        return self.summary()
+
+    def summary(self):
+        m = self.metrics
+        queues = m['queue_lengths']
+        return {
+            'hours': self.hours,
+            'arrivals': m['arrivals'],
+            'walk_ins': m['walk_ins'],
+            'appointments': m['appointments'],
+            'booking_rejected': m['booking_rejected'],
+            'cancelled': m['cancelled'],
+            'dispatched': m['dispatched'],
+            'completed': m['completed'],
+            'throughput_per_hour': m['completed'] / self.hours if self.hours else 0,
+            'avg_queue': sum(queues) / len(queues) if queues else 0,
+            'max_queue': max(queues) if queues else 0,
+            'utilization': m['busy_minutes'] / m['capacity_minutes'] if m['capacity_minutes'] else 0,
+            'wait_p50': percentile(m['waits'], 50),
+            'wait_p95': percentile(m['waits'], 95),
+            'dispatch_passes': m['dispatch_passes'],
+            'empty_dispatch_passes': m['empty_dispatch_passes'],
+            'queries_per_dispatch_pass': (
+                m['dispatch_queries'] / m['dispatch_passes'] if m['dispatch_passes'] else None
+            ),
+            'queries_per_dispatched_order': (
+                m['dispatch_queries'] / m['dispatched'] if m['dispatched'] else None
+            ),
+            'availability_hits': availability.stats['hits'],
+            'availability_misses': availability.stats['misses'],
+            'availability_hit_ratio': availability.hit_ratio(),
+        }
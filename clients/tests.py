@@ -1,3 +1,1748 @@
-from django.test import TestCase
+import io
+import itertools
+import math
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count, F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from washers.models import Washer
+from .forms import AppointmentForm
+from .dispatch import (
+    BalancedWasherPolicy, Dispatcher, FifoOrderPolicy, OrderCandidate,
+    PriorityOrderPolicy, SeniorityWasherPolicy, WasherCandidate
+)
+from . import availability, matching, rollups, utils, washer_stats
+from .booking import book_appointment
+from .events import DispatchTicker, capacity_freed, flush_after_commit, ticker
+from .models import (
+    Appointment, Client, DailyOrderStats, Review, ScheduleClosure, ScheduleTemplate, TimeSlot, Vehicle, WaitlistEntry,
+    WashOrder, WasherServiceTime
+)
+from .scheduling import generate_time_slots, next_available_slots, slots_between
+from .simulation import OperationsSimulator
+from .transitions import (
+    OrderTransition, assign_order, cancel_order, complete_order, order_transitioned, start_order
+)
+from .waitlist import join_waitlist, promote_waitlist
+from .utils import (
+    ACTIVE_ORDER_STATUSES, claim_order, dispatch_pending_orders, get_free_washers, ranked_free_washers,
+    rebuild_active_order_counts, rebuild_slot_booked_counts, release_due_orders
+)
+
+
+# Hour-long washes of every type, so an hourly slot holds one wash per bay
+ONE_WASH_PER_BAY = {'basic': 60, 'premium': 60, 'deluxe': 60}
+
+
+def retry_on_lock(func, *args):
+    """Retry while another thread holds the SQLite write lock"""
+    while True:
+        try:
+            return func(*args)
+        except OperationalError:
+            time.sleep(0.001)
+
+
+class FixtureMixin:
+    """Clients, vehicles and washers for the test cases below"""
+
+    def make_client(self, name):
+        """A client with one vehicle, both named after name; returns (client, vehicle)"""
+        client = Client.objects.create(
+            email=f'{name}@example.com', password_hash='x', first_name=name.title(), last_name='Test'
+        )
+        vehicle = Vehicle.objects.create(client=client, make='Fiat', model='Panda', license_plate=name.upper())
+        return client, vehicle
+
+    def make_washer(self, name, **fields):
+        """An active, available washer named after name"""
+        return Washer.objects.create(
+            email=f'{name}@example.com', password_hash='x',
+            first_name=name.title(), last_name='Washer', phone='0700000000', **fields
+        )
+
+
+@override_settings(DISPATCH_COALESCE_SECONDS=0)
+class ClaimOrderConcurrencyTests(FixtureMixin, TransactionTestCase):
+    """Hammer claim_order() from many threads at once"""
+
+    THREADS = 8
+    CLAIMS_PER_THREAD = 50
+
+    def setUp(self):
+        client, vehicle = self.make_client('stress')
+        self.washer_ids = [
+            self.make_washer(f'washer{i}', max_concurrent_orders=1 + i % 3).washer_id
+            for i in range(5)
+        ]
+        self.order_ids = [
+            WashOrder.objects.create(client=client, vehicle=vehicle, price=15).order_id
+            for _ in range(40)
+        ]
+
+    def test_concurrent_claims_never_double_assign(self):
+        successes = []
+        start = threading.Barrier(self.THREADS)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                start.wait()
+                for _ in range(self.CLAIMS_PER_THREAD):
+                    order_id = rng.choice(self.order_ids)
+                    washer_id = rng.choice(self.washer_ids)
+                    if retry_on_lock(claim_order, order_id, washer_id):
+                        successes.append((order_id, washer_id))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.THREADS)]
+        # The shared in-memory database locks whole tables, so rollup deltas
+        # run into locks after their claim committed and are retried
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        today = timezone.localdate()
+        self.assertEqual(rollups.stale_days(), [])
+        self.assertEqual(rollups.drifted_days(today, today), [])
+
+        active = WashOrder.objects.filter(status__in=ACTIVE_ORDER_STATUSES)
+        per_washer = active.values('washer_id').annotate(orders=Count('order_id'))
+
+        capacity = dict(Washer.objects.values_list('washer_id', 'max_concurrent_orders'))
+
+        self.assertTrue(all(row['orders'] <= capacity[row['washer_id']] for row in per_washer))
+        self.assertEqual(len(successes), active.count())
+        self.assertEqual(len({order_id for order_id, _ in successes}), len(successes))
+        self.assertEqual(rebuild_active_order_counts(fix=False), [])
+
+
+@override_settings(WASH_DURATION_MINUTES=ONE_WASH_PER_BAY)
+class SlotBookingConcurrencyTests(FixtureMixin, TransactionTestCase):
+    """Book and cancel the same few slots from many threads at once"""
+
+    THREADS = 8
+    BOOKINGS_PER_THREAD = 30
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('slotstress')
+        day = timezone.localdate() + timedelta(days=2)
+        self.slot_ids = [
+            TimeSlot.objects.create(
+                date=day, start_time=dt_time(9 + i, 0), end_time=dt_time(10 + i, 0),
+                max_capacity=2 + i
+            ).id
+            for i in range(3)
+        ]
+
+    def book(self, slot_id):
+        try:
+            return Appointment.objects.create(
+                client=self.client_obj, vehicle=self.vehicle, time_slot_id=slot_id
+            )
+        except ValidationError:
+            return None
+
+    def test_concurrent_bookings_never_overbook(self):
+        start = threading.Barrier(self.THREADS)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            mine = []
+            try:
+                start.wait()
+                for _ in range(self.BOOKINGS_PER_THREAD):
+                    if mine and rng.random() < 0.3:
+                        retry_on_lock(mine.pop(rng.randrange(len(mine))).cancel_appointment)
+                    else:
+                        appointment = retry_on_lock(self.book, rng.choice(self.slot_ids))
+                        if appointment:
+                            mine.append(appointment)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for slot in TimeSlot.objects.filter(id__in=self.slot_ids):
+            live = slot.appointments.filter(is_cancelled=False).count()
+            self.assertLessEqual(live, slot.max_capacity)
+            self.assertEqual(slot.booked_count, live)
+        self.assertEqual(rebuild_slot_booked_counts(fix=False), [])
+
+
+class FreeWasherPoolTests(FixtureMixin, TestCase):
+    """The active order counter follows every status transition"""
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('pool')
+        self.washer = self.make_washer('poolwasher')
+
+    def active_count(self):
+        return Washer.objects.get(washer_id=self.washer.washer_id).active_order_count
+
+    def test_counter_follows_order_lifecycle(self):
+        order = WashOrder.objects.create(client=self.client_obj, vehicle=self.vehicle, price=15)
+        self.assertTrue(claim_order(order.order_id, self.washer.washer_id))
+        self.assertEqual(self.active_count(), 1)
+        self.assertFalse(get_free_washers().exists())
+
+        order = WashOrder.objects.get(order_id=order.order_id)
+        order.status = 'in_progress'
+        order.save()
+        self.assertEqual(self.active_count(), 1)
+
+        order.status = 'completed'
+        order.save()
+        self.assertEqual(self.active_count(), 0)
+        self.assertTrue(get_free_washers().exists())
+
+    def test_capacity_is_enforced_by_counter(self):
+        Washer.objects.filter(washer_id=self.washer.washer_id).update(max_concurrent_orders=2)
+        for _ in range(2):
+            WashOrder.objects.create(
+                client=self.client_obj, vehicle=self.vehicle, price=15,
+                washer=self.washer, status='assigned'
+            )
+        self.assertFalse(get_free_washers().exists())
+
+        with self.assertRaises(ValidationError):
+            WashOrder.objects.create(
+                client=self.client_obj, vehicle=self.vehicle, price=15,
+                washer=self.washer, status='assigned'
+            )
+        self.assertEqual(self.active_count(), 2)
+
+    def test_stale_washer_save_keeps_counter(self):
+        stale = Washer.objects.get(washer_id=self.washer.washer_id)
+        WashOrder.objects.create(
+            client=self.client_obj, vehicle=self.vehicle, price=15,
+            washer=self.washer, status='assigned'
+        )
+        stale.is_available = False
+        stale.save()
+        self.assertEqual(self.active_count(), 1)
+
+    def test_deleting_active_order_frees_washer(self):
+        WashOrder.objects.create(
+            client=self.client_obj, vehicle=self.vehicle, price=15,
+            washer=self.washer, status='assigned'
+        )
+        self.client_obj.delete()
+        self.assertEqual(self.active_count(), 0)
+
+    def test_rebuild_repairs_drift(self):
+        Washer.objects.filter(washer_id=self.washer.washer_id).update(active_order_count=3)
+        self.assertEqual(rebuild_active_order_counts(fix=False), [(self.washer.washer_id, 3, 0)])
+        rebuild_active_order_counts()
+        self.assertEqual(self.active_count(), 0)
+
+    @override_settings(DISPATCH_WASHER_POLICY='clients.dispatch.BalancedWasherPolicy')
+    def test_booking_claims_the_washer_the_policy_ranks_first(self):
+        # The longest-serving washer is already busy with an order; the
+        # balanced policy prefers the idle newcomer
+        Washer.objects.filter(washer_id=self.washer.washer_id).update(max_concurrent_orders=2)
+        WashOrder.objects.create(
+            client=self.client_obj, vehicle=self.vehicle, price=15,
+            washer=self.washer, status='assigned'
+        )
+        newcomer = self.make_washer('newcomer')
+        self.assertEqual(
+            [washer.washer_id for washer in ranked_free_washers()], [newcomer.washer_id, self.washer.washer_id]
+        )
+
+        session = self.client.session
+        session['client_id'] = self.client_obj.client_id
+        session.save()
+        self.client.post(reverse('clients:book_wash'), {'vehicle': self.vehicle.pk, 'wash_type': 'basic'})
+
+        booked = WashOrder.objects.latest('order_id')
+        self.assertEqual((booked.status, booked.washer_id), ('assigned', newcomer.washer_id))
+
+
+class OrderTransitionTests(FixtureMixin, TestCase):
+    """Guarded single-statement status transitions"""
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('fsm')
+        self.washer = self.make_washer('fsmwasher')
+        self.order = WashOrder.objects.create(client=self.client_obj, vehicle=self.vehicle, price=15)
+
+        self.sent = []
+        handler = lambda sender, transition, **kwargs: self.sent.append(transition)
+        order_transitioned.connect(handler)
+        self.addCleanup(order_transitioned.disconnect, handler)
+
+    def status(self):
+        return WashOrder.objects.values_list('status', flat=True).get(order_id=self.order.order_id)
+
+    def active_count(self):
+        return Washer.objects.get(washer_id=self.washer.washer_id).active_order_count
+
+    def test_full_lifecycle(self):
+        order_id, washer_id = self.order.order_id, self.washer.washer_id
+        self.assertTrue(assign_order(order_id, washer_id))
+        self.assertEqual(self.active_count(), 1)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(start_order(order_id, washer_id=washer_id))
+        self.assertEqual(self.status(), 'in_progress')
+
+        transition = complete_order(order_id, washer_id=washer_id)
+        self.assertEqual(transition.to_status, 'completed')
+        self.assertTrue(transition.frees_capacity)
+        self.assertEqual(self.active_count(), 0)
+        self.assertIsNotNone(WashOrder.objects.get(order_id=order_id).completed_at)
+
+        self.assertEqual([t.name for t in self.sent], ['assign', 'start', 'complete'])
+
+    def test_illegal_transition_is_rejected_without_reading(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(start_order(self.order.order_id))
+        self.assertIsNone(complete_order(self.order.order_id))
+        self.assertEqual(self.status(), 'pending')
+        self.assertEqual(self.sent, [])
+
+    def test_start_checks_washer(self):
+        other = self.make_washer('other')
+        assign_order(self.order.order_id, self.washer.washer_id)
+        self.assertIsNone(start_order(self.order.order_id, washer_id=other.washer_id))
+        self.assertEqual(self.status(), 'assigned')
+
+    def test_cancel_releases_washer_once(self):
+        assign_order(self.order.order_id, self.washer.washer_id)
+        start_order(self.order.order_id)
+
+        transition = cancel_order(self.order.order_id)
+        self.assertIsInstance(transition, OrderTransition)
+        self.assertTrue(transition.frees_capacity)
+        self.assertEqual(self.status(), 'cancelled')
+        self.assertEqual(self.active_count(), 0)
+
+        self.assertIsNone(cancel_order(self.order.order_id))
+        self.assertEqual(self.active_count(), 0)
+
+    def test_cancel_is_one_read_and_one_guarded_update(self):
+        assign_order(self.order.order_id, self.washer.washer_id)
+        with CaptureQueriesContext(connection) as ctx:
+            transition = cancel_order(self.order.order_id)
+        # The order's status and washer, the order, the washer's counter
+        self.assertEqual(self.statements(ctx), ['SELECT', 'UPDATE', 'UPDATE'])
+        self.assertEqual((transition.from_statuses, transition.washer_id), (('assigned',), self.washer.washer_id))
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertIsNone(cancel_order(self.order.order_id))
+        self.assertEqual(self.statements(ctx), ['SELECT'])
+
+    def statements(self, ctx):
+        return [query['sql'].split()[0] for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+
+    def test_cancelling_queued_order_frees_nothing(self):
+        other = WashOrder.objects.create(
+            client=self.client_obj, vehicle=self.vehicle, price=15,
+            washer=self.washer, status='assigned'
+        )
+        transition = cancel_order(self.order.order_id)
+        self.assertFalse(transition.frees_capacity)
+        self.assertEqual(self.active_count(), 1)
+        self.assertEqual(WashOrder.objects.get(order_id=other.order_id).status, 'assigned')
+
+
+@override_settings(VIRTUAL_TIME_SLOTS=False, WASH_DURATION_MINUTES=ONE_WASH_PER_BAY)
+class SlotAvailabilityQueryTests(FixtureMixin, TestCase):
+    """Slot availability is counted in one grouped query, not per slot"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client_obj, self.vehicle = self.make_client('slots')
+        self.day = timezone.localdate() + timedelta(days=3)
+
+        session = self.client.session
+        session['client_id'] = self.client_obj.client_id
+        session['client_name'] = 'Slot Test'
+        session.save()
+
+    def add_slots(self, hours, max_capacity=2):
+        slots = [
+            TimeSlot.objects.create(
+                date=self.day, start_time=dt_time(hour, 0), end_time=dt_time(hour + 1, 0),
+                max_capacity=max_capacity
+            )
+            for hour in hours
+        ]
+        for slot in slots:
+            Appointment.objects.create(
+                client=self.client_obj, vehicle=self.vehicle, time_slot=slot
+            )
+        return slots
+
+    def render_schedule_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('clients:schedule_appointment'), {'selected_date': self.day.isoformat()}
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_annotation_matches_properties(self):
+        full, open_slot = self.add_slots([8, 9], max_capacity=1)
+        TimeSlot.objects.filter(pk=open_slot.pk).update(max_capacity=3)
+
+        annotated = {slot.pk: slot for slot in TimeSlot.objects.with_availability()}
+        self.assertEqual((annotated[full.pk].booked, annotated[full.pk].remaining), (1, 0))
+        self.assertEqual((annotated[open_slot.pk].booked, annotated[open_slot.pk].remaining), (1, 120))
+        self.assertEqual(list(TimeSlot.objects.bookable()), [annotated[open_slot.pk]])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(annotated[open_slot.pk].available_spots, 2)
+            self.assertFalse(annotated[full.pk].is_available)
+
+    def test_cancel_and_delete_give_spots_back(self):
+        slot, = self.add_slots([8], max_capacity=1)
+        self.assertEqual(TimeSlot.objects.get(pk=slot.pk).booked_count, 1)
+
+        with self.assertRaises(ValidationError):
+            Appointment.objects.create(client=self.client_obj, vehicle=self.vehicle, time_slot=slot)
+
+        appointment = Appointment.objects.get(time_slot=slot)
+        self.assertTrue(appointment.cancel_appointment('test'))
+        self.assertFalse(appointment.cancel_appointment('again'))
+        self.assertEqual(TimeSlot.objects.get(pk=slot.pk).booked_count, 0)
+
+        rebooked = Appointment.objects.create(client=self.client_obj, vehicle=self.vehicle, time_slot=slot)
+        rebooked.delete()
+        self.assertEqual(TimeSlot.objects.get(pk=slot.pk).booked_count, 0)
+
+    def test_moving_appointment_moves_spot(self):
+        first, second = self.add_slots([8, 9], max_capacity=1)
+        TimeSlot.objects.filter(pk=second.pk).update(max_capacity=2)
+
+        appointment = Appointment.objects.get(time_slot=first)
+        appointment.time_slot = second
+        appointment.save()
+
+        counts = dict(TimeSlot.objects.values_list('id', 'booked_count'))
+        self.assertEqual((counts[first.pk], counts[second.pk]), (0, 2))
+
+    def test_schedule_page_query_count_is_constant(self):
+        self.add_slots([8, 9])
+        response, small = self.render_schedule_page()
+        self.assertEqual(len(response.context['available_slots']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_slots(range(10, 18))
+        response, large = self.render_schedule_page()
+        self.assertEqual(len(response.context['available_slots']), 10)
+
+        self.assertEqual(small, large)
+        # session, client, vehicle check, vehicle choices, slots (shared by form and cards)
+        self.assertEqual(large, 5)
+
+
+@override_settings(VIRTUAL_TIME_SLOTS=False)
+class AvailabilityCalendarTests(FixtureMixin, TestCase):
+    """Versioned per-day availability cache, invalidated as bookings change"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client_obj, self.vehicle = self.make_client('calendar')
+        self.day = timezone.localdate() + timedelta(days=5)
+        self.slots = [
+            TimeSlot.objects.create(
+                date=self.day, start_time=dt_time(hour, 0), end_time=dt_time(hour + 1, 0),
+                max_capacity=2
+            )
+            for hour in (9, 10)
+        ]
+
+    def test_range_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            days = availability.get_range(self.day - timedelta(days=3), self.day + timedelta(days=3))
+        self.assertEqual(len(days), 7)
+        self.assertEqual(list(days[3].remaining), [120, 120])
+        self.assertEqual(days[0].as_dict()['slots'], [])
+
+        with self.assertNumQueries(0):
+            availability.get_range(self.day, self.day)
+
+    def test_bumps_reach_other_workers_through_a_shared_cache(self):
+        location = tempfile.mkdtemp(prefix='availability-cache-')
+        self.addCleanup(shutil.rmtree, location, True)
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+        with override_settings(CACHES={'default': shared}):
+            availability.get_range(self.day, self.day)
+            # Another worker process has its own connection to the same cache
+            with mock.patch.object(availability, 'cache', caches.create_connection('default')):
+                with self.assertNumQueries(0):
+                    availability.get_range(self.day, self.day)
+                with self.captureOnCommitCallbacks(execute=True):
+                    Appointment.objects.create(client=self.client_obj, vehicle=self.vehicle, time_slot=self.slots[0])
+            with self.assertNumQueries(1):
+                day, = availability.get_range(self.day, self.day)
+        self.assertEqual(list(day.remaining), [100, 120])
+
+    def test_booking_and_cancel_invalidate_only_their_day(self):
+        other_day = self.day + timedelta(days=1)
+        availability.get_range(self.day, other_day)
+        availability.reset_stats()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = Appointment.objects.create(
+                client=self.client_obj, vehicle=self.vehicle, time_slot=self.slots[1]
+            )
+        with self.assertNumQueries(1):
+            day, other = availability.get_range(self.day, other_day)
+        self.assertEqual(list(day.remaining), [120, 100])
+        self.assertEqual(availability.stats['hits'], 1)
+        self.assertEqual(availability.stats['misses'], 1)
+
+        with self.assertNumQueries(0):
+            availability.get_range(self.day, other_day)
+        self.assertEqual(availability.hit_ratio(), 0.75)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.cancel_appointment()
+        day, = availability.get_range(self.day, self.day)
+        self.assertEqual(list(day.remaining), [120, 120])
+
+    def test_template_change_invalidates_every_day(self):
+        availability.get_range(self.day, self.day + timedelta(days=1))
+        ScheduleClosure.objects.create(date=self.day + timedelta(days=20))
+        with self.assertNumQueries(1):
+            availability.get_range(self.day, self.day + timedelta(days=1))
+
+    def test_calendar_endpoint(self):
+        url = reverse('clients:availability_calendar')
+        response = self.client.get(url, {'start': self.day.isoformat(), 'end': self.day.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        day, = response.json()['days']
+        # 2 bays x 60 minutes in each slot, in 20-minute basic washes
+        self.assertEqual(day['available'], 12)
+        self.assertEqual(day['times'], ['09:00', '10:00'])
+        self.assertEqual(day['slots'], [slot.id for slot in self.slots])
+
+        self.assertEqual(self.client.get(url, {'start': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {
+            'start': self.day.isoformat(), 'end': (self.day - timedelta(days=1)).isoformat()
+        }).status_code, 400)
+
+
+class SlotGenerationTests(TestCase):
+    """Template-driven, idempotent bulk slot generation"""
+
+    def setUp(self):
+        ScheduleTemplate.objects.all().delete()
+        # Start on a Monday so weekday rules are predictable
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+        self.template = ScheduleTemplate.objects.create(
+            name='Standard', weekdays='0,1,2,3,4,5',
+            opens_at=dt_time(8, 0), closes_at=dt_time(17, 0),
+            break_start=dt_time(12, 0), break_end=dt_time(13, 0), max_capacity=3
+        )
+
+    def test_slot_times_skip_break(self):
+        times = self.template.slot_times()
+        self.assertEqual(len(times), 8)
+        self.assertNotIn(dt_time(12, 0), [start for start, _ in times])
+        self.assertEqual(times[4], (dt_time(13, 0), dt_time(14, 0)))
+
+        self.template.slot_minutes = 45
+        self.assertEqual(self.template.slot_times()[4], (dt_time(11, 0), dt_time(11, 45)))
+        self.assertEqual(self.template.slot_times()[5], (dt_time(13, 0), dt_time(13, 45)))
+
+    def test_generation_is_idempotent_and_respects_rules(self):
+        ScheduleClosure.objects.create(date=self.monday + timedelta(days=1), reason='Holiday')
+
+        created, existing = generate_time_slots(days=7, start=self.monday)
+        # Mon-Sat minus the closed Tuesday, 8 slots a day
+        self.assertEqual((created, existing), (5 * 8, 0))
+        self.assertFalse(TimeSlot.objects.filter(date=self.monday + timedelta(days=6)).exists())
+
+        TimeSlot.objects.filter(date=self.monday).first().delete()
+        self.assertEqual(generate_time_slots(days=7, start=self.monday), (1, 39))
+        self.assertEqual(generate_time_slots(days=7, start=self.monday), (0, 40))
+
+    def test_year_horizon_is_a_handful_of_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            created, _ = generate_time_slots(days=365, start=self.monday, chunk_size=1000)
+        self.assertGreater(created, 2400)
+        self.assertEqual(TimeSlot.objects.count(), created)
+        # templates, closures, existing slots, then one INSERT per chunk (+ savepoints);
+        # SQLite caps the chunk by its query parameter limit
+        fields = [f for f in TimeSlot._meta.concrete_fields if not f.primary_key]
+        batch = min(1000, connection.ops.bulk_batch_size(fields, [None] * created))
+        self.assertLessEqual(len(queries), 3 + math.ceil(created / batch) + 2)
+
+
+@override_settings(VIRTUAL_TIME_SLOTS=True)
+class VirtualSlotTests(FixtureMixin, TestCase):
+    """Template slots are offered without rows and created on first booking"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        ScheduleTemplate.objects.all().delete()
+        ScheduleTemplate.objects.create(
+            name='Mornings', weekdays='0,1,2,3,4,5,6',
+            opens_at=dt_time(8, 0), closes_at=dt_time(11, 0), max_capacity=2
+        )
+        self.client_obj, self.vehicle = self.make_client('virtual')
+        self.day = timezone.localdate() + timedelta(days=4)
+
+    def test_rows_override_template_slots(self):
+        TimeSlot.objects.create(
+            date=self.day, start_time=dt_time(9, 0), end_time=dt_time(10, 0), is_active=False
+        )
+        slots = slots_between(self.day, self.day)
+        self.assertEqual([slot.start_time for slot in slots], [dt_time(8, 0), dt_time(10, 0)])
+        self.assertTrue(all(slot.pk is None for slot in slots))
+
+    def test_first_booking_materializes_slot(self):
+        form = AppointmentForm(client=self.client_obj, selected_date=self.day, data={
+            'vehicle': self.vehicle.pk,
+            'time_slot': f'{self.day.isoformat()}T08:00',
+            'wash_type': 'basic',
+        })
+        self.assertEqual(len(form.available_slots), 3)
+        self.assertFalse(TimeSlot.objects.exists())
+
+        self.assertTrue(form.is_valid(), form.errors)
+        # Validating a virtual slot doesn't create it; booking does
+        self.assertFalse(TimeSlot.objects.exists())
+        appointment = form.save(commit=False)
+        appointment.client = self.client_obj
+        appointment.save()
+
+        slot = TimeSlot.objects.get()
+        self.assertEqual((slot.date, slot.start_time, slot.max_capacity, slot.booked_count),
+                         (self.day, dt_time(8, 0), 2, 1))
+        # The materialized slot is shared, not duplicated
+        again = TimeSlot.materialize(TimeSlot(
+            date=self.day, start_time=dt_time(8, 0), end_time=dt_time(9, 0)
+        ))
+        self.assertEqual(again.pk, slot.pk)
+
+    def test_calendar_includes_virtual_slots(self):
+        day, = availability.get_range(self.day, self.day)
+        self.assertEqual(day.as_dict()['times'], ['08:00', '09:00', '10:00'])
+        self.assertEqual(day.as_dict()['available'], 18)
+
+
+class NextAvailableSlotTests(TestCase):
+    """The next open slots, found with a constant number of queries"""
+
+    def setUp(self):
+        ScheduleTemplate.objects.all().delete()
+        ScheduleTemplate.objects.create(
+            name='Mornings', weekdays='0,1,2,3,4,5,6',
+            opens_at=dt_time(8, 0), closes_at=dt_time(11, 0), max_capacity=2
+        )
+        self.start = timezone.localdate() + timedelta(days=1)
+        self.after = timezone.make_aware(datetime.combine(self.start, dt_time(7, 0)))
+
+    def fill_days(self, days):
+        """Full rows for every template slot over the first `days` days"""
+        TimeSlot.objects.bulk_create(
+            TimeSlot(
+                date=self.start + timedelta(days=offset), start_time=dt_time(hour, 0),
+                end_time=dt_time(hour + 1, 0), max_capacity=2, booked_count=2, booked_minutes=120
+            )
+            for offset in range(days)
+            for hour in (8, 9, 10)
+        )
+
+    @override_settings(VIRTUAL_TIME_SLOTS=False)
+    def test_scan_skips_full_slots_in_one_query(self):
+        for days in (1, 60):
+            TimeSlot.objects.all().delete()
+            self.fill_days(days)
+            open_day = self.start + timedelta(days=days)
+            TimeSlot.objects.bulk_create(
+                TimeSlot(date=open_day, start_time=dt_time(hour, 0), end_time=dt_time(hour + 1, 0),
+                         max_capacity=2, booked_count=1, booked_minutes=60)
+                for hour in (8, 9, 10)
+            )
+            with self.assertNumQueries(1):
+                slots = next_available_slots(2, after=self.after)
+            self.assertEqual([(slot.date, slot.start_time) for slot in slots],
+                             [(open_day, dt_time(8, 0)), (open_day, dt_time(9, 0))])
+            self.assertEqual(slots[0].remaining, 60)
+
+    def test_virtual_slots_fill_gaps_with_constant_queries(self):
+        counts = []
+        for days in (1, 60):
+            TimeSlot.objects.all().delete()
+            self.fill_days(days)
+            open_day = self.start + timedelta(days=days)
+            TimeSlot.objects.create(
+                date=open_day, start_time=dt_time(9, 0), end_time=dt_time(10, 0),
+                max_capacity=2, booked_count=1, booked_minutes=60
+            )
+            with CaptureQueriesContext(connection) as ctx:
+                slots = next_available_slots(3, after=self.after)
+            counts.append(len(ctx))
+            self.assertEqual([(slot.date, slot.start_time) for slot in slots],
+                             [(open_day, dt_time(8, 0)), (open_day, dt_time(9, 0)), (open_day, dt_time(10, 0))])
+            self.assertEqual([slot.pk is None for slot in slots], [True, False, True])
+            self.assertEqual([slot.available_minutes for slot in slots], [120, 60, 120])
+        self.assertEqual(counts[0], counts[1])
+
+    def test_spills_without_a_template_slot_are_skipped_in_the_scan(self):
+        counts = []
+        for days in (1, 30):
+            TimeSlot.objects.all().delete()
+            # Every 10:00 row is open, but a deluxe wash there would run on
+            # past closing, into a slot no template has
+            TimeSlot.objects.bulk_create(
+                TimeSlot(
+                    date=self.start + timedelta(days=offset), start_time=dt_time(hour, 0),
+                    end_time=dt_time(hour + 1, 0), max_capacity=2,
+                    booked_count=0 if hour == 10 else 2, booked_minutes=0 if hour == 10 else 120
+                )
+                for offset in range(days)
+                for hour in (8, 9, 10)
+            )
+            open_day = self.start + timedelta(days=days)
+            with CaptureQueriesContext(connection) as ctx:
+                slots = next_available_slots(2, 'deluxe', after=self.after)
+            counts.append(len(ctx))
+            self.assertEqual([(slot.date, slot.start_time) for slot in slots],
+                             [(open_day, dt_time(8, 0)), (open_day, dt_time(9, 0))])
+        self.assertEqual(counts[0], counts[1])
+
+    @override_settings(VIRTUAL_TIME_SLOTS=False)
+    def test_a_past_after_counts_as_now(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        for day in (yesterday, self.start):
+            TimeSlot.objects.create(date=day, start_time=dt_time(9, 0), end_time=dt_time(10, 0), max_capacity=2)
+        slots = next_available_slots(3, after=timezone.now() - timedelta(days=30))
+        self.assertEqual([(slot.date, slot.start_time) for slot in slots], [(self.start, dt_time(9, 0))])
+
+    def test_slots_before_after_are_skipped(self):
+        after = self.after.replace(hour=9, minute=30)
+        slots = next_available_slots(2, after=after)
+        self.assertEqual([(slot.date, slot.start_time) for slot in slots],
+                         [(self.start, dt_time(10, 0)), (self.start + timedelta(days=1), dt_time(8, 0))])
+
+    def test_endpoint(self):
+        url = reverse('clients:next_available')
+        response = self.client.get(url, {'n': 2, 'after': self.after.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([slot['slot'] for slot in response.json()['slots']],
+                         [f'{self.start.isoformat()}T08:00', f'{self.start.isoformat()}T09:00'])
+
+        self.assertEqual(self.client.get(url, {'n': 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'wash_type': 'waxed'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'after': 'tomorrow'}).status_code, 400)
+
+
+@override_settings(VIRTUAL_TIME_SLOTS=False)
+class BayMinuteCapacityTests(FixtureMixin, TestCase):
+    """Slots hold bay-minutes; long washes run on into the next slot"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client_obj, self.vehicle = self.make_client('minutes')
+        self.day = timezone.localdate() + timedelta(days=2)
+        self.nine, self.ten = [
+            TimeSlot.objects.create(
+                date=self.day, start_time=dt_time(hour, 0), end_time=dt_time(hour + 1, 0), max_capacity=1
+            )
+            for hour in (9, 10)
+        ]
+
+    def book(self, slot, wash_type):
+        return Appointment.objects.create(
+            client=self.client_obj, vehicle=self.vehicle, time_slot=slot, wash_type=wash_type
+        )
+
+    def booked(self):
+        return dict(TimeSlot.objects.values_list('start_time', 'booked_minutes'))
+
+    def test_long_wash_spills_into_next_slot(self):
+        deluxe = self.book(self.nine, 'deluxe')
+        self.assertEqual(deluxe.booked_minutes, 90)
+        self.assertEqual(self.booked(), {dt_time(9, 0): 60, dt_time(10, 0): 30})
+
+        self.book(self.ten, 'basic')
+        with self.assertRaises(ValidationError):
+            self.book(self.ten, 'premium')
+        self.assertEqual(self.booked(), {dt_time(9, 0): 60, dt_time(10, 0): 50})
+
+        deluxe.cancel_appointment()
+        self.assertEqual(self.booked(), {dt_time(9, 0): 0, dt_time(10, 0): 20})
+        self.assertEqual(rebuild_slot_booked_counts(fix=False), [])
+
+    def test_wash_cannot_run_past_the_last_slot(self):
+        with self.assertRaises(ValidationError):
+            self.book(self.ten, 'deluxe')
+
+        form = AppointmentForm(client=self.client_obj, selected_date=self.day, data={
+            'vehicle': self.vehicle.pk, 'time_slot': self.ten.slot_key, 'wash_type': 'deluxe',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('fully booked for a Deluxe Wash', form.errors['time_slot'][0])
+
+    def test_slot_and_next_are_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            slot, next_slot = TimeSlot.following(self.nine.pk)
+        self.assertEqual((slot, next_slot), (self.nine, self.ten))
+        self.assertTrue(slot.fits(90, next_slot))
+        self.assertFalse(next_slot.fits(90, None))
+
+    def test_changing_wash_type_rebooks_minutes(self):
+        appointment = self.book(self.nine, 'basic')
+        appointment = Appointment.objects.get(pk=appointment.pk)
+        appointment.wash_type = 'deluxe'
+        appointment.save()
+        self.assertEqual(self.booked(), {dt_time(9, 0): 60, dt_time(10, 0): 30})
+
+    def test_reconfigured_durations_leave_saved_bookings_alone(self):
+        appointment = self.book(self.nine, 'basic')
+        appointment = Appointment.objects.get(pk=appointment.pk)
+        with override_settings(WASH_DURATION_MINUTES={'basic': 45, 'premium': 50, 'deluxe': 90}):
+            appointment.special_instructions = 'Mind the roof box'
+            with self.assertNumQueries(1):
+                appointment.save()
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.booked_minutes, 20)
+        self.assertEqual(self.booked(), {dt_time(9, 0): 20, dt_time(10, 0): 0})
+
+    def test_busy_day_does_not_overflow_the_calendar(self):
+        TimeSlot.objects.filter(pk=self.nine.pk).update(max_capacity=1200)
+        day, = availability.get_range(self.day, self.day)
+        self.assertEqual(day.remaining[0], 1200 * 60)
+
+    def test_next_available_checks_spill_room(self):
+        after = timezone.make_aware(datetime.combine(self.day, dt_time(8, 0)))
+        slots = next_available_slots(5, 'deluxe', after=after)
+        self.assertEqual([slot.pk for slot in slots], [self.nine.pk])
+
+        self.book(self.ten, 'basic')
+        self.book(self.ten, 'basic')
+        self.assertEqual(next_available_slots(5, 'deluxe', after=after), [])
+        self.assertEqual([slot.pk for slot in next_available_slots(5, 'basic', after=after)],
+                         [self.nine.pk, self.ten.pk])
+
+    @override_settings(VIRTUAL_TIME_SLOTS=True)
+    def test_spill_into_virtual_slot_materializes_it(self):
+        ScheduleTemplate.objects.all().delete()
+        ScheduleTemplate.objects.create(
+            name='Late', weekdays='0,1,2,3,4,5,6',
+            opens_at=dt_time(11, 0), closes_at=dt_time(13, 0), max_capacity=1
+        )
+        eleven = TimeSlot.materialize(TimeSlot(
+            date=self.day, start_time=dt_time(11, 0), end_time=dt_time(12, 0), max_capacity=1
+        ))
+        self.book(eleven, 'deluxe')
+        self.assertEqual(self.booked()[dt_time(12, 0)], 30)
+
+
+@override_settings(VIRTUAL_TIME_SLOTS=False)
+class BookingServiceTests(FixtureMixin, TestCase):
+    """book_appointment() writes the slot, order and appointment together or not at all"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client_obj, self.vehicle = self.make_client('booking')
+        self.day = timezone.localdate() + timedelta(days=2)
+        self.slot = TimeSlot.objects.create(
+            date=self.day, start_time=dt_time(9, 0), end_time=dt_time(10, 0), max_capacity=1
+        )
+
+    def assertNothingBooked(self):
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.booked_count, self.slot.booked_minutes), (0, 0))
+        self.assertFalse(Appointment.objects.exists())
+        self.assertFalse(WashOrder.objects.exists())
+
+    def test_books_slot_order_and_appointment(self):
+        with CaptureQueriesContext(connection) as ctx:
+            appointment = book_appointment(self.client_obj, self.vehicle, self.slot, 'premium', 'Mind the roof rack')
+
+        writes = [query['sql'].split(None, 3)[:3] for query in ctx.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(writes, [
+            ['UPDATE', '"time_slots"', 'SET'],
+            ['INSERT', 'INTO', '"wash_orders"'],
+            ['INSERT', 'INTO', '"appointments"'],
+        ])
+        appointment = Appointment.objects.select_related('wash_order').get(pk=appointment.pk)
+        self.assertEqual(appointment.wash_order.wash_type, 'premium')
+        self.assertEqual(appointment.wash_order.notes, 'Mind the roof rack')
+        self.assertEqual(appointment.wash_order.status, 'scheduled')
+        self.assertEqual(appointment.booked_minutes, 45)
+        self.assertEqual(rebuild_slot_booked_counts(fix=False), [])
+
+    def test_full_slot_writes_nothing(self):
+        TimeSlot.objects.filter(pk=self.slot.pk).update(booked_minutes=50)
+        with self.assertRaises(ValidationError):
+            book_appointment(self.client_obj, self.vehicle, self.slot, 'basic')
+        self.assertFalse(Appointment.objects.exists())
+        self.assertFalse(WashOrder.objects.exists())
+
+    def test_failure_after_reserving_rolls_everything_back(self):
+        with mock.patch.object(Appointment, 'save_base', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                book_appointment(self.client_obj, self.vehicle, self.slot, 'basic')
+        self.assertNothingBooked()
+
+    def test_rejects_invalid_requests(self):
+        other, _ = self.make_client('other')
+        with self.assertRaises(ValidationError):
+            book_appointment(other, self.vehicle, self.slot, 'basic')
+        with self.assertRaises(ValidationError):
+            book_appointment(self.client_obj, self.vehicle, self.slot, 'ceramic')
+        TimeSlot.objects.filter(pk=self.slot.pk).update(is_active=False)
+        self.slot.refresh_from_db()
+        with self.assertRaises(ValidationError):
+            book_appointment(self.client_obj, self.vehicle, self.slot, 'basic')
+        self.assertNothingBooked()
+
+    def test_schedule_view_books_through_the_service(self):
+        session = self.client.session
+        session['client_id'] = self.client_obj.client_id
+        session.save()
+
+        response = self.client.post(reverse('clients:schedule_appointment'), {
+            'date': self.day.isoformat(), 'vehicle': self.vehicle.pk,
+            'time_slot': self.slot.slot_key, 'wash_type': 'basic',
+        })
+        appointment = Appointment.objects.get()
+        self.assertRedirects(
+            response, reverse('clients:track_order', args=[appointment.wash_order_id]), fetch_redirect_response=False
+        )
+        self.assertEqual(WashOrder.objects.count(), 1)
+
+
+@override_settings(VIRTUAL_TIME_SLOTS=False, WASH_DURATION_MINUTES=ONE_WASH_PER_BAY)
+class WaitlistTests(FixtureMixin, TestCase):
+    """Full slots can be waitlisted; freed spots go to the oldest entry"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.day = timezone.localdate() + timedelta(days=3)
+        self.slot = TimeSlot.objects.create(
+            date=self.day, start_time=dt_time(10, 0), end_time=dt_time(11, 0), max_capacity=2
+        )
+        self.booked = [self.book(self.make_client(f'booked{i}')) for i in range(2)]
+
+    def book(self, who, slot=None):
+        client, vehicle = who
+        appointment = Appointment.objects.create(client=client, vehicle=vehicle, time_slot=slot or self.slot)
+        appointment.create_wash_order()
+        return appointment
+
+    def wait(self, name):
+        client, vehicle = self.make_client(name)
+        entry, position = join_waitlist(client, vehicle, self.slot, wash_type='premium')
+        return entry
+
+    def test_form_requires_opt_in_for_full_slot(self):
+        client, vehicle = self.make_client('former')
+        data = {'vehicle': vehicle.pk, 'time_slot': self.slot.slot_key, 'wash_type': 'basic'}
+
+        form = AppointmentForm(client=client, selected_date=self.day, data=data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('fully booked', form.errors['time_slot'][0])
+
+        form = AppointmentForm(client=client, selected_date=self.day, data={**data, 'join_waitlist': 'on'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertTrue(form.waitlisted)
+
+        entry, position = join_waitlist(client, vehicle, form.cleaned_data['time_slot'])
+        again, position_again = join_waitlist(client, vehicle, self.slot)
+        self.assertEqual((again.pk, position, position_again), (entry.pk, 1, 1))
+
+    def test_cancellation_promotes_oldest_entry(self):
+        first, second = self.wait('first'), self.wait('second')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.booked[0].cancel_appointment('changed plans'))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, second.status), ('promoted', 'waiting'))
+        appointment = first.appointment
+        self.assertEqual((appointment.time_slot_id, appointment.wash_type), (self.slot.pk, 'premium'))
+        self.assertEqual(appointment.wash_order.status, 'scheduled')
+        self.assertEqual(TimeSlot.objects.get(pk=self.slot.pk).booked_count, 2)
+
+        # The promoted appointment holds its spot like any other
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.cancel_appointment()
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'promoted')
+        self.assertEqual(TimeSlot.objects.get(pk=self.slot.pk).booked_count, 2)
+
+    def test_a_slot_booked_meanwhile_leaves_the_other_slots_promoted(self):
+        later = TimeSlot.objects.create(
+            date=self.day, start_time=dt_time(12, 0), end_time=dt_time(13, 0), max_capacity=1
+        )
+        here = self.wait('here')
+        client, vehicle = self.make_client('there')
+        there, _ = join_waitlist(client, vehicle, later, wash_type='premium')
+        TimeSlot.objects.filter(pk=self.slot.pk).update(max_capacity=3)
+        change_bookings = TimeSlot.change_bookings
+
+        def booked_meanwhile(changes, *args):
+            if len(changes) > 1:
+                # A direct booking takes the room in self.slot first
+                TimeSlot.objects.filter(pk=self.slot.pk).update(
+                    booked_minutes=F('max_capacity') * F('length_minutes')
+                )
+            return change_bookings(changes, *args)
+
+        with mock.patch.object(TimeSlot, 'change_bookings', side_effect=booked_meanwhile):
+            promoted = promote_waitlist([self.slot.pk, later.pk])
+        self.assertEqual([entry.pk for entry in promoted], [there.pk])
+        here.refresh_from_db()
+        self.assertEqual(here.status, 'waiting')
+        self.assertEqual(TimeSlot.objects.get(pk=later.pk).booked_count, 1)
+
+    def test_burst_is_promoted_in_one_batch(self):
+        entries = [self.wait(f'burst{i}') for i in range(2)]
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for appointment in self.booked:
+                    appointment.cancel_appointment()
+        self.assertEqual(WaitlistEntry.objects.filter(status='promoted').count(), 2)
+        self.assertEqual(Appointment.objects.filter(is_cancelled=False, time_slot=self.slot).count(), 2)
+        self.assertEqual(TimeSlot.objects.get(pk=self.slot.pk).booked_count, 2)
+
+        # Promotion costs the same number of queries for one entry or many
+        counts = []
+        for size in (1, 3):
+            Appointment.objects.filter(time_slot=self.slot).update(is_cancelled=True)
+            TimeSlot.objects.filter(pk=self.slot.pk).update(booked_count=0, booked_minutes=0, max_capacity=size)
+            for i in range(size):
+                self.wait(f'size{size}-{i}')
+            with CaptureQueriesContext(connection) as ctx:
+                promoted = promote_waitlist([self.slot.pk])
+            self.assertEqual(len(promoted), size)
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_promotion_without_bulk_insert_keys(self):
+        first, second = self.wait('first'), self.wait('second')
+
+        # MySQL returns no primary keys from a bulk insert
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                self.captureOnCommitCallbacks(execute=True):
+            for appointment in self.booked:
+                appointment.cancel_appointment()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, second.status), ('promoted', 'promoted'))
+        self.assertEqual(first.appointment.wash_order.status, 'scheduled')
+        self.assertNotEqual(first.appointment_id, second.appointment_id)
+        self.assertEqual(rebuild_slot_booked_counts(fix=False), [])
+        # Saved one by one, the orders are rolled up once by post_save
+        self.assertEqual(
+            DailyOrderStats.objects.filter(wash_type='premium', status='scheduled').values_list('orders', flat=True).get(),
+            2
+        )
+
+    def test_client_already_booked_is_withdrawn(self):
+        client, vehicle = self.make_client('double')
+        entry, _ = join_waitlist(client, vehicle, self.slot)
+        later = self.wait('later')
+        other = TimeSlot.objects.create(
+            date=self.day, start_time=dt_time(11, 0), end_time=dt_time(12, 0), max_capacity=2
+        )
+        moved = self.book((client, vehicle), slot=other)
+        TimeSlot.objects.filter(pk=other.pk).update(booked_count=0)
+        Appointment.objects.filter(pk=moved.pk).update(time_slot=self.slot)
+        self.booked[0].cancel_appointment()
+
+        promote_waitlist([self.slot.pk])
+        entry.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual((entry.status, later.status), ('withdrawn', 'promoted'))
+
+
+class ScheduledReleaseTests(FixtureMixin, TestCase):
+    """Appointment orders wait out of the dispatch queue until their slot"""
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('release')
+        start = timezone.localtime() + timedelta(days=21)
+        self.slot = TimeSlot.objects.create(
+            date=start.date(), start_time=start.time().replace(microsecond=0),
+            end_time=(start + timedelta(hours=1)).time().replace(microsecond=0)
+        )
+
+    def book(self):
+        appointment = Appointment.objects.create(
+            client=self.client_obj, vehicle=self.vehicle, time_slot=self.slot
+        )
+        return appointment.create_wash_order()
+
+    def test_future_appointment_is_held_until_window(self):
+        order = self.book()
+        self.assertEqual(order.status, 'scheduled')
+
+        self.make_washer('idle')
+        self.assertEqual(dispatch_pending_orders()['assigned'], [])
+
+        self.assertEqual(release_due_orders(now=order.release_at), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+
+    def test_dispatch_runs_on_the_given_clock(self):
+        order = self.book()
+        washer = self.make_washer('clock')
+
+        report = dispatch_pending_orders(now=order.release_at)
+
+        self.assertEqual((report['released'], report['assigned']), (1, [(order.order_id, washer.washer_id)]))
+        order.refresh_from_db()
+        self.assertEqual(order.assigned_at, order.release_at)
+
+    def test_rescheduling_moves_the_release(self):
+        order = self.book()
+        appointment = Appointment.objects.get(wash_order=order)
+        soon = timezone.localtime() + timedelta(minutes=30)
+        soon_slot = TimeSlot.objects.create(
+            date=soon.date(), start_time=soon.time().replace(microsecond=0),
+            end_time=(soon + timedelta(hours=1)).time().replace(microsecond=0)
+        )
+
+        # Three weeks out -> within the release window: queued now
+        appointment.time_slot = soon_slot
+        appointment.save()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+        self.assertEqual(order.release_at, appointment.release_at)
+
+        # And back out again: held, not dispatched today
+        appointment.time_slot = self.slot
+        appointment.save()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'scheduled')
+        self.assertEqual(order.release_at, appointment.release_at)
+        self.make_washer('resched')
+        self.assertEqual(dispatch_pending_orders()['assigned'], [])
+
+    def test_rescheduling_leaves_a_taken_order_alone(self):
+        order = self.book()
+        release_at = order.release_at
+        WashOrder.objects.filter(order_id=order.order_id).update(status='assigned')
+        appointment = Appointment.objects.get(wash_order=order)
+        later = self.slot.date + timedelta(days=1)
+        appointment.time_slot = TimeSlot.objects.create(
+            date=later, start_time=self.slot.start_time, end_time=self.slot.end_time
+        )
+        appointment.save()
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.release_at), ('assigned', release_at))
+
+
+class DailyRollupTests(FixtureMixin, TestCase):
+    """The daily order rollup follows the orders without recounting them"""
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('rollup')
+        self.washer = self.make_washer('rollwasher', max_concurrent_orders=5)
+        self.today = timezone.localdate()
+
+    def order(self, wash_type='basic', price='15.00', **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return WashOrder.objects.create(
+                client=self.client_obj, vehicle=self.vehicle, wash_type=wash_type, price=price, **fields
+            )
+
+    def stored(self):
+        return {
+            (row.wash_type, row.status, row.washer_id): (row.orders, row.revenue, row.timed_orders)
+            for row in DailyOrderStats.objects.filter(date=self.today) if row.orders
+        }
+
+    def test_transitions_move_orders_between_rows(self):
+        done, cancelled, pending = self.order('premium', '25.00'), self.order(), self.order()
+        held = self.order(status='scheduled', release_at=timezone.now() - timedelta(minutes=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_order(done.order_id, self.washer.washer_id)
+            assign_order(cancelled.order_id, self.washer.washer_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            start_order(done.order_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            complete_order(done.order_id)
+            cancel_order(cancelled.order_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            release_due_orders()
+
+        self.assertEqual(self.stored(), {
+            ('premium', 'completed', self.washer.washer_id): (1, Decimal('25.00'), 1),
+            ('basic', 'cancelled', self.washer.washer_id): (1, Decimal('15.00'), 0),
+            ('basic', 'pending', None): (2, Decimal('30.00'), 0),
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pending.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            held.refresh_from_db()
+            held.wash_type = 'deluxe'
+            held.save()
+        self.assertEqual(rollups.drifted_days(self.today, self.today), [])
+        self.assertEqual(self.stored()[('deluxe', 'pending', None)][0], 1)
+
+    def test_backfill_repairs_drift(self):
+        self.order()
+        WashOrder.objects.update(price=Decimal('99.00'))
+        self.assertEqual(rollups.drifted_days(self.today, self.today), [self.today])
+
+        out = io.StringIO()
+        call_command('backfill_rollups', '--chunk-days', '2', stdout=out)
+        self.assertIn('1 row(s)', out.getvalue())
+        self.assertEqual(rollups.drifted_days(self.today, self.today), [])
+        self.assertEqual(self.stored(), {('basic', 'pending', None): (1, Decimal('99.00'), 0)})
+
+    def test_edits_move_the_order_with_a_delta(self):
+        order = self.order()
+        order = WashOrder.objects.get(order_id=order.order_id)
+        order.wash_type, order.price = 'premium', Decimal('25.00')
+        with mock.patch.object(rollups, 'rebuild') as rebuild, self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        rebuild.assert_not_called()
+        self.assertEqual(self.stored(), {('premium', 'pending', None): (1, Decimal('25.00'), 0)})
+        self.assertEqual(DailyOrderStats.objects.filter(date=self.today).count(), 2)
+
+    def test_upsert_adds_to_a_row_created_meanwhile(self):
+        changes = rollups._changes()
+        rollups._add(changes, (self.today, 'basic', 'pending', None), (1, Decimal('15.00'), 0, 0))
+        add_to_row = rollups._add_to_row
+
+        def racing(*args):
+            # The first update finds no row; another writer creates it before the insert
+            if racing.first:
+                racing.first = False
+                DailyOrderStats.objects.create(
+                    date=self.today, wash_type='basic', status='pending', orders=2, revenue=Decimal('30.00')
+                )
+                return 0
+            return add_to_row(*args)
+        racing.first = True
+
+        with mock.patch.object(rollups, '_add_to_row', side_effect=racing):
+            rollups.apply(changes)
+        self.assertEqual(self.stored(), {('basic', 'pending', None): (3, Decimal('45.00'), 0)})
+        self.assertEqual(DailyOrderStats.objects.filter(date=self.today).count(), 1)
+
+    def test_updates_blocked_by_a_lock_are_retried(self):
+        apply = rollups.apply
+        attempts = []
+
+        def locked_twice(changes):
+            attempts.append(changes)
+            if len(attempts) <= 2:
+                raise OperationalError('database table is locked')
+            return apply(changes)
+
+        with mock.patch.object(rollups, 'apply', side_effect=locked_twice):
+            self.order()
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(rollups.stale_days(), [])
+        self.assertEqual(self.stored(), {('basic', 'pending', None): (1, Decimal('15.00'), 0)})
+
+    @mock.patch.object(rollups, 'RETRY_SECONDS', 0)
+    def test_failed_updates_mark_the_day_for_stale_backfill(self):
+        with mock.patch.object(rollups, 'apply', side_effect=OperationalError('table is locked')), \
+                self.assertLogs('clients.rollups', 'ERROR'):
+            order = self.order()
+        self.assertEqual([day for day, _ in rollups.stale_days()], [self.today])
+        self.assertEqual(rollups.drifted_days(self.today, self.today), [self.today])
+
+        out = io.StringIO()
+        call_command('backfill_rollups', '--stale', stdout=out)
+        self.assertIn('Rebuilt 1 stale rollup day(s).', out.getvalue())
+        self.assertEqual(rollups.stale_days(), [])
+        self.assertEqual(self.stored(), {('basic', 'pending', None): (1, Decimal('15.00'), 0)})
+
+    def test_chunks_cover_the_range(self):
+        start = self.today - timedelta(days=9)
+        chunks = list(rollups.in_chunks(start, self.today, 4))
+        self.assertEqual([(a.day, b.day) for a, b in chunks][0], (start.day, (start + timedelta(days=3)).day))
+        self.assertEqual(chunks[-1][1], self.today)
+        self.assertEqual(sum((b - a).days + 1 for a, b in chunks), 10)
+
+
+class WasherStatsTests(FixtureMixin, TestCase):
+    """Ratings and service times are maintained per washer"""
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('stats')
+        self.washer = self.make_washer('statswasher', max_concurrent_orders=5)
+
+    def completed_order(self, minutes):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = WashOrder.objects.create(
+                client=self.client_obj, vehicle=self.vehicle, wash_type='basic', price=Decimal('15.00')
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_order(order.order_id, self.washer.washer_id)
+            start_order(order.order_id)
+        WashOrder.objects.filter(order_id=order.order_id).update(
+            started_at=timezone.now() - timedelta(minutes=minutes)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            complete_order(order.order_id)
+        return order
+
+    def review(self, order, rating):
+        return Review.objects.create(
+            client=self.client_obj, wash_order=order, washer=self.washer, rating=rating, job_id=order.order_id
+        )
+
+    def test_percentiles_from_buckets(self):
+        buckets = [(10, 5), (20, 4), (60, 1)]
+        self.assertEqual(washer_stats.percentile(buckets, 50), 10)
+        self.assertEqual(washer_stats.percentile(buckets, 90), 20)
+        self.assertEqual(washer_stats.percentile(buckets, 100), 60)
+        self.assertEqual(washer_stats.summarize_service_times(buckets)['avg'], 19)
+        self.assertIsNone(washer_stats.percentile([], 50))
+
+    def test_reviews_move_the_rating_counters(self):
+        first, second = self.completed_order(20), self.completed_order(30)
+        self.review(first, 5)
+        review = self.review(second, 2)
+        self.washer.refresh_from_db()
+        self.assertEqual(self.washer.average_rating, 3.5)
+
+        review.rating = 4
+        review.save()
+        self.washer.refresh_from_db()
+        self.assertEqual(self.washer.average_rating, 4.5)
+
+        review.delete()
+        self.washer.refresh_from_db()
+        self.assertEqual((self.washer.rating_count, self.washer.rating_total), (1, 5))
+        self.assertEqual(washer_stats.overall_rating(), 5.0)
+
+    def test_moving_a_review_recounts_both_washers(self):
+        review = self.review(self.completed_order(20), 4)
+        other = self.make_washer('otherwasher')
+
+        review = Review.objects.get(pk=review.pk)
+        review.washer = other
+        review.save()
+        self.washer.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.washer.rating_count, self.washer.rating_total), (0, 0))
+        self.assertEqual((other.rating_count, other.rating_total), (1, 4))
+
+        review.washer = None
+        review.save()
+        other.refresh_from_db()
+        self.assertEqual((other.rating_count, other.rating_total), (0, 0))
+
+    def test_first_completions_racing_into_a_bucket_both_count(self):
+        add_to_bucket = washer_stats._add_to_bucket
+
+        def racing(washer_id, minutes, orders):
+            if racing.first:
+                # Another completion creates the bucket between our update and insert
+                racing.first = False
+                WasherServiceTime.objects.create(washer_id=washer_id, minutes=minutes, orders=1)
+                return 0
+            return add_to_bucket(washer_id, minutes, orders)
+        racing.first = True
+
+        with mock.patch.object(washer_stats, '_add_to_bucket', side_effect=racing):
+            washer_stats.adjust_service_time(self.washer.washer_id, 25)
+        self.assertEqual(
+            list(WasherServiceTime.objects.filter(washer=self.washer).values_list('minutes', 'orders')), [(25, 2)]
+        )
+
+    def test_stale_full_save_keeps_the_counters(self):
+        stale = Washer.objects.get(washer_id=self.washer.washer_id)
+        self.review(self.completed_order(20), 4)
+        stale.phone = '0711111111'
+        stale.save()
+        self.washer.refresh_from_db()
+        self.assertEqual((self.washer.rating_count, self.washer.rating_total), (1, 4))
+
+    def test_completions_fill_the_histogram(self):
+        for minutes in (20, 20, 25, 40, 90):
+            self.completed_order(minutes)
+        times = washer_stats.service_times()[self.washer.washer_id]
+        self.assertEqual(times, {'orders': 5, 'avg': 39, 'p50': 25, 'p90': 90})
+        self.assertEqual(washer_stats.overall_service_time(), times)
+
+        WashOrder.objects.filter(started_at__lt=timezone.now() - timedelta(minutes=60)).delete()
+        self.assertEqual(washer_stats.service_times()[self.washer.washer_id]['p90'], 40)
+        self.assertEqual(washer_stats.rebuild(fix=False), [])
+
+    def test_rebuild_repairs_drift(self):
+        self.review(self.completed_order(30), 5)
+        Washer.objects.update(rating_count=0, rating_total=0)
+        WasherServiceTime.objects.update(minutes=1)
+
+        self.assertEqual(sorted(washer_stats.rebuild()), [
+            (self.washer.washer_id, 'rating'), (self.washer.washer_id, 'service_times')
+        ])
+        self.assertEqual(washer_stats.rebuild(fix=False), [])
+        self.assertEqual(washer_stats.service_times()[self.washer.washer_id]['p50'], 30)
+
+
+class DispatcherTests(SimpleTestCase):
+    """Heap ordering of the in-memory dispatcher"""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def test_priority_policy_prefers_deluxe_and_imminent_appointments(self):
+        old_basic = OrderCandidate(1, self.now - timedelta(minutes=5), 'basic')
+        new_deluxe = OrderCandidate(2, self.now - timedelta(minutes=1), 'deluxe')
+        appointment = OrderCandidate(3, self.now, 'basic', self.now + timedelta(minutes=10))
+
+        dispatcher = Dispatcher(PriorityOrderPolicy(), SeniorityWasherPolicy(), now=self.now)
+        for order in (old_basic, new_deluxe, appointment):
+            dispatcher.push_order(order)
+
+        self.assertEqual([o.order_id for o in dispatcher.pending_orders()], [3, 2, 1])
+
+    def test_fifo_policy_keeps_creation_order(self):
+        dispatcher = Dispatcher(FifoOrderPolicy(), SeniorityWasherPolicy(), now=self.now)
+        for order_id, wash_type in enumerate(['deluxe', 'basic', 'premium']):
+            dispatcher.push_order(OrderCandidate(order_id, self.now - timedelta(minutes=10 - order_id), wash_type))
+
+        self.assertEqual([o.order_id for o in dispatcher.pending_orders()], [0, 1, 2])
+
+    def test_balanced_policy_prefers_rated_and_rested_washers(self):
+        dispatcher = Dispatcher(FifoOrderPolicy(), BalancedWasherPolicy(), now=self.now)
+        dispatcher.push_washer(WasherCandidate(1, self.now, rating=3, completed_today=0))
+        dispatcher.push_washer(WasherCandidate(2, self.now, rating=5, completed_today=6))
+        dispatcher.push_washer(WasherCandidate(3, self.now, rating=5, completed_today=1))
+        for order_id in range(4):
+            dispatcher.push_order(OrderCandidate(order_id, self.now - timedelta(minutes=10 - order_id)))
+
+        pairs = [(order.order_id, washer.washer_id) for order, washer in dispatcher.match()]
+
+        self.assertEqual(pairs, [(0, 3), (1, 1), (2, 2)])
+        self.assertEqual([o.order_id for o in dispatcher.pending_orders()], [3])
+
+
+class OptimalMatchingTests(SimpleTestCase):
+    """Batch matching beats greedy pairing and the fallback solver is exact"""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def test_top_rated_washer_gets_deluxe_wash(self):
+        basic = OrderCandidate(1, self.now - timedelta(minutes=30), 'basic')
+        deluxe = OrderCandidate(2, self.now - timedelta(minutes=5), 'deluxe')
+        low = WasherCandidate(10, self.now, rating=2, hourly_rate=10)
+        high = WasherCandidate(20, self.now, rating=5, hourly_rate=10)
+
+        pairs = matching.optimal_pairs([basic, deluxe], [low, high], self.now)
+
+        self.assertEqual(
+            sorted((order.order_id, washer.washer_id) for order, washer in pairs),
+            [(1, 10), (2, 20)]
+        )
+
+    @skipIf(matching.linear_sum_assignment is None, 'scipy is not installed')
+    def test_hundreds_by_hundreds_in_milliseconds(self):
+        rng = random.Random(3)
+        orders = [
+            OrderCandidate(
+                i, self.now - timedelta(minutes=rng.randint(0, 120)), rng.choice(['basic', 'premium', 'deluxe'])
+            )
+            for i in range(600)
+        ]
+        washers = [
+            WasherCandidate(i, self.now, rating=rng.randint(1, 5), hourly_rate=rng.randint(8, 20))
+            for i in range(200)
+        ]
+        started = time.perf_counter()
+        pairs = matching.optimal_pairs(orders, washers, self.now)
+        self.assertEqual(len(pairs), 200)
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+    @mock.patch.object(matching, 'np', None)
+    @mock.patch.object(matching, 'linear_sum_assignment', None)
+    def test_fallback_solver_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(100):
+            rows, cols = rng.randint(1, 4), rng.randint(1, 4)
+            cost = [[rng.randint(0, 20) for _ in range(cols)] for _ in range(rows)]
+            size = min(rows, cols)
+
+            best = min(
+                sum(cost[r][c] for r, c in zip(row_pick, col_pick))
+                for row_pick in itertools.permutations(range(rows), size)
+                for col_pick in itertools.combinations(range(cols), size)
+            )
+            pairs = matching.solve_assignment(cost)
+
+            self.assertEqual(len(pairs), size)
+            self.assertEqual(sum(cost[r][c] for r, c in pairs), best)
+
+
+class DispatchQueryCountTests(FixtureMixin, TestCase):
+    """A dispatch pass costs the same number of queries for any backlog"""
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('queue')
+
+    def add_backlog(self, orders, washers):
+        start = Washer.objects.count()
+        for i in range(start, start + washers):
+            self.make_washer(f'queue{i}')
+        WashOrder.objects.bulk_create(
+            WashOrder(client=self.client_obj, vehicle=self.vehicle, price=15)
+            for _ in range(orders)
+        )
+
+    def test_constant_queries(self):
+        self.add_backlog(orders=3, washers=2)
+        with CaptureQueriesContext(connection) as small:
+            report = dispatch_pending_orders()
+        self.assertEqual(len(report['assigned']), 2)
+        self.assertEqual(len(small), 7)
+
+        # Twenty times the backlog, the same queries
+        self.add_backlog(orders=60, washers=40)
+        with self.assertNumQueries(len(small)), self.assertLogs('clients.utils', 'INFO') as logs:
+            report = dispatch_pending_orders()
+        self.assertEqual(logs.output, ['INFO:clients.utils:Auto-assigned 40 order(s), 21 still pending'])
+        self.assertEqual(len(report['assigned']), 40)
+        self.assertEqual(len(report['skipped']), 21)
+        self.assertEqual({reason for _, reason in report['skipped']}, {'no_free_washer'})
+        self.assertEqual(rebuild_active_order_counts(fix=False), [])
+
+    def test_dispatch_fills_washers_to_capacity(self):
+        self.add_backlog(orders=7, washers=2)
+        Washer.objects.update(max_concurrent_orders=3)
+
+        report = dispatch_pending_orders()
+
+        self.assertEqual(len(report['assigned']), 6)
+        self.assertEqual(sorted(Washer.objects.values_list('active_order_count', flat=True)), [3, 3])
+        self.assertEqual(rebuild_active_order_counts(fix=False), [])
+
+    def test_optimal_matching_constant_queries(self):
+        self.add_backlog(orders=30, washers=10)
+        # Two more reads than greedy, for the plan made before the transaction
+        with self.assertNumQueries(9):
+            report = dispatch_pending_orders(matching='optimal')
+        self.assertEqual(len(report['assigned']), 10)
+        self.assertEqual(len(report['skipped']), 20)
+        self.assertEqual({reason for _, reason in report['skipped']}, {'not_planned'})
+
+    def test_orders_whose_planned_washer_was_taken_are_reported(self):
+        self.add_backlog(orders=2, washers=1)
+        plan_optimal_pairs = utils.plan_optimal_pairs
+
+        def washer_taken_after_planning(now):
+            plan = plan_optimal_pairs(now)
+            Washer.objects.update(is_available=False)
+            return plan
+
+        with mock.patch.object(utils, 'plan_optimal_pairs', side_effect=washer_taken_after_planning):
+            report = dispatch_pending_orders(matching='optimal')
+        planned, unplanned = WashOrder.objects.order_by('order_id').values_list('order_id', flat=True)
+        self.assertEqual(report['assigned'], [])
+        self.assertEqual(report['skipped'], [(planned, 'washer_taken'), (unplanned, 'not_planned')])
+
+    def test_orders_that_left_pending_are_not_counted(self):
+        self.add_backlog(orders=2, washers=2)
+        order_candidates = utils.order_candidates
+        cancelled = WashOrder.objects.earliest('order_id')
+
+        def cancelled_after_reading(queryset):
+            candidates = order_candidates(queryset)
+            WashOrder.objects.filter(order_id=cancelled.order_id).update(status='cancelled')
+            return candidates
+
+        with mock.patch.object(utils, 'order_candidates', side_effect=cancelled_after_reading), \
+                self.assertLogs('clients.utils', 'WARNING') as logs:
+            report = dispatch_pending_orders()
+        self.assertIn('1 order(s) left pending during dispatch', logs.output[0])
+        self.assertEqual(len(report['assigned']), 1)
+        self.assertEqual(report['skipped'], [(cancelled.order_id, 'no_longer_pending')])
+        self.assertEqual(sorted(Washer.objects.values_list('active_order_count', flat=True)), [0, 1])
+        self.assertEqual(rebuild_active_order_counts(fix=False), [])
+
+    def test_optimal_plan_is_solved_before_the_transaction(self):
+        self.add_backlog(orders=6, washers=3)
+        queries_before_solving = []
+        build_cost_matrix = matching.build_cost_matrix
+
+        def recording(*args):
+            queries_before_solving.extend(query['sql'] for query in ctx.captured_queries)
+            return build_cost_matrix(*args)
+
+        with CaptureQueriesContext(connection) as ctx, \
+                mock.patch.object(matching, 'build_cost_matrix', side_effect=recording):
+            report = dispatch_pending_orders(matching='optimal')
+        self.assertEqual(len(report['assigned']), 3)
+        self.assertTrue(queries_before_solving)
+        self.assertFalse([sql for sql in queries_before_solving if 'SAVEPOINT' in sql or 'UPDATE' in sql])
+
+    @mock.patch.object(matching, 'linear_sum_assignment', None)
+    @mock.patch.object(matching, 'PURE_PYTHON_MAX_CELLS', 10)
+    def test_large_batches_fall_back_to_greedy_without_scipy(self):
+        self.add_backlog(orders=12, washers=4)
+        with mock.patch.object(matching, 'solve_assignment') as solve, \
+                self.assertLogs('clients.utils', 'WARNING') as logs:
+            report = dispatch_pending_orders(matching='optimal')
+        solve.assert_not_called()
+        self.assertIn('matching greedily', logs.output[0])
+        self.assertEqual(len(report['assigned']), 4)
+        self.assertEqual(rebuild_active_order_counts(fix=False), [])
+
+
+@override_settings(DISPATCH_COALESCE_SECONDS=60)
+class DispatchTickTests(FixtureMixin, TestCase):
+    """Capacity-freeing transitions share one coalesced dispatch pass"""
+
+    def setUp(self):
+        self.client_obj, self.vehicle = self.make_client('tick')
+        self.addCleanup(ticker.flush)
+
+    def make_order(self, **kwargs):
+        return WashOrder.objects.create(client=self.client_obj, vehicle=self.vehicle, price=15, **kwargs)
+
+    def test_burst_of_completions_triggers_one_pass(self):
+        in_progress = []
+        for i in range(5):
+            washer = self.make_washer(f'tick{i}', is_available=False)
+            in_progress.append(self.make_order(washer=washer, status='in_progress'))
+        Washer.objects.update(is_available=True)
+        waiting = [self.make_order() for _ in range(5)]
+
+        ticks_before = ticker.stats['ticks']
+        with self.captureOnCommitCallbacks(execute=True):
+            for order in WashOrder.objects.filter(status='in_progress'):
+                order.status = 'completed'
+                order.save()
+
+        self.assertEqual(ticker.stats['ticks'], ticks_before)
+        report = ticker.flush()
+
+        self.assertEqual(ticker.stats['ticks'], ticks_before + 1)
+        self.assertEqual(len(report['assigned']), len(waiting))
+        self.assertIsNotNone(ticker.stats['last_latency_ms'])
+
+    def test_washer_coming_on_duty_enqueues_tick(self):
+        washer = self.make_washer('late', is_available=False)
+        order = self.make_order()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            washer = Washer.objects.get(washer_id=washer.washer_id)
+            washer.is_available = True
+            washer.save(update_fields=['is_available'])
+
+        self.assertEqual(ticker.flush()['assigned'], [(order.order_id, washer.washer_id)])
+
+    def test_cancelling_names_the_freed_washer(self):
+        washer = self.make_washer('freed')
+        order = self.make_order()
+        assign_order(order.order_id, washer.washer_id)
+        freed = []
+        receiver = lambda sender, washer_id=None, **kwargs: freed.append(washer_id)
+        capacity_freed.connect(receiver)
+        self.addCleanup(capacity_freed.disconnect, receiver)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transition = cancel_order(order.order_id)
+        self.assertEqual((transition.washer_id, freed), (washer.washer_id, [washer.washer_id]))
+
+    def test_flush_waits_for_the_freeing_commit(self):
+        washer = self.make_washer('commit', is_available=False)
+        order = self.make_order()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                washer.is_available = True
+                washer.save(update_fields=['is_available'])
+                reports = flush_after_commit()
+                self.assertEqual(reports, [])
+        self.assertEqual(reports[0]['assigned'], [(order.order_id, washer.washer_id)])
+
+    @override_settings(DISPATCH_TICKER_TIMER=False)
+    def test_without_timer_threads_cron_picks_up_coalesced_events(self):
+        washers = [
+            self.make_washer(f'notimer{i}', is_available=False)
+            for i in range(2)
+        ]
+        orders = [self.make_order() for _ in range(2)]
+
+        with mock.patch('clients.events.ticker', DispatchTicker()) as fresh_ticker:
+            # The first event after a quiet spell dispatches at once
+            with self.captureOnCommitCallbacks(execute=True):
+                washer = Washer.objects.get(pk=washers[0].pk)
+                washer.is_available = True
+                washer.save(update_fields=['is_available'])
+            self.assertEqual(fresh_ticker.stats['ticks'], 1)
+            self.assertIsNone(fresh_ticker._timer)
+
+            # One inside the window waits for the next pass
+            with self.captureOnCommitCallbacks(execute=True):
+                washer = Washer.objects.get(pk=washers[1].pk)
+                washer.is_available = True
+                washer.save(update_fields=['is_available'])
+            self.assertEqual(fresh_ticker.stats['ticks'], 1)
+
+        out = io.StringIO()
+        call_command('dispatch_tick', stdout=out)
+        self.assertIn('assigned 1', out.getvalue())
+        self.assertFalse(WashOrder.objects.filter(order_id__in=[o.order_id for o in orders], status='pending'))
+
+
+class OperationsSimulatorTests(TestCase):
+    """The simulator drives the real dispatch path end to end"""
+
+    def test_short_run_is_consistent(self):
+        summary = OperationsSimulator(hours=3, washers=4, arrivals_per_hour=12, seed=1).run()
+
+        self.assertGreater(summary['dispatched'], 0)
+        self.assertLessEqual(summary['completed'], summary['dispatched'])
+        self.assertLessEqual(summary['wait_p50'], summary['wait_p95'])
+        self.assertLessEqual(summary['utilization'], 1)
+        self.assertEqual(rebuild_active_order_counts(fix=False), [])
+
+    def test_command_runs_on_its_own_database_and_caches(self):
+        default = connections['default']
+        configured_cache = caches['default']
+        cache.set('kept', 1)
+        out = io.StringIO()
+
+        call_command('simulate_operations', hours=2, washers=2, stdout=out)
+
+        self.assertIn('queries per pass', out.getvalue())
+        self.assertIs(connections['default'], default)
+        self.assertIs(caches['default'], configured_cache)
+        self.assertEqual(cache.get('kept'), 1)
+        self.assertFalse(WashOrder.objects.exists())
+        self.assertFalse(Washer.objects.exists())
@@ -0,0 +1,197 @@
+# clients/transitions.py
+"""
+WashOrder state machine.
+
+    pending/scheduled -> assigned -> in_progress -> completed
+             \________________\____________\____-> cancelled
+
+pending and scheduled also swap when an appointment is moved
+(reschedule_order).
+
+Each transition is a conditional UPDATE of just the status and its
+timestamp, guarded by the statuses it may start from, so an illegal
+transition simply matches no row and save()/clean() never run. Cancelling
+and rescheduling can start from several statuses, so they first read the
+order's status (and washer) with its row locked and guard the one UPDATE
+on that status. A transition that happens returns an OrderTransition
+describing it and sends it with order_transitioned; one that doesn't
+returns None.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
+
+from washers.models import Washer
+from .models import WashOrder
+
+
+# Sent with transition=OrderTransition(...) after each successful transition
+order_transitioned = Signal()
+
+
+class OrderTransition:
+    """What changed in a successful transition"""
+    __slots__ = ('order_id', 'name', 'from_statuses', 'to_status', 'washer_id', 'at')
+
+    def __init__(self, order_id, name, from_statuses, to_status, washer_id=None, at=None):
+        self.order_id = order_id
+        self.name = name
+        self.from_statuses = tuple(from_statuses)
+        self.to_status = to_status
+        self.washer_id = washer_id
+        self.at = at
+
+    @property
+    def frees_capacity(self):
+        """True if a washer stopped working this order"""
+        return bool(set(self.from_statuses) & set(WashOrder.ACTIVE_STATUSES)) and \
+            self.to_status not in WashOrder.ACTIVE_STATUSES
+
+    def __repr__(self):
+        return f'<OrderTransition #{self.order_id} {self.name}: {"/".join(self.from_statuses)} -> {self.to_status}>'
+
+
+QUEUED_STATUSES = ('pending', 'scheduled')
+
+
+def _send(transition):
+    order_transitioned.send(sender=WashOrder, transition=transition)
+
+
+def assign_order(order_id, washer_id):
+    """
+    pending -> assigned. Takes a capacity slot on the washer with a guarded
+    UPDATE first (see Washer.reserve_order_slot), then claims the order;
+    either both happen or neither does.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if not Washer.reserve_order_slot(washer_id):
+            return None
+
+        claimed = WashOrder.objects.filter(order_id=order_id, status='pending').update(
+            washer_id=washer_id,
+            status='assigned',
+            assigned_at=now
+        )
+        if not claimed:
+            transaction.set_rollback(True)
+            return None
+
+    transition = OrderTransition(order_id, 'assign', ['pending'], 'assigned', washer_id, now)
+    _send(transition)
+    return transition
+
+
+def start_order(order_id, washer_id=None):
+    """assigned -> in_progress, optionally only for the given washer"""
+    now = timezone.now()
+    orders = WashOrder.objects.filter(order_id=order_id, status='assigned')
+    if washer_id is not None:
+        orders = orders.filter(washer_id=washer_id)
+
+    if not orders.update(status='in_progress', started_at=now):
+        return None
+
+    transition = OrderTransition(order_id, 'start', ['assigned'], 'in_progress', washer_id, now)
+    _send(transition)
+    return transition
+
+
+def _lock_order(order_id, statuses):
+    """
+    (status, washer_id) of the order with its row locked, or None if it
+    isn't in one of the statuses. Call inside a transaction.
+    """
+    return WashOrder.objects.select_for_update().filter(
+        order_id=order_id, status__in=statuses
+    ).values_list('status', 'washer_id').first()
+
+
+def _update_from(order_id, statuses, **fields):
+    """
+    Move the order out of whichever of the statuses it is in with one
+    guarded UPDATE. Returns the (status, washer_id) it left, or None.
+    """
+    while True:
+        current = _lock_order(order_id, statuses)
+        if current is None:
+            return None
+        # Guarded on the status read too: SQLite takes no row locks, so
+        # another writer may have moved the order since
+        if WashOrder.objects.filter(order_id=order_id, status=current[0]).update(**fields):
+            return current
+
+
+def _release_washer(order_id, washer_id):
+    """Give the order's capacity slot back to its washer"""
+    if washer_id is not None:
+        washers = Washer.objects.filter(washer_id=washer_id)
+    else:
+        washers = Washer.objects.filter(
+            washer_id__in=WashOrder.objects.filter(order_id=order_id).values('washer_id')
+        )
+    washers.filter(active_order_count__gt=0).update(active_order_count=F('active_order_count') - 1)
+
+
+def complete_order(order_id, washer_id=None):
+    """in_progress -> completed, optionally only for the given washer"""
+    now = timezone.now()
+    with transaction.atomic():
+        orders = WashOrder.objects.filter(order_id=order_id, status='in_progress')
+        if washer_id is not None:
+            orders = orders.filter(washer_id=washer_id)
+
+        if not orders.update(status='completed', completed_at=now):
+            return None
+        _release_washer(order_id, washer_id)
+
+    transition = OrderTransition(order_id, 'complete', ['in_progress'], 'completed', washer_id, now)
+    _send(transition)
+    return transition
+
+
+def cancel_order(order_id):
+    """
+    Any open status -> cancelled. An order a washer is working on releases
+    the washer's capacity slot. The transition records which status the
+    order left and, for an active order, its washer.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        left = _update_from(order_id, WashOrder.ACTIVE_STATUSES + list(QUEUED_STATUSES), status='cancelled')
+        if left is None:
+            return None
+        from_status, washer_id = left
+        if from_status in WashOrder.ACTIVE_STATUSES:
+            _release_washer(order_id, washer_id)
+        else:
+            washer_id = None
+
+    transition = OrderTransition(order_id, 'cancel', [from_status], 'cancelled', washer_id, now)
+    _send(transition)
+    return transition
+
+
+def reschedule_order(order_id, release_at):
+    """
+    pending/scheduled -> scheduled or pending, for an appointment moved so
+    that its order is released at release_at: held while that is still
+    ahead, queued for dispatch once it has passed. An order a washer has
+    already taken is left alone. Returns the transition, or None if the
+    order wasn't queued or kept its status (release_at is updated either way).
+    """
+    now = timezone.now()
+    to_status = 'scheduled' if release_at > now else 'pending'
+    with transaction.atomic():
+        left = _update_from(order_id, QUEUED_STATUSES, status=to_status, release_at=release_at)
+    if left is None:
+        return None
+    from_status = left[0]
+
+    if from_status == to_status:
+        return None
+    transition = OrderTransition(order_id, 'reschedule', [from_status], to_status, None, now)
+    _send(transition)
+    return transition
@@ -23,6 +23,8 @@ urlpatterns = [
     path('track-order/<int:order_id>/', views.track_order_view, name='track_order'),
     path('order-history/', views.order_history_view, name='order_history'),
     path('schedule/', views.schedule_appointment_view, name='schedule_appointment'),
+    path('schedule/calendar/', views.availability_calendar_view, name='availability_calendar'),
+    path('schedule/next-available/', views.next_available_view, name='next_available'),
     path('appointments/', views.my_appointments_view, name='my_appointments'),
     path('appointments/cancel/<int:appointment_id>/', views.cancel_appointment_view, name='cancel_appointment'),
     path('appointments/reschedule/<int:appointment_id>/', views.reschedule_appointment_view, name='reschedule_appointment'),
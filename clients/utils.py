@@ -2,66 +2,341 @@
 """
 Utility functions for client operations
 """
+import logging
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
 from django.utils import timezone
-from .models import WashOrder
+from django.conf import settings
+from . import rollups
+from .dispatch import Dispatcher, order_candidates, washer_candidates
+from .matching import can_solve, optimal_pairs
+from .models import Appointment, TimeSlot, WashOrder
+from .transitions import OrderTransition, assign_order, order_transitioned
 from washers.models import Washer
 
 
+logger = logging.getLogger(__name__)
+
+# Order statuses that keep a washer busy
+ACTIVE_ORDER_STATUSES = WashOrder.ACTIVE_STATUSES
+
+# In 'optimal' matching, how many of the top-priority orders per free
+# washer slot are considered for the cost matrix
+MATCHING_LOOKAHEAD = 3
+
+
+def get_free_washers():
+    """
+    Queryset of washers who are active, available and have room for
+    another order.
+
+    Served from the maintained active_order_count column, so this is a
+    single lookup on the washers table with no join or COUNT.
+    """
+    return Washer.objects.filter(
+        is_available=True,
+        status='active',
+        active_order_count__lt=F('max_concurrent_orders')
+    )
+
+
+def ranked_free_washers(now=None):
+    """
+    The free washers as WasherCandidates, best first by the configured
+    washer policy (DISPATCH_WASHER_POLICY), from one query.
+    """
+    dispatcher = Dispatcher(now=now)
+    for washer in washer_candidates(get_free_washers(), now=now):
+        dispatcher.push_washer(washer)
+    return dispatcher.free_washers()
+
+
+def claim_order(order_id, washer_id):
+    """
+    Atomically assign a pending order to a washer.
+
+    A slot on the washer is reserved first with a guarded UPDATE on its
+    active_order_count (see Washer.reserve_order_slot), which also takes
+    the washer's row lock, and the order is then claimed with an UPDATE
+    that only matches while it is still pending. Either both succeed or the
+    transaction is rolled back, so concurrent claims can never push a
+    washer past max_concurrent_orders. This is the 'assign' transition of
+    clients.transitions.
+
+    Returns True if this call assigned the order.
+    """
+    return bool(assign_order(order_id, washer_id))
+
+
+def rebuild_active_order_counts(fix=True):
+    """
+    Compare every washer's active_order_count with the real number of
+    active orders and (optionally) repair the ones that drifted.
+
+    Returns a list of (washer_id, stored, actual) tuples for drifted washers.
+    """
+    actual_counts = Washer.objects.annotate(
+        actual=Count('washorder', filter=Q(washorder__status__in=ACTIVE_ORDER_STATUSES))
+    ).values_list('washer_id', 'active_order_count', 'actual')
+
+    drifted = [row for row in actual_counts if row[1] != row[2]]
+
+    if fix and drifted:
+        with transaction.atomic():
+            for washer_id, _, actual in drifted:
+                Washer.objects.filter(washer_id=washer_id).update(active_order_count=actual)
+
+    return drifted
+
+
+def rebuild_slot_booked_counts(fix=True):
+    """
+    Recompute every time slot's booked_count and booked_minutes from the
+    non-cancelled appointments (including washes running on from the
+    previous slot) and (optionally) repair the ones that drifted.
+
+    Returns a list of (slot_id, stored, actual) tuples for drifted slots,
+    where stored and actual are (bookings, bay-minutes) pairs.
+    """
+    slots = TimeSlot.objects.only(
+        'date', 'start_time', 'end_time', 'length_minutes', 'booked_count', 'booked_minutes'
+    ).in_bulk()
+    by_position = {(slot.date, slot.start_time): slot for slot in slots.values()}
+
+    actual = {slot_id: [0, 0] for slot_id in slots}
+    booked = Appointment.objects.filter(is_cancelled=False).values_list('time_slot_id', 'booked_minutes')
+    for slot_id, minutes in booked:
+        slot = slots[slot_id]
+        parts = slot.split(minutes, by_position.get((slot.date, slot.end_time))) or \
+            [(slot, min(minutes, slot.length_minutes))]
+        for part_id, (taken, bookings) in TimeSlot.booking_changes(parts).items():
+            actual[part_id][0] += bookings
+            actual[part_id][1] += taken
+
+    drifted = [
+        (slot_id, (slot.booked_count, slot.booked_minutes), tuple(actual[slot_id]))
+        for slot_id, slot in slots.items()
+        if (slot.booked_count, slot.booked_minutes) != tuple(actual[slot_id])
+    ]
+
+    if fix and drifted:
+        with transaction.atomic():
+            for slot_id, _, (bookings, minutes) in drifted:
+                TimeSlot.objects.filter(id=slot_id).update(booked_count=bookings, booked_minutes=minutes)
+
+    return drifted
+
+
+def release_due_orders(now=None):
+    """
+    Move held appointment orders whose release time has come into the
+    pending queue. Only due rows are touched, via the (status, release_at)
+    index. Returns the number of orders released.
+    """
+    now = now or timezone.now()
+    # Read the due orders first, for the daily rollup; a pass with nothing
+    # due still costs one query
+    released = list(
+        WashOrder.objects.filter(status='scheduled', release_at__lte=now).only(*rollups.ROLLUP_FIELDS)
+    )
+    if not released:
+        return 0
+    count = WashOrder.objects.filter(
+        order_id__in=[order.order_id for order in released], status='scheduled'
+    ).update(status='pending')
+    if count == len(released):
+        rollups.record(rollups.status_changes(released, 'pending'))
+    else:
+        # Some were cancelled or released meanwhile; recount their days
+        for day in {rollups.order_day(order) for order in released}:
+            rollups.record_rebuild(day)
+    return count
+
+
+def next_release_at():
+    """Release time of the next held appointment order, or None"""
+    return WashOrder.objects.filter(
+        status='scheduled',
+        release_at__isnull=False
+    ).order_by('release_at').values_list('release_at', flat=True).first()
+
+
+def plan_optimal_pairs(now):
+    """
+    Solve 'optimal' matching over an unlocked read of the pending queue and
+    the free washers, so the solver runs before dispatch opens its write
+    transaction. Returns {order_id: washer_id}, or None when the problem is
+    too big for the pure-Python solver (the pass then matches greedily).
+    """
+    washers = washer_candidates(get_free_washers(), now=now)
+    dispatcher = Dispatcher(now=now)
+    for order in order_candidates(WashOrder.objects.filter(status='pending')):
+        dispatcher.push_order(order)
+    free_slots = sum(max(0, washer.capacity - washer.load) for washer in washers)
+    candidates = dispatcher.pop_orders(free_slots * MATCHING_LOOKAHEAD)
+    if not can_solve(len(candidates), free_slots):
+        logger.warning(
+            'Optimal matching of %d orders x %d washer slots needs scipy; matching greedily',
+            len(candidates), free_slots
+        )
+        return None
+    return {order.order_id: washer.washer_id for order, washer in optimal_pairs(candidates, washers, now)}
+
+
+def landed_assignments(assignments, now):
+    """
+    Split dispatch's assignments into those the bulk update wrote (the
+    order is now assigned to that washer at now) and those it didn't.
+    """
+    landed = set(WashOrder.objects.filter(
+        order_id__in=[order.order_id for order in assignments], status='assigned', assigned_at=now
+    ).values_list('order_id', 'washer_id'))
+    kept, lost = [], []
+    for order in assignments:
+        (kept if (order.order_id, order.washer_id) in landed else lost).append(order)
+    return kept, lost
+
+
+def dispatch_pending_orders(matching=None, now=None):
+    """
+    Assign pending orders to free washers in a single pass.
+
+    The free-washer pool and the pending queue are each fetched once and
+    loaded into a Dispatcher, which ranks orders by the configured order
+    policy. With 'greedy' matching (the default) the best order goes to the
+    best washer one at a time; with 'optimal' matching the top-priority
+    orders and all free washers are paired by solving an assignment
+    problem (see clients/matching.py) before the transaction opens, and
+    the planned pairs still valid under the locks are kept; whatever is
+    left (orders released by this pass, a washer taken meanwhile) is
+    matched greedily. Every assignment is written back with one bulk
+    update inside a single transaction, so the query count does not grow
+    with the backlog.
+
+    matching defaults to the DISPATCH_MATCHING setting. now (default: the
+    current time) is when the pass runs: it ranks the queue, releases due
+    held orders and stamps assigned_at, so a simulation can run on its own
+    clock.
+
+    The bulk update only matches orders still pending; if one left pending
+    since it was read (possible on SQLite, which takes no row locks), only
+    the assignments that landed are kept and counted against the washers.
+
+    Returns a report dict:
+        {
+            'released': number of held appointment orders released,
+            'assigned': [(order_id, washer_id), ...],
+            'skipped': [(order_id, reason), ...],
+        }
+    where reason is one of
+        'no_free_washer'     every free washer was full by its turn
+        'not_planned'        (optimal) left out of the solved batch
+        'washer_taken'       (optimal) its planned washer was taken meanwhile
+                             and no other washer was free
+        'locked'             another transaction held the order's row lock
+        'no_longer_pending'  assigned or cancelled elsewhere before the
+                             assignment was written
+    """
+    report = {'assigned': [], 'skipped': []}
+
+    now = now or timezone.now()
+    dispatcher = Dispatcher(now=now)
+    matching = matching or getattr(settings, 'DISPATCH_MATCHING', 'greedy')
+    plan = plan_optimal_pairs(now) if matching == 'optimal' else None
+
+    with transaction.atomic():
+        report['released'] = release_due_orders(now=now)
+
+        # The washer row locks are the same ones claim_order() takes;
+        # SQLite ignores them and serialises writers.
+        washers = washer_candidates(
+            get_free_washers().select_for_update(skip_locked=True, of=('self',)), now=now
+        )
+        locked_washers = {washer.washer_id: washer for washer in washers}
+        pairs = []
+        orders = order_candidates(
+            WashOrder.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status='pending')
+        )
+        for order in orders:
+            washer = locked_washers.get(plan.get(order.order_id)) if plan else None
+            if washer is not None and washer.has_capacity:
+                washer.load += 1
+                pairs.append((order, washer))
+            else:
+                dispatcher.push_order(order)
+
+        for washer in washers:
+            dispatcher.push_washer(washer)
+        pairs += dispatcher.match()
+
+        assignments = []
+        for order, washer in pairs:
+            assignments.append(WashOrder(
+                order_id=order.order_id,
+                washer_id=washer.washer_id,
+                status='assigned',
+                assigned_at=now,
+            ))
+            report['assigned'].append((order.order_id, washer.washer_id))
+
+        for order in dispatcher.pending_orders():
+            if plan is None:
+                reason = 'no_free_washer'
+            else:
+                reason = 'washer_taken' if order.order_id in plan else 'not_planned'
+            report['skipped'].append((order.order_id, reason))
+
+        if connection.features.has_select_for_update_skip_locked:
+            # Pending orders the locked read skipped are held by another
+            # transaction (a booking claiming them, a concurrent pass)
+            seen = {order.order_id for order in orders}
+            report['skipped'] += [
+                (order_id, 'locked')
+                for order_id in WashOrder.objects.filter(status='pending').values_list('order_id', flat=True)
+                if order_id not in seen
+            ]
+
+        if assignments:
+            # Bypasses WashOrder.save()/clean(); the dispatcher never fills
+            # a washer past its capacity
+            updated = WashOrder.objects.filter(status='pending').bulk_update(
+                assignments, ['washer', 'status', 'assigned_at']
+            )
+            if updated != len(assignments):
+                assignments, lost = landed_assignments(assignments, now)
+                logger.warning('%d order(s) left pending during dispatch; not assigned', len(lost))
+                report['assigned'] = [(order.order_id, order.washer_id) for order in assignments]
+                report['skipped'] += [(order.order_id, 'no_longer_pending') for order in lost]
+            added = Counter(order.washer_id for order in assignments)
+            Washer.objects.filter(washer_id__in=added).update(
+                active_order_count=F('active_order_count') + Case(
+                    *[When(washer_id=washer_id, then=Value(n)) for washer_id, n in added.items()],
+                    output_field=IntegerField()
+                )
+            )
+
+    # One daily rollup update for the whole pass
+    with rollups.batched():
+        for order_id, washer_id in report['assigned']:
+            order_transitioned.send(sender=WashOrder, transition=OrderTransition(
+                order_id, 'assign', ['pending'], 'assigned', washer_id, now
+            ))
+
+    if report['assigned']:
+        logger.info('Auto-assigned %d order(s), %d still pending', len(report['assigned']), len(report['skipped']))
+
+    return report
+
+
 def auto_assign_pending_orders():
     """
     Automatically assign pending orders to available washers.
     Returns the number of orders assigned.
     """
-    assigned_count = 0
-    
-    # Get all pending orders ordered by creation time (FIFO)
-    pending_orders = WashOrder.objects.filter(
-        status='pending'
-    ).order_by('created_at')
-    
-    if not pending_orders.exists():
-        return 0
-    
-    # Get washers who don't have any active orders
-    washers_with_active_orders = WashOrder.objects.filter(
-        status__in=['assigned', 'in_progress']
-    ).values_list('washer_id', flat=True)
-    
-    available_washers = Washer.objects.filter(
-        is_available=True,
-        status='active'
-    ).exclude(
-        washer_id__in=washers_with_active_orders
-    ).order_by('date_hired')  # Prioritize by seniority or any other criteria
-    
-    # Assign orders to available washers
-    for order in pending_orders:
-        # Check if there are still available washers
-        # Re-query to get fresh list since we're assigning in a loop
-        washers_with_active_orders = WashOrder.objects.filter(
-            status__in=['assigned', 'in_progress']
-        ).values_list('washer_id', flat=True)
-        
-        available_washer = Washer.objects.filter(
-            is_available=True,
-            status='active'
-        ).exclude(
-            washer_id__in=washers_with_active_orders
-        ).first()
-        
-        if available_washer:
-            order.washer = available_washer
-            order.status = 'assigned'
-            order.assigned_at = timezone.now()
-            order.save()
-            assigned_count += 1
-            
-            print(f"Auto-assigned order #{order.order_id} to {available_washer.full_name}")
-        else:
-            # No more available washers
-            break
-    
-    return assigned_count
+    return len(dispatch_pending_orders()['assigned'])
 
 
 def notify_client_order_assigned(order):
@@ -70,5 +345,4 @@ def notify_client_order_assigned(order):
     Can be extended to send email/SMS notifications.
     """
     # TODO: Implement email/SMS notification
-    print(f"Notification: Order #{order.order_id} assigned to {order.washer.full_name} for {order.client.email}")
-    pass
+    logger.info('Notification: Order #%s assigned to %s for %s', order.order_id, order.washer.full_name, order.client.email)
@@ -1,16 +1,23 @@
-from django.http import HttpResponse
+import logging
+
+from django.http import HttpResponse, JsonResponse
 from django.template import loader
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.mail import send_mail
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.utils import timezone
 from .forms import SignupForm, ForgotPasswordForm, ResetPasswordForm, VehicleForm, WashOrderForm, AppointmentForm, TimeSlotSelectionForm
 from .models import Client, PasswordResetToken, Vehicle, WashOrder, Appointment, TimeSlot
 from django.db import models
 
+
+logger = logging.getLogger(__name__)
+
+
 def clients(request):
   template = loader.get_template('myfirst.html')
   return HttpResponse(template.render())
@@ -414,52 +421,30 @@ def book_wash_view(request):
                 }
                 wash_order.price = prices.get(wash_order.wash_type, 15.00)
                 
-                # Try to assign an available washer
+                wash_order.status = 'pending'
+                wash_order.save()
+                
+                # Try to claim the best free washer by the dispatch washer
+                # policy; a washer grabbed by a concurrent booking just makes
+                # us try the next one
+                from .utils import ranked_free_washers, claim_order
                 from washers.models import Washer
                 try:
-                    # Debug: Check all washers
-                    all_washers = Washer.objects.all()
-                    print(f"DEBUG: Total washers in system: {all_washers.count()}")
-                    for w in all_washers:
-                        print(f"  - {w.full_name}: is_available={w.is_available}, status={w.status}")
+                    assigned_washer = None
+                    for washer in ranked_free_washers()[:5]:
+                        if claim_order(wash_order.order_id, washer.washer_id):
+                            assigned_washer = Washer.objects.get(washer_id=washer.washer_id)
+                            break
                     
-                    # Get washers who don't have any active orders
-                    washers_with_active_orders = WashOrder.objects.filter(
-                        status__in=['assigned', 'in_progress']
-                    ).values_list('washer_id', flat=True)
-                    print(f"DEBUG: Washers with active orders: {list(washers_with_active_orders)}")
-                    
-                    available_washers = Washer.objects.filter(
-                        is_available=True, 
-                        status='active'
-                    ).exclude(
-                        washer_id__in=washers_with_active_orders
-                    )
-                    print(f"DEBUG: Available washers found: {available_washers.count()}")
-                    
-                    available_washer = available_washers.first()
-                    
-                    if available_washer:
-                        wash_order.washer = available_washer
-                        wash_order.status = 'assigned'
-                        wash_order.assigned_at = timezone.now()
-                        
-                        print(f"DEBUG: Assigned order to {available_washer.full_name}")
-                        messages.success(request, f'Wash order booked successfully! Assigned to {available_washer.full_name}.')
+                    if assigned_washer:
+                        messages.success(request, f'Wash order booked successfully! Assigned to {assigned_washer.full_name}.')
                     else:
                         # No available washers - order will remain pending
-                        wash_order.status = 'pending'
-                        print(f"DEBUG: No available washers - order set to pending")
                         messages.info(request, 'Wash order booked successfully! All washers are currently busy. We will assign one as soon as possible.')
-                except Exception as e:
-                    # Log the error for debugging
-                    print(f"ERROR assigning washer: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    wash_order.status = 'pending'
+                except Exception:
+                    logger.exception('Assigning a washer to order #%s failed', wash_order.order_id)
                     messages.info(request, 'Wash order booked successfully! We will assign a washer soon.')
                 
-                wash_order.save()
                 return redirect('clients:track_order', order_id=wash_order.order_id)
         else:
             form = WashOrderForm(client=client)
@@ -633,6 +618,8 @@ def order_history_view(request):
 
 def schedule_appointment_view(request):
     """Schedule a new appointment with time slot selection"""
+    from .booking import book_appointment
+    
     if 'client_id' not in request.session:
         messages.error(request, 'Please log in to schedule an appointment.')
         return redirect('clients:login')
@@ -654,25 +641,28 @@ def schedule_appointment_view(request):
         selected_date = request.GET.get('selected_date') or request.POST.get('date')
         
         if request.method == 'POST':
-            print(f"DEBUG: POST data: {request.POST}")
-            print(f"DEBUG: Selected date from POST: {selected_date}")
             appointment_form = AppointmentForm(client=client, selected_date=selected_date, data=request.POST)
             
+            if appointment_form.is_valid() and appointment_form.waitlisted:
+                return _join_waitlist(request, client, appointment_form.cleaned_data)
+            
             if appointment_form.is_valid():
-                print("DEBUG: Form is valid")
-                appointment = appointment_form.save(commit=False)
-                appointment.client = client
-                appointment.save()
-                print(f"DEBUG: Appointment saved: {appointment.id}")
-                
-                # Create wash order from appointment
-                wash_order = appointment.create_wash_order()
-                print(f"DEBUG: Wash order created: {wash_order.order_id}")
-                
-                messages.success(request, f'Appointment scheduled successfully for {appointment.time_slot}!')
-                return redirect('clients:track_order', order_id=wash_order.order_id)
+                data = appointment_form.cleaned_data
+                try:
+                    # Reserves the spot and inserts the order and the
+                    # appointment in one transaction
+                    appointment = book_appointment(
+                        client, data['vehicle'], data['time_slot'],
+                        wash_type=data['wash_type'], special_instructions=data.get('special_instructions', '')
+                    )
+                except ValidationError:
+                    if data.get('join_waitlist'):
+                        return _join_waitlist(request, client, data)
+                    messages.error(request, 'Sorry, that time slot was just fully booked. Please pick another.')
+                else:
+                    messages.success(request, f'Appointment scheduled successfully for {appointment.time_slot}!')
+                    return redirect('clients:track_order', order_id=appointment.wash_order.order_id)
             else:
-                print(f"DEBUG: Form errors: {appointment_form.errors}")
                 messages.error(request, 'Please correct the errors below.')
         else:
             appointment_form = AppointmentForm(client=client, selected_date=selected_date)
@@ -680,32 +670,9 @@ def schedule_appointment_view(request):
         # Date selection form
         date_form = TimeSlotSelectionForm(initial={'selected_date': selected_date} if selected_date else None)
         
-        # Get available time slots for the selected date
-        available_slots = []
-        if selected_date:
-            from datetime import datetime
-            try:
-                date_obj = datetime.strptime(selected_date, '%Y-%m-%d').date()
-                # Get all active time slots for the date
-                all_slots = TimeSlot.objects.filter(
-                    date=date_obj,
-                    is_active=True
-                )
-                
-                # Filter out slots that are fully booked
-                available_slots = []
-                for slot in all_slots:
-                    booked_count = slot.appointments.filter(is_cancelled=False).count()
-                    if booked_count < slot.max_capacity:
-                        available_slots.append(slot)
-                print(f"DEBUG: Selected date: {selected_date}")
-                print(f"DEBUG: Date object: {date_obj}")
-                print(f"DEBUG: Available slots count: {len(available_slots)}")
-                for slot in available_slots[:3]:  # Show first 3 slots
-                    print(f"DEBUG: Slot: {slot.start_time}-{slot.end_time}, capacity: {slot.max_capacity}")
-            except ValueError as e:
-                print(f"DEBUG: Date parsing error: {e}")
-                pass
+        # Available time slots for the selected date - the same ones the
+        # form offers, so they are only looked up once
+        available_slots = appointment_form.available_slots if selected_date else []
         
         context = {
             'client_name': request.session.get('client_name', 'User'),
@@ -722,6 +689,92 @@ def schedule_appointment_view(request):
         return redirect('clients:login')
 
 
+def _join_waitlist(request, client, data):
+    """Put the client on the waitlist of the slot chosen in AppointmentForm"""
+    from .waitlist import join_waitlist
+    
+    entry, position = join_waitlist(
+        client, data['vehicle'], data['time_slot'],
+        wash_type=data['wash_type'], special_instructions=data.get('special_instructions', '')
+    )
+    messages.info(
+        request,
+        f'{entry.time_slot} is fully booked. You are number {position} on its waitlist and will be '
+        f'booked in automatically if a spot opens up.'
+    )
+    return redirect('clients:my_appointments')
+
+
+def availability_calendar_view(request):
+    """
+    JSON availability for a date range (?start=YYYY-MM-DD&end=YYYY-MM-DD),
+    so the date picker can grey out full days without loading each one
+    """
+    from datetime import datetime, timedelta
+    from .availability import get_range
+    
+    max_days = getattr(settings, 'AVAILABILITY_CALENDAR_MAX_DAYS', 92)
+    today = timezone.localdate()
+    try:
+        start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if request.GET.get('start') else today
+        end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date() if request.GET.get('end') else start + timedelta(days=30)
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be in YYYY-MM-DD format.'}, status=400)
+    
+    if end < start:
+        return JsonResponse({'error': 'end must not be before start.'}, status=400)
+    if (end - start).days >= max_days:
+        return JsonResponse({'error': f'At most {max_days} days can be requested at once.'}, status=400)
+    
+    now = timezone.now()
+    return JsonResponse({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'days': [day.as_dict(now) for day in get_range(start, end)],
+    })
+
+
+def next_available_view(request):
+    """
+    JSON list of the next open slots (?n=5&wash_type=basic&after=ISO datetime),
+    for booking the earliest opening without paging through dates
+    """
+    from datetime import datetime
+    from .scheduling import next_available_slots
+    
+    max_results = getattr(settings, 'NEXT_AVAILABLE_MAX_RESULTS', 20)
+    try:
+        n = int(request.GET.get('n', 5))
+        after = datetime.fromisoformat(request.GET['after']) if request.GET.get('after') else None
+    except ValueError:
+        return JsonResponse({'error': 'n must be a number and after an ISO 8601 datetime.'}, status=400)
+    if not 1 <= n <= max_results:
+        return JsonResponse({'error': f'n must be between 1 and {max_results}.'}, status=400)
+    if after is not None and timezone.is_naive(after):
+        after = timezone.make_aware(after)
+    
+    wash_type = request.GET.get('wash_type', 'basic')
+    try:
+        slots = next_available_slots(n, wash_type, after)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'wash_type': wash_type,
+        'slots': [
+            {
+                'slot': slot.slot_key,
+                'id': slot.pk,
+                'date': slot.date.isoformat(),
+                'start': slot.start_time.strftime('%H:%M'),
+                'end': slot.end_time.strftime('%H:%M'),
+                'free_minutes': slot.available_minutes,
+            }
+            for slot in slots
+        ],
+    })
+
+
 def my_appointments_view(request):
     """View client's appointments"""
     if 'client_id' not in request.session:
@@ -750,10 +803,17 @@ def my_appointments_view(request):
             time_slot__date__lt=timezone.now().date()
         ).select_related('time_slot', 'vehicle', 'wash_order').order_by('-time_slot__date', '-time_slot__start_time')[:10]
         
+        # Full slots the client is waiting on
+        waitlist_entries = client.waitlist_entries.filter(
+            status='waiting',
+            time_slot__date__gte=timezone.now().date()
+        ).select_related('time_slot', 'vehicle')
+        
         context = {
             'client_name': request.session.get('client_name', 'User'),
             'upcoming_appointments': upcoming_appointments,
             'past_appointments': past_appointments,
+            'waitlist_entries': waitlist_entries,
         }
         return render(request, 'clients/my_appointments.html', context)
         
@@ -813,9 +873,14 @@ def reschedule_appointment_view(request, appointment_id):
             form = AppointmentForm(client=client, selected_date=selected_date, data=request.POST, instance=appointment)
             
             if form.is_valid():
-                form.save()
-                messages.success(request, f'Appointment rescheduled to {appointment.time_slot}!')
-                return redirect('clients:my_appointments')
+                try:
+                    # Moves the booking: reserves the new slot, releases the old one
+                    form.save()
+                except ValidationError:
+                    messages.error(request, 'Sorry, that time slot was just fully booked. Please pick another.')
+                else:
+                    messages.success(request, f'Appointment rescheduled to {appointment.time_slot}!')
+                    return redirect('clients:my_appointments')
         else:
             form = AppointmentForm(client=client, selected_date=selected_date, instance=appointment)
         
@@ -880,8 +945,10 @@ def cancel_appointment_view(request, appointment_id):
         
         if request.method == 'POST':
             reason = request.POST.get('reason', 'Cancelled by client')
-            appointment.cancel_appointment(reason)
-            messages.success(request, 'Appointment cancelled successfully.')
+            if appointment.cancel_appointment(reason):
+                messages.success(request, 'Appointment cancelled successfully.')
+            else:
+                messages.warning(request, 'This appointment is already cancelled.')
             return redirect('clients:my_appointments')
         
         return redirect('clients:my_appointments')
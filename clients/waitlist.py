@@ -0,0 +1,223 @@
+# clients/waitlist.py
+"""
+Waitlist for fully booked time slots.
+
+A client who picks a full slot can join its waitlist (join_waitlist).
+Every spot given back - a cancelled, deleted or moved appointment, all of
+which go through TimeSlot.release_spot - queues its slot for promotion
+once the transaction commits. All slots released in one transaction are
+promoted together by promote_waitlist(): it takes the oldest entries
+whose washes fit each slot's free bay-minutes, reserves them all with one
+guarded UPDATE and inserts the wash orders and appointments in bulk
+(row by row on MySQL, whose bulk inserts return no keys), all in one
+transaction. A burst of cancellations therefore costs a fixed
+handful of queries per pass, not several per promoted entry. If a slot
+was booked directly since it was read, the batch reservation fails as a
+whole and the entries are reserved one at a time instead, so the others
+are still promoted.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import rollups
+from .models import Appointment, TimeSlot, WaitlistEntry, WashOrder, wash_minutes
+
+
+logger = logging.getLogger(__name__)
+
+# Slots released in this thread's open transaction, promoted on commit
+_local = threading.local()
+
+
+def join_waitlist(client, vehicle, time_slot, wash_type='basic', special_instructions=''):
+    """
+    Put the client on the slot's waitlist (once per slot; joining again
+    returns the existing entry). Returns (entry, position in line).
+    """
+    time_slot = TimeSlot.materialize(time_slot)
+    entry, _ = WaitlistEntry.objects.get_or_create(
+        client=client,
+        time_slot=time_slot,
+        status='waiting',
+        defaults={
+            'vehicle': vehicle,
+            'wash_type': wash_type,
+            'special_instructions': special_instructions,
+        }
+    )
+    position = WaitlistEntry.objects.filter(
+        Q(created_at__lt=entry.created_at) | Q(created_at=entry.created_at, id__lte=entry.id),
+        time_slot=time_slot,
+        status='waiting'
+    ).count()
+    return entry, position
+
+
+def spot_released(slot_id):
+    """Promote the slot's waitlist once the releasing transaction commits"""
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = set()
+    pending.add(slot_id)
+    # Each release registers a callback, but the first one to run takes
+    # every pending slot, so a burst in one transaction is one pass
+    transaction.on_commit(promote_pending)
+
+
+def promote_pending():
+    slot_ids = getattr(_local, 'pending', None)
+    if not slot_ids:
+        return
+    _local.pending = set()
+    try:
+        promote_waitlist(slot_ids)
+    except Exception:
+        logger.exception('Promoting the waitlist for slots %s failed', sorted(slot_ids))
+
+
+def promote_waitlist(slot_ids):
+    """
+    Fill the free bay-minutes of the given slots from their waitlists,
+    oldest entry first; an entry whose wash doesn't fit is passed over for
+    a later one that does. Entries whose client already holds a spot in
+    the slot are withdrawn instead. Returns the promoted entries.
+    """
+    from .availability import invalidate_day
+
+    # Most released slots have nobody waiting, so this first query only
+    # touches the waitlist table
+    entries = list(
+        WaitlistEntry.objects.filter(time_slot_id__in=slot_ids, status='waiting')
+        .select_related('client', 'vehicle').order_by('time_slot_id', 'created_at', 'id')
+    )
+    if not entries:
+        return []
+
+    # The waitlisted slots and the slots right after them, which long
+    # washes spill into, in one query
+    slots = TimeSlot.objects.filter(id__in={entry.time_slot_id for entry in entries}).in_bulk()
+    ends = {(slot.date, slot.end_time) for slot in slots.values()}
+    following = {
+        (row.date, row.start_time): row
+        for row in TimeSlot.objects.filter(
+            date__in={day for day, _ in ends}, start_time__in={end for _, end in ends}
+        )
+    }
+    entries = [entry for entry in entries if entry.time_slot_id in slots and slots[entry.time_slot_id].is_active]
+    if not entries:
+        return []
+    for entry in entries:
+        entry.time_slot = slots[entry.time_slot_id]
+
+    holding = set(
+        Appointment.objects.filter(
+            time_slot_id__in={entry.time_slot_id for entry in entries},
+            is_cancelled=False
+        ).values_list('time_slot_id', 'client_id')
+    )
+    # Spill slots are materialized in the same transaction as the bookings
+    with transaction.atomic():
+        free = {}
+        changes = defaultdict(lambda: [0, 0])
+        candidates = []
+        picked = []
+        withdrawn = []
+        for entry in entries:
+            slot = entry.time_slot
+            if (slot.id, entry.client_id) in holding:
+                entry.status = 'withdrawn'
+                withdrawn.append(entry)
+                continue
+            if slot.is_past:
+                continue
+
+            minutes = wash_minutes(entry.wash_type)
+            key = (slot.date, slot.end_time)
+            if minutes > slot.length_minutes and key not in following:
+                virtual = TimeSlot.virtual_at(*key)
+                following[key] = TimeSlot.materialize(virtual) if virtual else None
+            parts = slot.split(minutes, following.get(key))
+            if parts is None or any(not part.is_active for part, _ in parts):
+                continue
+            candidates.append((entry, minutes, parts))
+            if any(free.get(part.id, part.available_minutes) < taken for part, taken in parts):
+                continue
+
+            for part, taken in parts:
+                free[part.id] = free.get(part.id, part.available_minutes) - taken
+            for slot_id, (taken, bookings) in TimeSlot.booking_changes(parts).items():
+                changes[slot_id][0] += taken
+                changes[slot_id][1] += bookings
+            picked.append((entry, minutes))
+            holding.add((slot.id, entry.client_id))
+
+        now = timezone.now()
+        promoted = picked
+        if picked and not TimeSlot.change_bookings({slot_id: tuple(change) for slot_id, change in changes.items()}):
+            # A slot was booked directly since it was read, so the batch
+            # didn't fit; reserve entry by entry, oldest first, each
+            # guarded on its own, so the slots that still have room fill
+            promoted = [
+                (entry, minutes) for entry, minutes, parts in candidates
+                if TimeSlot.change_bookings(TimeSlot.booking_changes(parts))
+            ]
+
+        appointments = [
+            Appointment(
+                client=entry.client,
+                vehicle=entry.vehicle,
+                time_slot=entry.time_slot,
+                wash_type=entry.wash_type,
+                special_instructions=entry.special_instructions,
+                booked_minutes=minutes
+            )
+            for entry, minutes in promoted
+        ]
+        orders = [appointment.build_wash_order() for appointment in appointments]
+        # The minutes are reserved above, so saving an appointment doesn't
+        # reserve them again
+        for appointment in appointments:
+            appointment._loaded_spot = (appointment.time_slot_id, appointment.booked_minutes, appointment.wash_type)
+        # The waitlist rows point at the new appointments, so the inserts
+        # must return their keys. MySQL's bulk inserts don't, and the keys
+        # can't be worked out afterwards (with InnoDB's default interleaved
+        # auto-increment locking, one multi-row INSERT needn't get
+        # consecutive ids), so there each row is saved on its own
+        bulk = connection.features.can_return_rows_from_bulk_insert
+        if bulk:
+            WashOrder.objects.bulk_create(orders)
+            # bulk_create sends no post_save, so add the orders to the daily rollup here
+            rollups.record(rollups.order_changes(orders))
+        else:
+            for order in orders:
+                order.save()
+        for appointment, order in zip(appointments, orders):
+            appointment.wash_order = order
+        if bulk:
+            Appointment.objects.bulk_create(appointments)
+        else:
+            for appointment in appointments:
+                appointment.save()
+
+        promoted = [entry for entry, _ in promoted]
+        for entry, appointment in zip(promoted, appointments):
+            entry.status = 'promoted'
+            entry.appointment = appointment
+            entry.promoted_at = now
+        if promoted or withdrawn:
+            WaitlistEntry.objects.bulk_update(promoted + withdrawn, ['status', 'appointment', 'promoted_at'])
+
+        for day in {entry.time_slot.date for entry in promoted}:
+            transaction.on_commit(lambda day=day: invalidate_day(day))
+
+    if promoted:
+        logger.info(
+            'Waitlist: promoted %d entry(ies) into %d slot(s)',
+            len(promoted), len({entry.time_slot_id for entry in promoted})
+        )
+    return promoted
@@ -0,0 +1,200 @@
+# clients/washer_stats.py
+"""
+Per-washer rating and service time aggregates.
+
+Ratings are two counters on the washer, rating_count and rating_total,
+moved with F() updates as reviews are written and deleted, so an average
+rating is a division rather than an AVG over the reviews table.
+
+Service times are a histogram (WasherServiceTime): for each washer, how
+many completed orders took each whole number of minutes. A completion
+adds one to its bucket once its transaction commits, so the median and
+90th percentile come from a few dozen rows per washer instead of every
+order's completed_at - started_at.
+
+rebuild() recomputes both from the reviews and orders and repairs any
+drift; rebuild_washer_pool runs it.
+"""
+import logging
+import math
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from .models import Review, WashOrder, WasherServiceTime
+
+
+logger = logging.getLogger(__name__)
+
+
+def service_minutes(started_at, completed_at):
+    """The histogram bucket of a completed order: its service time in whole minutes"""
+    return max(0, round((completed_at - started_at).total_seconds() / 60))
+
+
+def percentile(buckets, pct):
+    """
+    Nearest-rank percentile of [(minutes, orders)] sorted by minutes, or
+    None when there are no orders
+    """
+    total = sum(orders for _, orders in buckets)
+    if not total:
+        return None
+    rank = max(1, math.ceil(pct / 100 * total))
+    seen = 0
+    for minutes, orders in buckets:
+        seen += orders
+        if seen >= rank:
+            return minutes
+    return buckets[-1][0]
+
+
+def summarize_service_times(buckets):
+    """{'orders', 'avg', 'p50', 'p90'} (minutes) from [(minutes, orders)] sorted by minutes"""
+    orders = sum(n for _, n in buckets)
+    return {
+        'orders': orders,
+        'avg': round(sum(minutes * n for minutes, n in buckets) / orders) if orders else None,
+        'p50': percentile(buckets, 50),
+        'p90': percentile(buckets, 90),
+    }
+
+
+def service_times(washer_ids=None):
+    """{washer_id: summarize_service_times()} for the washers (all by default), from one query"""
+    rows = WasherServiceTime.objects.filter(orders__gt=0)
+    if washer_ids is not None:
+        rows = rows.filter(washer_id__in=washer_ids)
+    buckets = defaultdict(list)
+    for washer_id, minutes, orders in rows.order_by('minutes').values_list('washer_id', 'minutes', 'orders'):
+        buckets[washer_id].append((minutes, orders))
+    return {washer_id: summarize_service_times(washer_buckets) for washer_id, washer_buckets in buckets.items()}
+
+
+def overall_service_time():
+    """summarize_service_times() across every washer, from one grouped query"""
+    buckets = list(
+        WasherServiceTime.objects.filter(orders__gt=0).values('minutes')
+        .annotate(total=Sum('orders')).order_by('minutes').values_list('minutes', 'total')
+    )
+    return summarize_service_times(buckets)
+
+
+def overall_rating():
+    """Mean rating over every washer's reviews, or None without any"""
+    from washers.models import Washer
+
+    totals = Washer.objects.aggregate(count=Sum('rating_count'), total=Sum('rating_total'))
+    return round(totals['total'] / totals['count'], 1) if totals['count'] else None
+
+
+def adjust_rating(washer_id, rating, sign=1):
+    """Add (sign=1) or take away (sign=-1) one review's rating on the washer"""
+    from washers.models import Washer
+
+    washers = Washer.objects.filter(washer_id=washer_id)
+    if sign < 0:
+        washers = washers.filter(rating_count__gte=1, rating_total__gte=rating)
+    washers.update(rating_count=F('rating_count') + sign, rating_total=F('rating_total') + sign * rating)
+
+
+def refresh_rating(washer_id):
+    """Recount one washer's rating counters from their reviews"""
+    from washers.models import Washer
+
+    totals = Review.objects.filter(washer_id=washer_id).aggregate(count=Count('review_id'), total=Sum('rating'))
+    Washer.objects.filter(washer_id=washer_id).update(
+        rating_count=totals['count'] or 0, rating_total=totals['total'] or 0
+    )
+
+
+def _add_to_bucket(washer_id, minutes, orders):
+    return WasherServiceTime.objects.filter(washer_id=washer_id, minutes=minutes).update(
+        orders=F('orders') + orders
+    )
+
+
+def adjust_service_time(washer_id, minutes, orders=1):
+    """Add orders (negative to take away) to the washer's bucket"""
+    if _add_to_bucket(washer_id, minutes, orders) or orders <= 0:
+        return
+    try:
+        with transaction.atomic():
+            WasherServiceTime.objects.create(washer_id=washer_id, minutes=minutes, orders=orders)
+    except IntegrityError:
+        # Another transaction created the bucket since the update missed it
+        _add_to_bucket(washer_id, minutes, orders)
+
+
+def _add_completion(order_id):
+    order = WashOrder.objects.filter(order_id=order_id).values(
+        'washer_id', 'status', 'started_at', 'completed_at'
+    ).first()
+    if order and order['status'] == 'completed' and order['washer_id'] and \
+            order['started_at'] and order['completed_at']:
+        adjust_service_time(order['washer_id'], service_minutes(order['started_at'], order['completed_at']))
+
+
+def record_completion(order_id):
+    """Count a completed order in its washer's histogram once the transaction commits"""
+    def run():
+        try:
+            _add_completion(order_id)
+        except Exception:
+            logger.exception('Updating washer service times for order #%s failed', order_id)
+    transaction.on_commit(run)
+
+
+def rebuild(fix=True):
+    """
+    Recompute every washer's rating counters and service time histogram
+    from the reviews and completed orders, and (optionally) repair the ones
+    that drifted.
+
+    Returns a list of (washer_id, what) tuples for drifted washers, where
+    what is 'rating' or 'service_times'.
+    """
+    from washers.models import Washer
+
+    ratings = defaultdict(lambda: (0, 0))
+    reviews = Review.objects.filter(washer__isnull=False).values('washer_id').annotate(
+        count=Count('review_id'), total=Sum('rating')
+    ).values_list('washer_id', 'count', 'total')
+    for washer_id, count, total in reviews:
+        ratings[washer_id] = (count, total)
+
+    actual_times = defaultdict(Counter)
+    timed = WashOrder.objects.filter(
+        status='completed', washer__isnull=False, started_at__isnull=False, completed_at__isnull=False
+    ).values_list('washer_id', 'started_at', 'completed_at')
+    for washer_id, started_at, completed_at in timed.iterator():
+        actual_times[washer_id][service_minutes(started_at, completed_at)] += 1
+
+    stored_times = defaultdict(Counter)
+    for washer_id, minutes, orders in WasherServiceTime.objects.filter(orders__gt=0).values_list(
+        'washer_id', 'minutes', 'orders'
+    ):
+        stored_times[washer_id][minutes] = orders
+
+    drifted = []
+    for washer_id, count, total in Washer.objects.values_list('washer_id', 'rating_count', 'rating_total'):
+        if (count, total) != ratings[washer_id]:
+            drifted.append((washer_id, 'rating'))
+        if stored_times[washer_id] != actual_times[washer_id]:
+            drifted.append((washer_id, 'service_times'))
+
+    if fix and drifted:
+        with transaction.atomic():
+            for washer_id, what in drifted:
+                if what == 'rating':
+                    count, total = ratings[washer_id]
+                    Washer.objects.filter(washer_id=washer_id).update(rating_count=count, rating_total=total)
+                else:
+                    WasherServiceTime.objects.filter(washer_id=washer_id).delete()
+                    WasherServiceTime.objects.bulk_create([
+                        WasherServiceTime(washer_id=washer_id, minutes=minutes, orders=orders)
+                        for minutes, orders in actual_times[washer_id].items()
+                    ])
+
+    return drifted
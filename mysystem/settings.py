@@ -167,6 +167,82 @@ EMAIL_SUBJECT_PREFIX = '[Car Wash] '
 # Email timeout settings
 EMAIL_TIMEOUT = 60
 
+# Appointment orders are held out of the dispatch queue until this many
+# minutes before their time slot starts
+APPOINTMENT_RELEASE_WINDOW_MINUTES = 60
+
+# Scoring policies used by the auto-assign dispatcher (see clients/dispatch.py).
+# Use 'clients.dispatch.FifoOrderPolicy' / 'clients.dispatch.SeniorityWasherPolicy'
+# for plain first-come first-served assignment.
+DISPATCH_ORDER_POLICY = 'clients.dispatch.PriorityOrderPolicy'
+DISPATCH_WASHER_POLICY = 'clients.dispatch.BalancedWasherPolicy'
+# 'greedy' pairs one order at a time; 'optimal' solves the whole batch as an
+# assignment problem with scipy (see requirements.txt). Without scipy only
+# batches up to clients.matching.PURE_PYTHON_MAX_CELLS are solved; bigger ones
+# are matched greedily, with a warning in the log
+DISPATCH_MATCHING = 'greedy'
+
+# Capacity-freeing events (completions, cancellations, washers coming on duty)
+# within this many seconds share one auto-assign pass; 0 dispatches at once
+DISPATCH_COALESCE_SECONDS = 2
+# The coalesced pass runs on a timer thread; set False where workers run no
+# threads (uWSGI without --enable-threads, PythonAnywhere) and schedule the
+# dispatch_tick command instead (see clients/events.py)
+DISPATCH_TICKER_TIMER = True
+
+# Cache used for per-day slot availability (clients/availability.py). Entries
+# are keyed by a per-date version that bookings bump, so with several worker
+# processes point this at a shared backend (FileBasedCache, Redis, ...) for
+# every worker to see the bumps, as settings_production does.
+#
+# The analytics page widgets (admin/analytics_cache.py) live in their own
+# file-based cache, shared by every worker process and warm_analytics_cache
+# run on the host, so a warmed widget and the refresh lock are seen by all.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carwash-availability',
+    },
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'analytics',
+    },
+}
+
+# Availability calendar: a cached day is rebuilt when its version is bumped
+# (booking, cancellation, slot change) or after this many seconds
+AVAILABILITY_CACHE_SECONDS = 300
+AVAILABILITY_CALENDAR_MAX_DAYS = 92
+
+# Analytics page widgets (admin/analytics_cache.py), per date range: each is
+# served as is for its fresh seconds, then for its stale seconds more while
+# one background refresh runs. Override a widget's policy with
+# {'kpis': (fresh, stale), ...}. A miss waits up to WAIT seconds for a
+# refresh already running.
+ANALYTICS_WIDGET_CACHE_SECONDS = {}
+ANALYTICS_CACHE = 'analytics'  # CACHES alias the widgets are kept in
+ANALYTICS_CACHE_WAIT_SECONDS = 5
+
+# "Next available" slot finder: most results per request, and how far ahead
+# it looks for template slots when fewer open rows exist than were asked for
+NEXT_AVAILABLE_MAX_RESULTS = 20
+NEXT_AVAILABLE_SEARCH_DAYS = 365
+
+# How long each wash type keeps a bay busy, in minutes. Slot capacity is
+# bays (max_capacity) x slot length in bay-minutes; a wash longer than its
+# slot runs on into the slot that starts when it ends, so make slots at
+# least half as long as the longest wash.
+WASH_DURATION_MINUTES = {
+    'basic': 20,
+    'premium': 45,
+    'deluxe': 90,
+}
+
+# Offer the schedule templates' slots without pre-creating TimeSlot rows; a
+# row is inserted when a slot is first booked. With this off, only slots
+# created by generate_time_slots (or by hand) can be booked.
+VIRTUAL_TIME_SLOTS = True
+
 # Custom login URL for admin
 LOGIN_URL = '/carwash-admin/login/'
 LOGIN_REDIRECT_URL = '/carwash-admin/dashboard/'
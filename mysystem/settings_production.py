@@ -34,6 +34,36 @@ DATABASES = {
 #     }
 # }
 
+# The slot availability versions (clients/availability.py) must be shared by
+# every worker process, or a booking in one leaves the others serving the old
+# availability until their entries expire
+CACHES = {
+    **CACHES,
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'availability',
+    },
+}
+
+# PythonAnywhere's workers don't run the dispatch ticker's timer thread;
+# schedule `python manage.py dispatch_tick` (or run it with --every 30 as
+# an always-on task) to pick up coalesced dispatch passes
+DISPATCH_TICKER_TIMER = False
+
+# Dispatch, waitlist and rollup messages go to the server log (stderr);
+# errors are logged with their tracebacks
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'clients': {'handlers': ['console'], 'level': 'INFO'},
+        'admin': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Email configuration for production
 # Configure with your actual SMTP settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
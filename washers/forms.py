@@ -155,7 +155,7 @@ class AdminAddWasherForm(forms.ModelForm):
 
     class Meta:
         model = Washer
-        fields = ['email', 'first_name', 'last_name', 'phone', 'hourly_rate', 'is_available', 'status']
+        fields = ['email', 'first_name', 'last_name', 'phone', 'hourly_rate', 'max_concurrent_orders', 'is_available', 'status']
         widgets = {
             'email': forms.EmailInput(attrs={
                 'placeholder': 'Email Address',
@@ -172,6 +172,10 @@ class AdminAddWasherForm(forms.ModelForm):
                 'class': 'form-control',
                 'required': True
             }),
+            'max_concurrent_orders': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': '1'
+            }),
             'is_available': forms.CheckboxInput(attrs={
                 'class': 'form-check-input'
             }),
@@ -183,6 +187,7 @@ class AdminAddWasherForm(forms.ModelForm):
             'email': 'Enter a valid email address for the staff member',
             'first_name': 'Staff member\'s first name',
             'last_name': 'Staff member\'s last name',
+            'max_concurrent_orders': 'How many cars this staff member can work on at once',
             'is_available': 'Check if the staff member is available for work',
             'status': 'Set the current status of the staff member'
         }
@@ -414,7 +419,7 @@ class AdminEditWasherForm(forms.ModelForm):
 
     class Meta:
         model = Washer
-        fields = ['email', 'first_name', 'last_name', 'phone', 'hourly_rate', 'is_available', 'status']
+        fields = ['email', 'first_name', 'last_name', 'phone', 'hourly_rate', 'max_concurrent_orders', 'is_available', 'status']
         widgets = {
             'email': forms.EmailInput(attrs={
                 'placeholder': 'Email Address',
@@ -431,6 +436,10 @@ class AdminEditWasherForm(forms.ModelForm):
                 'class': 'form-control',
                 'required': True
             }),
+            'max_concurrent_orders': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': '1'
+            }),
             'is_available': forms.CheckboxInput(attrs={
                 'class': 'form-check-input'
             }),
@@ -442,6 +451,7 @@ class AdminEditWasherForm(forms.ModelForm):
             'email': 'Enter a valid email address for the staff member',
             'first_name': 'Staff member\'s first name',
             'last_name': 'Staff member\'s last name',
+            'max_concurrent_orders': 'How many cars this staff member can work on at once',
             'is_available': 'Check if the staff member is available for work',
             'status': 'Set the current status of the staff member'
         }
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.13 on 2026-10-17 17:22
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_active_order_counts(apps, schema_editor):
+    """Seed the counter from the orders each washer is currently working"""
+    Washer = apps.get_model('washers', 'Washer')
+
+    counts = Washer.objects.annotate(
+        actual=Count('washorder', filter=Q(washorder__status__in=['assigned', 'in_progress']))
+    ).filter(actual__gt=0).values_list('washer_id', 'actual')
+
+    for washer_id, actual in counts:
+        Washer.objects.filter(washer_id=washer_id).update(active_order_count=actual)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('washers', '0002_auto_20251028_2250'),
+        ('clients', '0004_merge_20251125_2043'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='washer',
+            name='active_order_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='washer',
+            index=models.Index(fields=['is_available', 'status', 'active_order_count'], name='washers_free_pool_idx'),
+        ),
+        migrations.RunPython(populate_active_order_counts, migrations.RunPython.noop),
+    ]
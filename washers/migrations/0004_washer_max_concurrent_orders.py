@@ -0,0 +1,18 @@
+# Generated by Django 5.1.13 on 2026-10-17 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('washers', '0003_washer_active_order_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='washer',
+            name='max_concurrent_orders',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.13 on 2026-10-17 18:14
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_ratings(apps, schema_editor):
+    """Seed the rating counters from the reviews each washer has"""
+    Washer = apps.get_model('washers', 'Washer')
+    Review = apps.get_model('clients', 'Review')
+
+    ratings = Review.objects.filter(washer__isnull=False).values('washer_id').annotate(
+        count=Count('review_id'), total=Sum('rating')
+    ).values_list('washer_id', 'count', 'total')
+
+    for washer_id, count, total in ratings:
+        Washer.objects.filter(washer_id=washer_id).update(rating_count=count, rating_total=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('washers', '0004_washer_max_concurrent_orders'),
+        ('clients', '0004_merge_20251125_2043'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='washer',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='washer',
+            name='rating_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
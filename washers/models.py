@@ -1,6 +1,13 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.hashers import make_password, check_password
 
+
+# Counters kept up to date with F() updates elsewhere, which a full save of
+# a stale instance must not overwrite
+MAINTAINED_FIELDS = ('active_order_count', 'rating_count', 'rating_total')
+
+
 class Washer(models.Model):
     STATUS_CHOICES = [
         ('active', 'Active'),
@@ -18,9 +25,22 @@ class Washer(models.Model):
     hourly_rate = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     date_hired = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    # Orders currently assigned or in progress - maintained by WashOrder, see
+    # the rebuild_washer_pool command if it ever drifts
+    active_order_count = models.PositiveIntegerField(default=0)
+    # How many orders the washer (crew) can work at once, e.g. multi-bay sites
+    max_concurrent_orders = models.PositiveIntegerField(default=1)
+    # Reviews of the washer's orders: how many and their ratings summed -
+    # maintained by clients.washer_stats, repaired by rebuild_washer_pool
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'washers'
+        indexes = [
+            # "Who is free right now" lookups
+            models.Index(fields=['is_available', 'status', 'active_order_count'], name='washers_free_pool_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -29,31 +49,84 @@ class Washer(models.Model):
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Read from __dict__ so deferred fields aren't fetched one by one
+        loaded = instance.__dict__
+        instance._loaded_on_duty = bool(loaded.get('is_available')) and loaded.get('status') == 'active'
+        instance._loaded_capacity = loaded.get('max_concurrent_orders')
+        return instance
+    
+    @property
+    def is_on_duty(self):
+        """Available and active, i.e. eligible for new orders"""
+        return self.is_available and self.status == 'active'
+    
+    def save(self, *args, **kwargs):
+        """Never write back stale maintained counters from a full save"""
+        from clients.events import capacity_freed
+        
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in MAINTAINED_FIELDS
+            ]
+        
+        # New washers, washers coming back on duty and washers given more
+        # capacity can take pending orders
+        came_on_duty = self.is_on_duty and not getattr(self, '_loaded_on_duty', False)
+        loaded_capacity = getattr(self, '_loaded_capacity', None)
+        capacity_raised = loaded_capacity is not None and self.max_concurrent_orders > loaded_capacity
+        super().save(*args, **kwargs)
+        self._loaded_on_duty = self.is_on_duty
+        self._loaded_capacity = self.max_concurrent_orders
+        
+        if came_on_duty or (capacity_raised and self.is_on_duty):
+            reason = 'washer_on_duty' if came_on_duty else 'capacity_raised'
+            capacity_freed.send(sender=Washer, washer_id=self.washer_id, reason=reason)
+    
+    @staticmethod
+    def reserve_order_slot(washer_id):
+        """
+        Take one order slot if the washer has spare capacity. A single
+        guarded UPDATE, so concurrent reservations can't overfill a washer.
+        Returns True if the slot was taken.
+        """
+        return Washer.objects.filter(
+            washer_id=washer_id,
+            active_order_count__lt=F('max_concurrent_orders')
+        ).update(active_order_count=F('active_order_count') + 1) == 1
+    
+    @staticmethod
+    def adjust_active_order_count(washer_id, delta):
+        """Atomically add delta to a washer's active order counter"""
+        washers = Washer.objects.filter(washer_id=washer_id)
+        if delta < 0:
+            washers = washers.filter(active_order_count__gte=-delta)
+        return washers.update(active_order_count=F('active_order_count') + delta)
+    
+    @property
+    def average_rating(self):
+        """Mean review rating, or None before the first review"""
+        return round(self.rating_total / self.rating_count, 1) if self.rating_count else None
+    
     @property
     def has_active_orders(self):
         """Check if washer has any active orders (assigned or in_progress)"""
-        try:
-            from clients.models import WashOrder
-            return WashOrder.objects.filter(
-                washer=self,
-                status__in=['assigned', 'in_progress']
-            ).exists()
-        except:
-            return False
+        return self.active_order_count > 0
     
     @property
     def active_orders_count(self):
         """Get count of active orders for this washer"""
-        try:
-            from clients.models import WashOrder
-            return WashOrder.objects.filter(
-                washer=self,
-                status__in=['assigned', 'in_progress']
-            ).count()
-        except:
-            return 0
+        return self.active_order_count
+    
+    @property
+    def has_spare_capacity(self):
+        """Check if washer can take another order"""
+        return self.active_order_count < self.max_concurrent_orders
     
     @property
     def is_truly_available(self):
-        """Check if washer is available and has no active orders"""
-        return self.is_available and not self.has_active_orders
+        """Check if washer is available and has room for another order"""
+        return self.is_available and self.has_spare_capacity
@@ -144,21 +144,17 @@ def start_wash_view(request, order_id):
         washer = Washer.objects.get(washer_id=washer_id)
         
         from clients.models import WashOrder
-        # Get the order and make sure it's assigned to this washer
-        order = WashOrder.objects.get(order_id=order_id, washer=washer, status='assigned')
-        
-        # Start the wash
-        order.status = 'in_progress'
-        order.started_at = timezone.now()
-        order.save()
-        
-        messages.success(request, f'Started washing {order.vehicle}!')
+        from clients.transitions import start_order
+        # Only matches if the order is assigned to this washer
+        if start_order(order_id, washer_id=washer.washer_id):
+            order = WashOrder.objects.select_related('vehicle').get(order_id=order_id)
+            messages.success(request, f'Started washing {order.vehicle}!')
+        else:
+            messages.error(request, 'Order not found or not assigned to you.')
         
     except Washer.DoesNotExist:
         messages.error(request, 'Washer account not found.')
         return redirect('washers:auth')
-    except WashOrder.DoesNotExist:
-        messages.error(request, 'Order not found or not assigned to you.')
     except Exception as e:
         messages.error(request, f'Error starting wash: {str(e)}')
     
@@ -175,25 +171,22 @@ def complete_wash_view(request, order_id):
         washer = Washer.objects.get(washer_id=washer_id)
         
         from clients.models import WashOrder
-        # Get the order and make sure it's assigned to this washer
-        order = WashOrder.objects.get(order_id=order_id, washer=washer, status='in_progress')
-        
-        # Complete the wash
-        order.status = 'completed'
-        order.completed_at = timezone.now()
-        order.save()
-        
-        # Make washer available again
-        washer.is_available = True
-        washer.save()
-        
-        # Send notification to client (optional - can be implemented later)
-        messages.success(request, f'Completed washing {order.vehicle}! You are now available for new orders.')
+        from clients.transitions import complete_order
+        # Only matches if this washer's order is in progress
+        if complete_order(order_id, washer_id=washer.washer_id):
+            # Make washer available again
+            if not washer.is_available:
+                washer.is_available = True
+                washer.save(update_fields=['is_available'])
+            
+            # Send notification to client (optional - can be implemented later)
+            order = WashOrder.objects.select_related('vehicle').get(order_id=order_id)
+            messages.success(request, f'Completed washing {order.vehicle}! You are now available for new orders.')
+        else:
+            messages.error(request, 'Order not found or not in progress.')
         
     except Washer.DoesNotExist:
         messages.error(request, 'Washer account not found.')
-    except WashOrder.DoesNotExist:
-        messages.error(request, 'Order not found or not in progress.')
     except Exception as e:
         messages.error(request, f'Error completing wash: {str(e)}')
     
@@ -211,7 +204,7 @@ def toggle_availability_view(request):
         
         # Toggle availability
         washer.is_available = not washer.is_available
-        washer.save()
+        washer.save(update_fields=['is_available'])
         
         status = "available" if washer.is_available else "unavailable"
         messages.success(request, f'You are now {status} for new orders.')